@@ -1,17 +1,37 @@
+import json
 import socket
 import threading
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import cv2
 import numpy as np
 import time
 import os
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime
+
+# Shared modules from the camera service
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pi_cam_service_py311"))
+from retention import RetentionIndex
+from timelapse import TimelapseWriter
 
 
 UPSTREAM_HOST = "raspberrypi"
 UPSTREAM_PORT = 8080
 UPSTREAM_PATH = "/stream"
 
+# ----- Cameras: name -> (host, port), or name=host[:port] on the command line -----
+CAMERAS = {UPSTREAM_HOST: (UPSTREAM_HOST, UPSTREAM_PORT)}
+UPSTREAM_TIMEOUT_S = 30           # no data for this long: reconnect
+RECONNECT_MIN_S = 1               # reconnect backoff, doubled after each failure
+RECONNECT_MAX_S = 30
+MAX_PART_BYTES = 16 * 1024 * 1024 # parser buffer limit without a complete part
+
+# ----- Mosaic of all cameras (/mosaic/stream) -----
+MOSAIC_FPS = 1                    # composed only while someone watches
+MOSAIC_TILE = (320, 240)
+MOSAIC_COLUMNS = 0                # 0 = square-ish grid
+MOSAIC_STALE_S = 10               # tile marked OFFLINE without a frame for this long
+
 BOUNDARY = b"--frame"
 
 # ----- Configurable periodic saver -----
@@ -21,59 +41,84 @@ SAVE_INTERVAL_MIN = 5             # save every 5 minutes
 SAVE_HOURLY_INTERVAL = 60         # save hourly image
 SAVE_5MIN_RETENTION_HOURS = 24    # 5-min images retention
 SAVE_HOURLY_RETENTION_DAYS = 28   # hourly images retention
-
+SAVE_MAX_MB = 0                   # byte quota for SAVE_DIR (0 = no quota)
+SAVE_INDEX_FILE = "retention.sqlite"
+
+# ----- Daily timelapse of the 5-minute saves, in SAVE_DIR/<camera name>/timelapse -----
+TIMELAPSE = {
+    "enable": True,
+    "width": 1280,                # 0 = keep the frame size; frames are only scaled down
+    "height": 0,                  # 0 = keep the aspect ratio
+    "quality": 85,
+    "deflicker": True,            # scale brightness towards the running mean of X-Dark-Score
+    "deflicker_alpha": 0.2,
+    "max_gain": 2.0,
+    "keep_days": 60,              # days of timelapse kept (0 = forever)
+    "max_mb": 2048,               # size cap of the timelapse directory (0 = none)
+}
+
+retention = None
 if SAVE_PERIODIC:
     os.makedirs(SAVE_DIR, exist_ok=True)
+    retention = RetentionIndex(
+        os.path.join(SAVE_DIR, SAVE_INDEX_FILE),
+        {
+            "5min": SAVE_5MIN_RETENTION_HOURS * 3600,
+            "hourly": SAVE_HOURLY_RETENTION_DAYS * 86400,
+        },
+        max_bytes=SAVE_MAX_MB * 1024 * 1024,
+        evict_order=["5min", "hourly"],
+    )
+    # Index files saved by earlier versions (one directory scan, only when the index is empty)
+    retention.adopt(
+        SAVE_DIR,
+        lambda name: "5min" if name.startswith("frame_5min_")
+        else "hourly" if name.startswith("frame_hourly_")
+        else None
+    )
 
-# Keep track of last save times
-_last_5min_save = None
-_last_hourly_save = None
+# ----- Overlay configuration -----
+circle_radius = 18
+circle_margin = 12
+circle_colors = {"day": (0, 255, 255), "night": (139, 0, 0)}  # BGR
 
-def draw_overlay(img, headers):
-    """Draw metadata overlay on image with parameterizable fonts, colors, sizes, and GitHub link."""
+circle_label_font = cv2.FONT_HERSHEY_SIMPLEX
+circle_label_scale = 0.6
+circle_label_thickness = 1
+circle_label_color = (255, 255, 255)  # white
 
-    h, w, _ = img.shape
+dark_text_font = cv2.FONT_HERSHEY_SIMPLEX
+dark_text_scale = 0.6
+dark_text_thickness = 1
+dark_text_color = (255, 255, 255)
 
-    # ----- Overlay configuration -----
-    circle_radius = 18
-    circle_margin = 12
-    circle_colors = {"day": (0, 255, 255), "night": (139, 0, 0)}  # BGR
-
-    circle_label_font = cv2.FONT_HERSHEY_SIMPLEX
-    circle_label_scale = 0.6
-    circle_label_thickness = 1
-    circle_label_color = (255, 255, 255)  # white
-
-    dark_text_font = cv2.FONT_HERSHEY_SIMPLEX
-    dark_text_scale = 0.6
-    dark_text_thickness = 1
-    dark_text_color = (255, 255, 255)
-
-    hud_font = cv2.FONT_HERSHEY_SIMPLEX
-    hud_scale = 0.6
-    hud_thickness = 1
-    hud_color_day = (255, 255, 255)
-    hud_color_night = (0, 255, 0)
-    hud_line_spacing = 30
-    hud_start_y = 25
-    hud_start_x = 10
-
-    # GitHub link watermark
-    link_font = cv2.FONT_HERSHEY_SIMPLEX
-    link_scale = 0.7
-    link_thickness = 1
-    link_color = (200, 200, 200)
-    link_margin = 10
-    link_text = "https://github.com/djeanner/cameraProject"
+hud_font = cv2.FONT_HERSHEY_SIMPLEX
+hud_scale = 0.6
+hud_thickness = 1
+hud_color_day = (255, 255, 255)
+hud_color_night = (0, 255, 0)
+hud_line_spacing = 30
+hud_start_y = 25
+hud_start_x = 10
 
-    # ----- Parse metadata -----
-    frame_id = headers.get("X-Frame-Id", "?")
-    dark_score = float(headers.get("X-Dark-Score", 0))
-    night = headers.get("X-Night", "0") == "1"
-    ts = headers.get("X-Timestamp", "?")
+# GitHub link watermark
+link_font = cv2.FONT_HERSHEY_SIMPLEX
+link_scale = 0.7
+link_thickness = 1
+link_color = (200, 200, 200)
+link_margin = 10
+link_text = "https://github.com/djeanner/cameraProject"
 
+JPEG_QUALITY = 85
+
+
+def _indicator_center(w):
+    return (w - circle_margin - circle_radius, circle_margin + circle_radius)
+
+
+def _draw_indicator(img, night):
     # ----- Day / Night indicator -----
-    center = (w - circle_margin - circle_radius, circle_margin + circle_radius)
+    center = _indicator_center(img.shape[1])
     color = circle_colors["night"] if night else circle_colors["day"]
     label = "NIGHT" if night else "DAY"
 
@@ -89,7 +134,87 @@ def draw_overlay(img, headers):
         cv2.LINE_AA
     )
 
+
+def _draw_watermark(img, night):
+    # ----- GitHub link watermark (bottom-left) -----
+    cv2.putText(
+        img,
+        link_text,
+        (link_margin, img.shape[0] - link_margin),
+        link_font,
+        link_scale,
+        link_color,
+        link_thickness,
+        cv2.LINE_AA
+    )
+
+
+class OverlayLayers:
+    """
+    Static overlay elements (watermark, day/night indicator) rendered once
+    per frame size and day/night state. Each element is kept as a crop of
+    its bounding box (premultiplied color and inverse alpha), so applying
+    them blends those boxes only instead of rasterizing text every frame.
+    """
+
+    elements = (_draw_watermark, _draw_indicator)
+
+    def __init__(self):
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def _render(self, h, w, night):
+        crops = []
+        for draw in self.elements:
+            # Drawn over black: color * alpha; over white, the difference gives 255 * (1 - alpha)
+            black = np.zeros((h, w, 3), np.uint8)
+            white = np.full((h, w, 3), 255, np.uint8)
+            draw(black, night)
+            draw(white, night)
+            inv_alpha = white - black
+            drawn = (inv_alpha < 255).any(axis=2).astype(np.uint8)
+            if not drawn.any():
+                continue
+            x, y, bw, bh = cv2.boundingRect(drawn)
+            crops.append((
+                y, y + bh, x, x + bw,
+                black[y:y + bh, x:x + bw].copy(),
+                inv_alpha[y:y + bh, x:x + bw].astype(np.uint16),
+            ))
+        return crops
+
+    def apply(self, img, night):
+        h, w = img.shape[:2]
+        key = (h, w, night)
+        with self.lock:
+            layers = self.cache.get(key)
+            if layers is None:
+                layers = self.cache[key] = self._render(h, w, night)
+        for y0, y1, x0, x1, color, inv_alpha in layers:
+            roi = img[y0:y1, x0:x1]
+            roi[:] = (roi * inv_alpha // 255).astype(np.uint8) + color
+        return img
+
+
+overlay_layers = OverlayLayers()
+
+
+def draw_overlay(img, headers):
+    """Draw metadata overlay on image with parameterizable fonts, colors, sizes, and GitHub link."""
+
+    h, w, _ = img.shape
+
+    # ----- Parse metadata -----
+    frame_id = headers.get("X-Frame-Id", "?")
+    dark_score = float(headers.get("X-Dark-Score", 0))
+    night = headers.get("X-Night", "0") == "1"
+    ts = headers.get("X-Timestamp", "?")
+
+    # Static parts: watermark and day/night indicator
+    overlay_layers.apply(img, night)
+
     # Dark score
+    center = _indicator_center(w)
     cv2.putText(
         img,
         f"Brightness {dark_score:.1f}",
@@ -120,39 +245,300 @@ def draw_overlay(img, headers):
         )
         y += hud_line_spacing
 
-    # ----- GitHub link watermark (bottom-left) -----
-    cv2.putText(
-        img,
-        link_text,
-        (link_margin, h - link_margin),
-        link_font,
-        link_scale,
-        link_color,
-        link_thickness,
-        cv2.LINE_AA
-    )
-
     return img
 
-class OverlayProxyHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path != "/stream":
-            self.send_error(404)
+class MultipartParser:
+    """
+    Incremental multipart/x-mixed-replace parser: feed() socket chunks of any
+    size and get back the complete parts as (headers, body). Uses
+    Content-Length when present, the next boundary otherwise.
+    """
+
+    def __init__(self, boundary=BOUNDARY):
+        self.boundary = boundary
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+        parts = []
+        while True:
+            start = self.buf.find(self.boundary)
+            if start < 0:
+                # Keep a possible partial boundary at the end
+                del self.buf[:max(0, len(self.buf) - len(self.boundary))]
+                break
+            head_end = self.buf.find(b"\r\n\r\n", start)
+            if head_end < 0:
+                del self.buf[:start]
+                break
+
+            headers = {}
+            for line in bytes(self.buf[start + len(self.boundary):head_end]).split(b"\r\n"):
+                if b":" in line:
+                    k, v = line.decode(errors="replace").split(":", 1)
+                    headers[k.strip()] = v.strip()
+
+            body_start = head_end + 4
+            if "Content-Length" in headers:
+                end = body_start + int(headers["Content-Length"])
+                if len(self.buf) < end:
+                    del self.buf[:start]
+                    break
+                body = bytes(self.buf[body_start:end])
+            else:
+                end = self.buf.find(self.boundary, body_start)
+                if end < 0:
+                    del self.buf[:start]
+                    break
+                body = bytes(self.buf[body_start:end]).rstrip(b"\r\n")
+            del self.buf[:end]
+            parts.append((headers, body))
+
+        if len(self.buf) > MAX_PART_BYTES:
+            self.buf.clear()
+        return parts
+
+
+class Broadcast:
+    """Latest multipart part for a set of viewers: produced once, sent to all of them."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.clients = 0
+        self.seq = 0
+        self.part = None
+
+    def subscribe(self):
+        with self.cond:
+            self.clients += 1
+            return self.seq
+
+    def unsubscribe(self):
+        with self.cond:
+            self.clients -= 1
+
+    def wait(self, seq, timeout=None):
+        """Newest part after seq as (seq, part), None on timeout."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq != seq, timeout):
+                return None
+            return self.seq, self.part
+
+    def publish(self, data):
+        part = (
+            BOUNDARY + b"\r\n"
+            + b"Content-Type: image/jpeg\r\n"
+            + f"Content-Length: {len(data)}\r\n".encode()
+            + b"\r\n"
+            + data
+            + b"\r\n"
+        )
+        with self.cond:
+            self.seq += 1
+            self.part = part
+            self.cond.notify_all()
+
+
+class CameraUpstream(threading.Thread):
+    """
+    Persistent connection to one camera's MJPEG stream, reconnecting with
+    backoff. The newest JPEG is always kept (for the mosaic); frames are
+    decoded, overlaid and re-encoded once, and only while the camera has
+    viewers or a periodic save is due.
+    """
+
+    def __init__(self, name, host, port, path=UPSTREAM_PATH):
+        super().__init__(daemon=True, name=f"upstream-{name}")
+        self.name = name
+        self.host = host
+        self.port = port
+        self.path = path
+        self.viewers = Broadcast()
+
+        self.latest = None          # (seq, jpeg, headers, received)
+        self.frames = 0
+        self.reconnects = 0
+        self.connected = False
+        self.last_error = None
+        self.last_5min_save = None
+        self.last_hourly_save = None
+        self.timelapse = None
+        self._backoff = RECONNECT_MIN_S
+
+    def run(self):
+        while True:
+            try:
+                self.stream()
+                self.last_error = "upstream closed"
+            except (OSError, ValueError) as e:
+                self.last_error = str(e)
+            self.connected = False
+            print(f"[{self.name}] upstream disconnected ({self.last_error}), retry in {self._backoff}s")
+            time.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, RECONNECT_MAX_S)
+            self.reconnects += 1
+
+    def stream(self):
+        with socket.create_connection((self.host, self.port), timeout=UPSTREAM_TIMEOUT_S) as upstream:
+            upstream.sendall(
+                f"GET {self.path} HTTP/1.1\r\n"
+                f"Host: {self.host}\r\n\r\n".encode()
+            )
+
+            # Upstream response headers
+            head = b""
+            while b"\r\n\r\n" not in head:
+                chunk = upstream.recv(4096)
+                if not chunk:
+                    return
+                head += chunk
+            head, rest = head.split(b"\r\n\r\n", 1)
+            status = head.split(b"\r\n", 1)[0]
+            if b" 200 " not in status + b" ":
+                raise ValueError(f"upstream answered {status.decode(errors='replace')}")
+
+            self.connected = True
+            print(f"[{self.name}] upstream connected")
+            parser = MultipartParser()
+            data = rest
+            while True:
+                for headers, jpeg in parser.feed(data):
+                    self._backoff = RECONNECT_MIN_S
+                    self.handle_part(jpeg, headers)
+                data = upstream.recv(65536)
+                if not data:
+                    return
+
+    def handle_part(self, jpeg, headers):
+        now = datetime.now()
+        self.frames += 1
+        self.latest = (self.frames, jpeg, headers, time.time())
+
+        save = save_due(self, now)
+        if self.viewers.clients == 0 and not save:
             return
 
-        upstream = socket.create_connection((UPSTREAM_HOST, UPSTREAM_PORT))
-        upstream.sendall(
-            f"GET {UPSTREAM_PATH} HTTP/1.1\r\n"
-            f"Host: {UPSTREAM_HOST}\r\n\r\n".encode()
+        # Decode JPEG
+        img = cv2.imdecode(
+            np.frombuffer(jpeg, np.uint8),
+            cv2.IMREAD_COLOR
         )
-        f = upstream.makefile("rb")
+        if img is None:
+            return
 
-        # Skip upstream headers
+        # Overlay
+        img = draw_overlay(img, headers)
+        if save:
+            save_frame(img, headers, self, now)
+        if self.viewers.clients == 0:
+            return
+        # Re-encode JPEG
+        ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if ok:
+            self.viewers.publish(encoded.tobytes())
+
+    def describe(self):
+        age = time.time() - self.latest[3] if self.latest else None
+        return {
+            "host": f"{self.host}:{self.port}",
+            "connected": self.connected,
+            "frames": self.frames,
+            "reconnects": self.reconnects,
+            "viewers": self.viewers.clients,
+            "last_frame_age_s": round(age, 1) if age is not None else None,
+            "last_error": self.last_error,
+            "timelapse": self.timelapse.describe() if self.timelapse else None,
+        }
+
+
+class Mosaic(threading.Thread):
+    """
+    Grid of all cameras at MOSAIC_FPS, composed only while it has viewers.
+    A tile is decoded again only when its camera has a new frame, with
+    JPEG reduced decoding (1/2, 1/4, 1/8) when the source is large.
+    """
+
+    def __init__(self, cameras):
+        super().__init__(daemon=True, name="mosaic")
+        self.cameras = cameras
+        self.viewers = Broadcast()
+        cols = MOSAIC_COLUMNS or int(np.ceil(np.sqrt(len(cameras))))
+        rows = int(np.ceil(len(cameras) / cols))
+        tw, th = MOSAIC_TILE
+        self.cols = cols
+        self.canvas = np.zeros((rows * th, cols * tw, 3), np.uint8)
+        self.tile_seq = {}          # camera name -> seq of the frame in its tile
+        self.reduce = {}            # camera name -> imread flag
+
+    def run(self):
         while True:
-            line = f.readline()
-            if not line or line == b"\r\n":
-                break
+            start = time.time()
+            if self.viewers.clients > 0:
+                self.compose()
+                ok, encoded = cv2.imencode(".jpg", self.canvas, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                if ok:
+                    self.viewers.publish(encoded.tobytes())
+            time.sleep(max(0.0, 1 / MOSAIC_FPS - (time.time() - start)))
+
+    def compose(self):
+        tw, th = MOSAIC_TILE
+        now = time.time()
+        for i, cam in enumerate(self.cameras):
+            y, x = (i // self.cols) * th, (i % self.cols) * tw
+            tile = self.canvas[y:y + th, x:x + tw]
+            latest = cam.latest
+            stale = latest is None or now - latest[3] > MOSAIC_STALE_S
+
+            if latest is not None and self.tile_seq.get(cam.name) != latest[0]:
+                img = cv2.imdecode(np.frombuffer(latest[1], np.uint8), self.reduce.get(cam.name, cv2.IMREAD_COLOR))
+                if img is not None:
+                    if cam.name not in self.reduce:
+                        self.reduce[cam.name] = self._reduce_flag(img.shape[1])
+                    tile[:] = cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA)
+                    self.tile_seq[cam.name] = latest[0]
+            elif latest is None:
+                tile[:] = 40
+
+            label = f"{cam.name} OFFLINE" if stale else cam.name
+            cv2.putText(tile, label, (8, th - 10), hud_font, hud_scale, (0, 0, 0), 3, cv2.LINE_AA)
+            cv2.putText(tile, label, (8, th - 10), hud_font, hud_scale, (255, 255, 255), hud_thickness, cv2.LINE_AA)
+            if stale:
+                # Labels are drawn into the tile: redraw it from the next frame
+                self.tile_seq.pop(cam.name, None)
+
+    @staticmethod
+    def _reduce_flag(width):
+        for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if width // factor >= MOSAIC_TILE[0]:
+                return flag
+        return cv2.IMREAD_COLOR
+
+
+cameras = {}
+mosaic = None
+
 
+class OverlayProxyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if self.path == "/stream" and cameras:
+            # First camera, as before the aggregator
+            self.serve(next(iter(cameras.values())).viewers, "client")
+        elif len(parts) == 3 and parts[0] == "cam" and parts[2] == "stream" and parts[1] in cameras:
+            self.serve(cameras[parts[1]].viewers, parts[1])
+        elif self.path == "/mosaic/stream":
+            self.serve(mosaic.viewers, "mosaic")
+        elif self.path == "/cams":
+            data = json.dumps({name: cam.describe() for name, cam in cameras.items()}, indent=2).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_error(404)
+
+    def serve(self, broadcast, name):
         self.send_response(200)
         self.send_header(
             "Content-Type",
@@ -160,132 +546,111 @@ class OverlayProxyHandler(BaseHTTPRequestHandler):
         )
         self.end_headers()
 
-        print("Overlay proxy client connected")
+        print(f"Overlay proxy {name} client connected")
+        seq = broadcast.subscribe()
 
         try:
             while True:
-                line = f.readline()
-                if not line:
-                    break
-
-                if not line.startswith(BOUNDARY):
-                    continue
-
-                headers = {}
-
-                # Read part headers
-                while True:
-                    line = f.readline().strip()
-                    if not line:
-                        break
-                    if b":" in line:
-                        k, v = line.decode().split(":", 1)
-                        headers[k.strip()] = v.strip()
-
-                length = int(headers.get("Content-Length", 0))
-                jpeg = f.read(length)
-
-                # Decode JPEG
-                img = cv2.imdecode(
-                    np.frombuffer(jpeg, np.uint8),
-                    cv2.IMREAD_COLOR
-                )
-                if img is None:
+                item = broadcast.wait(seq, UPSTREAM_TIMEOUT_S)
+                if item is None:
                     continue
-
-                # Overlay
-                img = draw_overlay(img, headers)
-                save_frame(img, headers)
-                # Re-encode JPEG
-                ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                if not ok:
-                    continue
-
-                data = encoded.tobytes()
-
+                # A slow client skips to the newest frame
+                seq, part = item
                 # Write downstream frame
-                self.wfile.write(BOUNDARY + b"\r\n")
-                self.wfile.write(b"Content-Type: image/jpeg\r\n")
-                self.wfile.write(f"Content-Length: {len(data)}\r\n".encode())
-                self.wfile.write(b"\r\n")
-                self.wfile.write(data)
-                self.wfile.write(b"\r\n")
+                self.wfile.write(part)
 
         except Exception as e:
-            print("Overlay proxy disconnected")
-            print("Overlay proxy disconnected")
+            print(f"Overlay proxy {name} client disconnected")
 
         finally:
-            upstream.close()
+            broadcast.unsubscribe()
 
-# Keep track of last save times
-_last_5min_save = None
-_last_hourly_save = None
 
-def save_frame(img, headers):
-    """Save frame periodically according to retention rules."""
-    global _last_5min_save, _last_hourly_save
+def save_due(camera, now):
+    if not SAVE_PERIODIC:
+        return False
+    return (
+        camera.last_5min_save is None
+        or (now - camera.last_5min_save).total_seconds() >= SAVE_INTERVAL_MIN * 60
+        or camera.last_hourly_save is None
+        or (now - camera.last_hourly_save).total_seconds() >= SAVE_HOURLY_INTERVAL * 60
+    )
 
+def save_frame(img, headers, camera, now):
+    """Save frame periodically according to retention rules, in SAVE_DIR/<camera name>."""
     if not SAVE_PERIODIC:
         return
 
-    now = datetime.now()
+    cam_dir = os.path.join(SAVE_DIR, camera.name)
+    os.makedirs(cam_dir, exist_ok=True)
     saved_any = False
 
-    # --- Save immediately at start ---
-    if _last_5min_save is None:
-        fname_5min = os.path.join(SAVE_DIR, f"frame_5min_{now.strftime('%Y%m%d_%H%M')}.jpg")
+    # --- Save immediately at start, then every 5 minutes ---
+    if camera.last_5min_save is None or (now - camera.last_5min_save).total_seconds() >= SAVE_INTERVAL_MIN * 60:
+        fname_5min = os.path.join(cam_dir, f"frame_5min_{now.strftime('%Y%m%d_%H%M')}.jpg")
         cv2.imwrite(fname_5min, img)
-        _last_5min_save = now
+        retention.add(fname_5min, "5min", ts=now.timestamp())
+        camera.last_5min_save = now
         saved_any = True
 
-    if _last_hourly_save is None:
-        fname_hourly = os.path.join(SAVE_DIR, f"frame_hourly_{now.strftime('%Y%m%d_%H')}.jpg")
-        cv2.imwrite(fname_hourly, img)
-        _last_hourly_save = now
-        saved_any = True
-
-    # --- Save every 5 minutes ---
-    if (now - _last_5min_save).total_seconds() >= SAVE_INTERVAL_MIN * 60:
-        fname_5min = os.path.join(SAVE_DIR, f"frame_5min_{now.strftime('%Y%m%d_%H%M')}.jpg")
-        cv2.imwrite(fname_5min, img)
-        _last_5min_save = now
-        saved_any = True
+        if TIMELAPSE["enable"]:
+            if camera.timelapse is None:
+                camera.timelapse = TimelapseWriter(TIMELAPSE, os.path.join(cam_dir, "timelapse"))
+            try:
+                frame_id = int(headers.get("X-Frame-Id", -1))
+                camera.timelapse.add(img, now.timestamp(), float(headers.get("X-Dark-Score", 0)), frame_id)
+            except Exception as e:
+                print("Error appending to timelapse:", e)
 
-    # --- Save hourly ---
-    if (now - _last_hourly_save).total_seconds() >= SAVE_HOURLY_INTERVAL * 60:
-        fname_hourly = os.path.join(SAVE_DIR, f"frame_hourly_{now.strftime('%Y%m%d_%H')}.jpg")
+    # --- Save immediately at start, then hourly ---
+    if camera.last_hourly_save is None or (now - camera.last_hourly_save).total_seconds() >= SAVE_HOURLY_INTERVAL * 60:
+        fname_hourly = os.path.join(cam_dir, f"frame_hourly_{now.strftime('%Y%m%d_%H')}.jpg")
         cv2.imwrite(fname_hourly, img)
-        _last_hourly_save = now
+        retention.add(fname_hourly, "hourly", ts=now.timestamp())
+        camera.last_hourly_save = now
         saved_any = True
 
-    # --- Cleanup old files only when saving ---
+    # --- Cleanup expired files only when saving (indexed, no directory scan) ---
     if saved_any:
-        for f in os.listdir(SAVE_DIR):
-            fpath = os.path.join(SAVE_DIR, f)
-            try:
-                ts = os.path.getmtime(fpath)
-                age = datetime.fromtimestamp(ts)
-                if f.startswith("frame_5min_") and (now - age) > timedelta(hours=SAVE_5MIN_RETENTION_HOURS):
-                    os.remove(fpath)
-                elif f.startswith("frame_hourly_") and (now - age) > timedelta(days=SAVE_HOURLY_RETENTION_DAYS):
-                    os.remove(fpath)
-            except Exception as e:
-                print("Error cleaning old files:", e)
+        try:
+            retention.enforce(now.timestamp())
+        except Exception as e:
+            print("Error cleaning old files:", e)
 
 class MJPEGOverlayProxy(threading.Thread):
-    def __init__(self, port=8090):
+    def __init__(self, port=8090, camera_list=None):
         super().__init__(daemon=True)
         self.port = port
+        self.camera_list = camera_list or CAMERAS
 
     def run(self):
-        server = HTTPServer(("0.0.0.0", self.port), OverlayProxyHandler)
+        global mosaic
+        for name, (host, port) in self.camera_list.items():
+            cameras[name] = CameraUpstream(name, host, port)
+            cameras[name].start()
+        mosaic = Mosaic(list(cameras.values()))
+        mosaic.start()
+
+        server = ThreadingHTTPServer(("0.0.0.0", self.port), OverlayProxyHandler)
         print(f"Overlay MJPEG proxy running on http://localhost:{self.port}/stream")
+        for name in cameras:
+            print(f"  http://localhost:{self.port}/cam/{name}/stream")
+        print(f"  http://localhost:{self.port}/mosaic/stream ({len(cameras)} cameras, {MOSAIC_FPS} FPS)")
         if SAVE_PERIODIC:
             print(f"Save periodic overlay MJPEG images in {SAVE_DIR}")     
         server.serve_forever()
 
 
+def parse_cameras(args):
+    """name=host[:port] arguments, e.g. garden=pi-garden door=pi-door:8080"""
+    camera_list = {}
+    for arg in args:
+        name, _, address = arg.partition("=")
+        host, _, port = (address or name).partition(":")
+        camera_list[name] = (host, int(port or UPSTREAM_PORT))
+    return camera_list
+
+
 if __name__ == "__main__":
-    MJPEGOverlayProxy().start()
+    MJPEGOverlayProxy(camera_list=parse_cameras(sys.argv[1:])).start()
     input("Press Enter to stop\n")
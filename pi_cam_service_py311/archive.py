@@ -0,0 +1,217 @@
+import json
+import os
+import struct
+import time
+import zipfile
+from typing import Iterator, List, Tuple
+import numpy as np
+from metadata import FrameMetadata
+
+ARCHIVE_EXTENSIONS = (".npz", ".h5")
+VERSION = 1
+
+META_DTYPE = np.dtype([
+    ("frame_id", "<i8"),
+    ("timestamp", "<f8"),
+    ("dark_score", "<f4"),
+    ("night_mode", "u1"),
+    ("motion_score", "<f4"),
+    ("chunk", "<i4"),
+    ("index", "<i4"),        # position in the chunk
+])
+
+_LOCAL_HEADER = struct.Struct("<4s5H3I2H")
+
+
+def _read_npy_header(f) -> tuple[tuple, bool, np.dtype]:
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def hdf5_available() -> bool:
+    try:
+        import h5py  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _chunks(frames: List[Tuple[np.ndarray, FrameMetadata]], chunk_frames: int) -> Iterator[list]:
+    """Runs of at most chunk_frames frames of the same shape and dtype (the ring can be resized meanwhile)."""
+    chunk: list = []
+    for frame in frames:
+        if chunk and (len(chunk) >= chunk_frames or frame[0].shape != chunk[0][0].shape or frame[0].dtype != chunk[0][0].dtype):
+            yield chunk
+            chunk = []
+        chunk.append(frame)
+    if chunk:
+        yield chunk
+
+
+def _meta_row(meta: FrameMetadata, chunk: int, index: int) -> tuple:
+    return (meta.frame_id, meta.timestamp, meta.dark_score, meta.night_mode, meta.motion_score, chunk, index)
+
+
+def _write_npz(path: str, frames, chunk_frames: int, compress: bool, info: dict) -> None:
+    rows = []
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(path, "w", compression=compression, allowZip64=True) as zf:
+        for c, chunk in enumerate(_chunks(frames, chunk_frames)):
+            first = chunk[0][0]
+            with zf.open(f"chunk_{c:05d}.npy", "w", force_zip64=True) as f:
+                # Header for the whole chunk, then the frames one by one: never stacked in memory
+                np.lib.format.write_array_header_1_0(f, {
+                    "descr": np.lib.format.dtype_to_descr(first.dtype),
+                    "fortran_order": False,
+                    "shape": (len(chunk),) + first.shape,
+                })
+                for i, (img, meta) in enumerate(chunk):
+                    f.write(np.ascontiguousarray(img).data)
+                    rows.append(_meta_row(meta, c, i))
+        with zf.open("meta.npy", "w") as f:
+            np.lib.format.write_array(f, np.array(rows, dtype=META_DTYPE), allow_pickle=False)
+        zf.writestr("info.json", json.dumps(info))
+
+
+def _write_hdf5(path: str, frames, chunk_frames: int, compress: bool, info: dict) -> None:
+    import h5py
+
+    rows = []
+    with h5py.File(path, "w") as h5:
+        for c, chunk in enumerate(_chunks(frames, chunk_frames)):
+            first = chunk[0][0]
+            ds = h5.create_dataset(
+                f"chunk_{c:05d}", shape=(len(chunk),) + first.shape, dtype=first.dtype,
+                chunks=(1,) + first.shape, compression="gzip" if compress else None,
+            )
+            for i, (img, meta) in enumerate(chunk):
+                ds[i] = img
+                rows.append(_meta_row(meta, c, i))
+        h5.create_dataset("meta", data=np.array(rows, dtype=META_DTYPE))
+        h5.attrs["info"] = json.dumps(info)
+
+
+def write_archive(path_base: str, frames: List[Tuple[np.ndarray, FrameMetadata]], cfg: dict) -> str:
+    """
+    Write frames into one container, path_base + ".npz" or ".h5" (backend
+    "npz", "hdf5" or "auto": HDF5 when h5py is installed; the shipped
+    config uses "npz"). Written to a .tmp file, fsynced and renamed.
+    Returns the path.
+    """
+    backend = cfg["backend"]
+    if backend == "auto":
+        backend = "hdf5" if hdf5_available() else "npz"
+    path = path_base + (".h5" if backend == "hdf5" else ".npz")
+    tmp = path + ".tmp"
+    info = {"version": VERSION, "created": time.time(), "frames": len(frames), "chunk_frames": cfg["chunk_frames"]}
+    try:
+        if backend == "hdf5":
+            _write_hdf5(tmp, frames, cfg["chunk_frames"], cfg["compress"], info)
+        else:
+            _write_npz(tmp, frames, cfg["chunk_frames"], cfg["compress"], info)
+        with open(tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
+
+
+class ArchiveReader:
+    """
+    Random access to an archive: `meta` is the metadata table (one row
+    per frame, in order), frame(i) returns (img, FrameMetadata). In
+    uncompressed .npz archives frames are memory-mapped straight from the
+    file; compressed members are read up to the frame.
+
+        with ArchiveReader("captures/20250101_220000_f1234_x60.npz") as archive:
+            img, meta = archive.frame(archive.find(t=1735765200.0))
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.hdf5 = path.endswith(".h5")
+        self._maps: dict[int, np.ndarray] = {}
+        if self.hdf5:
+            import h5py
+            self.file = h5py.File(path, "r")
+            self.meta = self.file["meta"][:]
+            self.info = json.loads(self.file.attrs["info"])
+        else:
+            self.file = zipfile.ZipFile(path)
+            with self.file.open("meta.npy") as f:
+                self.meta = np.lib.format.read_array(f)
+            self.info = json.loads(self.file.read("info.json"))
+
+    def __len__(self) -> int:
+        return len(self.meta)
+
+    def __enter__(self) -> "ArchiveReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._maps.clear()
+        self.file.close()
+
+    def metadata(self, i: int) -> FrameMetadata:
+        row = self.meta[i]
+        return FrameMetadata(
+            frame_id=int(row["frame_id"]), timestamp=float(row["timestamp"]),
+            dark_score=float(row["dark_score"]), night_mode=bool(row["night_mode"]),
+            motion_score=float(row["motion_score"]),
+        )
+
+    def find(self, frame_id: int | None = None, t: float | None = None) -> int:
+        """Index of the frame with frame_id, or of the frame closest to timestamp t."""
+        if frame_id is not None:
+            hits = np.flatnonzero(self.meta["frame_id"] == frame_id)
+            if not len(hits):
+                raise KeyError(frame_id)
+            return int(hits[0])
+        return int(np.argmin(np.abs(self.meta["timestamp"] - t)))
+
+    def _member_map(self, chunk: int) -> np.ndarray | None:
+        """Memory map of an uncompressed chunk member, None if it is compressed."""
+        if chunk in self._maps:
+            return self._maps[chunk]
+        zinfo = self.file.getinfo(f"chunk_{chunk:05d}.npy")
+        if zinfo.compress_type != zipfile.ZIP_STORED:
+            return None
+        with open(self.path, "rb") as f:
+            f.seek(zinfo.header_offset)
+            fields = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            name_len, extra_len = fields[-2], fields[-1]
+            f.seek(zinfo.header_offset + _LOCAL_HEADER.size + name_len + extra_len)
+            shape, _, dtype = _read_npy_header(f)
+            offset = f.tell()
+        arr = np.memmap(self.path, dtype=dtype, mode="r", offset=offset, shape=shape)
+        self._maps[chunk] = arr
+        return arr
+
+    def frame(self, i: int) -> tuple[np.ndarray, FrameMetadata]:
+        row = self.meta[i]
+        chunk, index = int(row["chunk"]), int(row["index"])
+        if self.hdf5:
+            img = self.file[f"chunk_{chunk:05d}"][index]
+        else:
+            arr = self._member_map(chunk)
+            if arr is not None:
+                img = arr[index]
+            else:
+                with self.file.open(f"chunk_{chunk:05d}.npy") as f:
+                    shape, _, dtype = _read_npy_header(f)
+                    frame_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+                    f.seek(f.tell() + index * frame_bytes)
+                    img = np.frombuffer(f.read(frame_bytes), dtype).reshape(shape[1:])
+        return img, self.metadata(i)
+
+    def frames(self) -> Iterator[tuple[np.ndarray, FrameMetadata]]:
+        for i in range(len(self)):
+            yield self.frame(i)
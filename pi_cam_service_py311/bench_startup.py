@@ -0,0 +1,108 @@
+"""
+Startup benchmark: launches the service several times and measures, from
+process launch, when the trigger port answers and when the first frame
+is captured (polled with the "startup" command).
+
+    python3 bench_startup.py --runs 5
+
+Run it with the service stopped, from the service directory.
+"""
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+
+def query(port: int, cmd: str, timeout: float = 2.0) -> str:
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as s:
+        s.sendall(cmd.encode())
+        chunks = []
+        while chunk := s.recv(4096):
+            chunks.append(chunk)
+    return b"".join(chunks).decode()
+
+
+def run_once(port: int, timeout: float, interval: float) -> dict:
+    launched = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, "main.py"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    result = {"trigger_ready_s": None, "first_frame_s": None, "service": None}
+    try:
+        while time.time() - launched < timeout:
+            if proc.poll() is not None:
+                result["exit_code"] = proc.returncode
+                break
+            try:
+                report = json.loads(query(port, "startup"))
+            except (OSError, ValueError):
+                time.sleep(interval)
+                continue
+            if result["trigger_ready_s"] is None:
+                result["trigger_ready_s"] = round(time.time() - launched, 3)
+            if report["first_frame_s"] is not None:
+                result["first_frame_s"] = round(time.time() - launched, 3)
+                result["service"] = report
+                break
+            time.sleep(interval)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+    return result
+
+
+def summarize(results: list[dict], key: str) -> dict | None:
+    values = [r[key] for r in results if r[key] is not None]
+    if not values:
+        return None
+    return {
+        "min": min(values),
+        "median": round(statistics.median(values), 3),
+        "max": max(values),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=None, help="trigger port (default: from config.json)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for the first frame")
+    parser.add_argument("--interval", type=float, default=0.05, help="poll interval in seconds")
+    parser.add_argument("--pause", type=float, default=2.0, help="seconds between runs (camera release)")
+    args = parser.parse_args()
+
+    port = args.port
+    if port is None:
+        with open("config.json") as f:
+            port = json.load(f)["network"]["trigger_port"]
+
+    results = []
+    for i in range(args.runs):
+        if i:
+            time.sleep(args.pause)
+        result = run_once(port, args.timeout, args.interval)
+        results.append(result)
+        print(
+            f"run {i + 1}: trigger ready {result['trigger_ready_s']}s, "
+            f"first frame {result['first_frame_s']}s",
+            file=sys.stderr,
+        )
+
+    print(json.dumps({
+        "runs": results,
+        "trigger_ready_s": summarize(results, "trigger_ready_s"),
+        "first_frame_s": summarize(results, "first_frame_s"),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import glob
+import logging
+import os
+import re
+import threading
+import time
+from typing import Callable
+import cv2
+import numpy as np
+
+TEMPERATURE_FILE = "/sys/class/thermal/thermal_zone0/temp"
+
+# Neighbours used to fill a hot pixel (3x3 without the centre)
+_DY = np.array([-1, -1, -1, 0, 0, 1, 1, 1])
+_DX = np.array([-1, 0, 1, -1, 1, -1, 0, 1])
+
+_NAME = re.compile(r"^dark_(\d+)x(\d+)_e(\d+)_g([\d.]+)_t(-?\d+|na)\.npy$")
+
+
+def read_temperature() -> float | None:
+    """SoC temperature in °C, the closest thing to a sensor temperature on a Pi."""
+    try:
+        with open(TEMPERATURE_FILE) as f:
+            return int(f.read().strip()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    tmp = path + ".tmp.npy"
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+def fill_hot_pixels(img: np.ndarray, hot: np.ndarray) -> None:
+    """In place: replace each hot pixel (rows, cols in hot[:, 0], hot[:, 1]) by the median of its 8 neighbours."""
+    if not len(hot):
+        return
+    h, w = img.shape[:2]
+    ys = np.clip(hot[:, 0, None] + _DY, 0, h - 1)
+    xs = np.clip(hot[:, 1, None] + _DX, 0, w - 1)
+    img[hot[:, 0], hot[:, 1]] = np.median(img[ys, xs], axis=1).astype(img.dtype)
+
+
+class DarkCalibration:
+    """
+    Master dark frames and hot-pixel lists for night frames.
+
+    A calibration is keyed by frame size, exposure, gain and temperature
+    bucket (temp_bucket_c wide) and stored in cfg["dir"] as two .npy
+    files: the master dark (uint8, average of the dark frames) and the
+    hot pixels as (row, col) pairs. They are opened as read-only memmaps,
+    so only the pages touched are loaded.
+
+    apply() subtracts the master dark in place (saturating) and fills hot
+    pixels with the median of their neighbours, using the calibration of
+    the same size, exposure and gain with the nearest temperature bucket.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        self.dir = cfg["dir"]
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.cache: dict[tuple, tuple[np.ndarray, np.ndarray]] = {}
+        self.available: set[tuple] = set()
+        self.applied = 0
+        self.missing: set[tuple] = set()
+        self.build_status = "idle"
+        self._temperature: float | None = None
+        self._temperature_ts = 0.0
+        self._scan()
+
+    # Keys and files
+
+    def _bucket(self, temperature: float | None) -> int | None:
+        if temperature is None:
+            return None
+        return int(temperature // self.cfg["temp_bucket_c"] * self.cfg["temp_bucket_c"])
+
+    def _paths(self, key: tuple) -> tuple[str, str]:
+        width, height, exposure_us, gain, bucket = key
+        name = f"{width}x{height}_e{exposure_us}_g{gain:g}_t{'na' if bucket is None else bucket}.npy"
+        return os.path.join(self.dir, "dark_" + name), os.path.join(self.dir, "hot_" + name)
+
+    def _scan(self) -> None:
+        for path in glob.glob(os.path.join(self.dir, "dark_*.npy")):
+            m = _NAME.match(os.path.basename(path))
+            if m is None:
+                continue
+            width, height, exposure_us, gain, bucket = m.groups()
+            self.available.add((
+                int(width), int(height), int(exposure_us), float(gain),
+                None if bucket == "na" else int(bucket),
+            ))
+        if self.available:
+            logging.info("Dark calibrations available: %d in %s", len(self.available), self.dir)
+
+    def temperature(self) -> float | None:
+        now = time.time()
+        if now - self._temperature_ts >= self.cfg["temperature_interval_s"]:
+            self._temperature_ts = now
+            self._temperature = read_temperature()
+        return self._temperature
+
+    def _lookup(self, width: int, height: int, exposure_us: int, gain: float) -> tuple | None:
+        bucket = self._bucket(self.temperature())
+        candidates = [
+            k for k in self.available
+            if k[:4] == (width, height, exposure_us, float(gain))
+        ]
+        if not candidates:
+            return None
+        if bucket is None:
+            return candidates[0]
+        key = min(candidates, key=lambda k: abs(k[4] - bucket) if k[4] is not None else float("inf"))
+        if key[4] is not None and abs(key[4] - bucket) > self.cfg["max_temp_distance_c"]:
+            return None
+        return key
+
+    def _load(self, key: tuple) -> tuple[np.ndarray, np.ndarray]:
+        with self.lock:
+            cal = self.cache.get(key)
+            if cal is None:
+                dark_path, hot_path = self._paths(key)
+                cal = (np.load(dark_path, mmap_mode="r"), np.load(hot_path))
+                self.cache[key] = cal
+            return cal
+
+    # Night pipeline
+
+    def apply(self, img: np.ndarray, exposure_us: int, gain: float) -> bool:
+        """Calibrate a full-resolution night frame in place. False if no calibration matches."""
+        height, width = img.shape[:2]
+        key = self._lookup(width, height, exposure_us, gain)
+        if key is None:
+            missing = (width, height, exposure_us, float(gain))
+            if missing not in self.missing:
+                self.missing.add(missing)
+                logging.warning(
+                    "No dark calibration for %dx%d exposure %d us gain %g (temperature %s °C): "
+                    "night frames are not calibrated, see 'calibrate dark'",
+                    width, height, exposure_us, gain, self.temperature()
+                )
+            return False
+
+        dark, hot = self._load(key)
+        if dark.shape != img.shape:
+            return False
+        cv2.subtract(img, dark, dst=img)
+        fill_hot_pixels(img, hot)
+        self.applied += 1
+        return True
+
+    # Building
+
+    def build(self, capture: Callable[[], np.ndarray], frames: int, exposure_us: int, gain: float) -> str:
+        """
+        Average `frames` dark frames (lens covered) from capture() and
+        detect hot pixels. Memory: one float32 accumulator of a frame.
+        """
+        self.build_status = f"capturing 0/{frames}"
+        acc = None
+        for i in range(frames):
+            img = capture()
+            if acc is None:
+                acc = np.zeros(img.shape, np.float32)
+            acc += img
+            self.build_status = f"capturing {i + 1}/{frames}"
+        acc /= frames
+
+        # Hot pixels: brightest channel far above the robust spread of the master dark
+        level = acc.max(axis=2) if acc.ndim == 3 else acc
+        median = float(np.median(level))
+        mad = float(np.median(np.abs(level - median))) * 1.4826
+        limit = median + self.cfg["hot_sigma"] * max(mad, 1.0)
+        hot = np.argwhere(level > limit).astype(np.int32)
+
+        dark = np.rint(acc).clip(0, 255).astype(np.uint8)
+        del acc, level
+
+        height, width = dark.shape[:2]
+        key = (width, height, int(exposure_us), float(gain), self._bucket(self.temperature()))
+        dark_path, hot_path = self._paths(key)
+        _save_npy(hot_path, hot)
+        _save_npy(dark_path, dark)
+        with self.lock:
+            self.cache.pop(key, None)
+            self.available.add(key)
+            self.missing.discard(key[:4])
+
+        self.build_status = (
+            f"done {os.path.basename(dark_path)}: {frames} frames, "
+            f"dark level {median:.1f}, {len(hot)} hot pixels (> {limit:.1f})"
+        )
+        logging.info("Dark calibration %s", self.build_status)
+        return self.build_status
+
+    def describe(self) -> dict:
+        return {
+            "temperature_c": self.temperature(),
+            "calibrations": sorted(
+                f"{w}x{h} exposure={e}us gain={g:g} temp={'na' if t is None else t}"
+                for w, h, e, g, t in self.available
+            ),
+            "frames_calibrated": self.applied,
+            "build": self.build_status,
+        }
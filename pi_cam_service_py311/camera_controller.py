@@ -1,17 +1,36 @@
+import threading
 import time
 import cv2
 import numpy as np
-from picamera2 import Picamera2
 from metadata import FrameMetadata
+from motion import gray_thumbnail
 
 class CameraController:
-    def __init__(self, cfg: dict, ring) -> None:
-        self.cfg = cfg          # live reference to full config
+    def __init__(self, store, ring, motion=None, stats=None, calibration=None) -> None:
+        self.store = store      # ConfigStore: typed settings in store.settings
+        self.cfg = store.cfg    # live reference to full config
         self.ring = ring
+        self.motion = motion    # optional MotionDetector
+        self.stats = stats      # optional FrameStats
+        self.calibration = calibration  # optional DarkCalibration, applied to night frames
+        self.thumb = None       # analysis thumbnail of the last captured frame
+        self.last_frame = None  # (ring image, meta) of the last capture, also when not stored in the ring
+        # Imported here: loading libcamera is a large part of the startup time
+        if self.cfg["camera"].get("synthetic", False):
+            from synthetic_camera import SyntheticCamera as Picamera2
+        else:
+            from picamera2 import Picamera2
         self.cam = Picamera2()
         self.frame_id = 0
         self.mode = None
         self.night_cfg = None
+        # As applied to the camera (cfg may already hold a pending change)
+        self.size = None
+        self.framerate = None
+        # Serializes captures with reconfiguration from other threads
+        self.lock = threading.RLock()
+        self.needs_restart = False  # set by abort(), the next capture restarts the camera
+        self.watchdog = None        # optional CaptureWatchdog, told when a capture starts
 
     # Universal getter for any parameter
     def get_param(self, key_path: str):
@@ -32,13 +51,14 @@ class CameraController:
         
         self.cam.stop()
 
+        camera = self.store.settings.camera
         cfg = self.cam.create_video_configuration(
             main={
-                "size": (self.get_param("camera.width"), self.get_param("camera.height")),
+                "size": (camera.width, camera.height),
                 "format": "RGB888"
             },
             controls={
-                "FrameRate": self.get_param("camera.framerate"),
+                "FrameRate": camera.framerate,
 
                 # Reset only on transition
                 "AeEnable": True,
@@ -54,20 +74,24 @@ class CameraController:
         self.cam.start()
 
         self.mode = "video"
+        self.size = (camera.width, camera.height)
+        self.framerate = camera.framerate
         self.night_cfg = None
         self.controls_applied = True
 
     # Start still/night mode
-    def start_still(self, night_cfg: dict):
+    def start_still(self, night_cfg):
+        """night_cfg: NightSettings"""
         if self.mode == "still":
             return
 
         self.cam.stop()
         self.night_cfg = night_cfg
 
+        camera = self.store.settings.camera
         cfg = self.cam.create_still_configuration(
             main={
-                "size": (self.get_param("camera.width"), self.get_param("camera.height")),
+                "size": (camera.width, camera.height),
                 "format": "RGB888"
             },
             controls={
@@ -76,8 +100,8 @@ class CameraController:
                 "AwbEnable": False,
 
                 # Fixed night parameters
-                "ExposureTime": night_cfg["exposure_us"],
-                "AnalogueGain": night_cfg["gain"],
+                "ExposureTime": night_cfg.exposure_us,
+                "AnalogueGain": night_cfg.gain,
             }
         )
 
@@ -85,64 +109,197 @@ class CameraController:
         self.cam.start()
 
         self.mode = "still"
+        self.size = (camera.width, camera.height)
+        self.framerate = None
         self.controls_applied = True        
 
     # Capture a frame for the ring buffer
     def capture_once(self):
-        img = self.cam.capture_array()
-
-        # Downscale for ring buffer if enabled
-        downscale = self.get_param("ring.downscale.enable") if self.get_param("ring.downscale") else True
-        if downscale:
-            w = self.get_param("ring.downscale.width")
-            h = self.get_param("ring.downscale.height")
-            ring_img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
-        else:
-            ring_img = img
+        with self.lock:
+            # The deadline starts once the lock is held: waiting behind a
+            # calibration or an HDR bracket is not a stuck capture
+            if self.watchdog is not None:
+                self.watchdog.begin()
+            if self.needs_restart:
+                self.needs_restart = False
+                self.reconfigure()
+            img = self._calibrated(self.cam.capture_array())
+            settings = self.store.settings
 
-        ts = time.time()
-        score = float(ring_img.mean())
+            # Downscale for ring buffer if enabled
+            if settings.ring.downscale:
+                ring_img = cv2.resize(img, (settings.ring.width, settings.ring.height), interpolation=cv2.INTER_AREA)
+            else:
+                ring_img = img
 
-        meta = FrameMetadata(
-            frame_id=self.frame_id,
-            timestamp=ts,
-            dark_score=score,
-            night_mode=(self.mode == "still")
-        )
+            ts = time.time()
+            score = float(ring_img.mean())
 
-        self.ring.append((ring_img, meta))
-        self.frame_id += 1
+            motion_score = 0.0
+            skip = False
+            if self.motion is not None or self.stats is not None:
+                small = cv2.resize(
+                    ring_img,
+                    (settings.analysis.thumb_width, settings.analysis.thumb_height),
+                    interpolation=cv2.INTER_AREA,
+                )
+                self.thumb = gray_thumbnail(small)
+                if self.stats is not None:
+                    # Monotonic: a clock step must not empty the rolling windows
+                    self.stats.update(small, self.thumb, time.monotonic())
+            if self.motion is not None:
+                self.motion.update(self.thumb)
+                motion_score = self.motion.score
+                skip = self.motion.skip_frame()
+
+            meta = FrameMetadata(
+                frame_id=self.frame_id,
+                timestamp=ts,
+                dark_score=score,
+                night_mode=(self.mode == "still"),
+                motion_score=motion_score
+            )
+
+            # Near-duplicate frames are dropped to save ring memory
+            self.last_frame = (ring_img, meta)
+            if not skip:
+                self.ring.append((ring_img, meta))
+            self.frame_id += 1
+            return meta
 
     def capture_fullres(self):
-        return self.cam.capture_array()
+        with self.lock:
+            return self._calibrated(self.cam.capture_array())
+
+    # Dark frame subtraction and hot pixel fill, in place, for night frames
+    def _calibrated(self, img):
+        if self.calibration is not None and self.mode == "still" and self.night_cfg is not None:
+            self.calibration.apply(img, self.night_cfg.exposure_us, self.night_cfg.gain)
+        return img
+
+    def capture_dark(self):
+        """Uncalibrated night-mode frame for building a dark calibration."""
+        with self.lock:
+            return self.cam.capture_array()
+
+    # Exposure bracket for HDR, with control changes only (no reconfiguration)
+    def capture_bracket(self, evs, settle_frames):
+        """
+        Full-resolution frames at the current exposure x 2**ev for each ev,
+        with auto exposure locked. Each frame is taken from the first request
+        whose metadata shows the requested exposure (at most settle_frames
+        requests), and dark-calibrated at night like ring frames.
+        Returns [(img, exposure_us)].
+
+        The camera is held for one exposure at a time and the mode's controls
+        are restored after each, so a night bracket of long exposures does
+        not stall the capture loop.
+        """
+        with self.lock:
+            current = self.cam.capture_metadata()
+            base_exposure = current.get("ExposureTime") or (self.night_cfg.exposure_us if self.night_cfg else 10000)
+            gain = current.get("AnalogueGain") or (self.night_cfg.gain if self.night_cfg else 1.0)
+        frames = []
+        for ev in evs:
+            exposure = int(base_exposure * 2 ** ev)
+            with self.lock:
+                try:
+                    self.cam.set_controls({"AeEnable": False, "ExposureTime": exposure, "AnalogueGain": gain})
+                    img, actual = self._capture_at_exposure(exposure, settle_frames)
+                finally:
+                    self._restore_controls()
+                if self.calibration is not None and self.mode == "still":
+                    self.calibration.apply(img, exposure, gain)
+            frames.append((img, actual))
+        return frames
+
+    def _restore_controls(self):
+        if self.mode == "still" and self.night_cfg is not None:
+            self.cam.set_controls({
+                "ExposureTime": self.night_cfg.exposure_us,
+                "AnalogueGain": self.night_cfg.gain,
+            })
+        else:
+            self.cam.set_controls({"AeEnable": True, "ExposureTime": 0, "AnalogueGain": 0.0})
+
+    def _capture_at_exposure(self, exposure, settle_frames):
+        actual = None
+        for _ in range(settle_frames):
+            request = self.cam.capture_request()
+            try:
+                actual = request.get_metadata().get("ExposureTime")
+                # The sensor caps exposure to the frame duration: accept what it settles on
+                if actual is not None and abs(actual - exposure) <= 0.1 * exposure:
+                    return request.make_array("main"), actual
+            finally:
+                request.release()
+        return self.cam.capture_array(), actual or exposure
+
+    # Re-apply the current mode's controls without reconfiguring (watchdog recovery)
+    def reset_controls(self):
+        with self.lock:
+            if self.mode == "still" and self.night_cfg is not None:
+                self.cam.set_controls({
+                    "AeEnable": False,
+                    "AwbEnable": False,
+                    "ExposureTime": self.night_cfg.exposure_us,
+                    "AnalogueGain": self.night_cfg.gain,
+                })
+            else:
+                self.framerate = self.store.settings.camera.framerate
+                self.cam.set_controls({
+                    "FrameRate": self.framerate,
+                    "AeEnable": True,
+                    "AwbEnable": True,
+                    "ExposureTime": 0,
+                    "AnalogueGain": 0.0,
+                })
+
+    def abort(self):
+        """Stop the camera from another thread to unblock a hung capture (no lock: the capture holds it)."""
+        self.needs_restart = True
+        self.cam.stop()
+
+    # Apply a new resolution in the current mode (stop/configure/start)
+    def reconfigure(self):
+        with self.lock:
+            mode, self.mode = self.mode, None
+            if mode == "still":
+                self.start_still(self.store.settings.night)
+            else:
+                self.start_video()
 
     # Apply live changes from cfg
     def update_settings(self):
         try:
             if self.mode == "video":
+                framerate = self.store.settings.camera.framerate
                 self.cam.set_controls({
-                    "FrameRate": self.get_param("camera.framerate"),
+                    "FrameRate": framerate,
                 })
+                self.framerate = framerate
             # ❌ NO exposure/gain changes here
         except Exception as e:
             import logging
             logging.warning("Failed to update camera settings live: %s", e)
 
+    # Settings as applied to the camera, so a description taken before a change differs from one after
     def describe_mode(self):
+        resolution = f"{self.size[0]}x{self.size[1]}" if self.size else None
         if self.mode == "video":
             return {
                 "mode": "video",
-                "resolution": f'{self.get_param("camera.width")}x{self.get_param("camera.height")}',
-                "framerate": self.get_param("camera.framerate"),
+                "resolution": resolution,
+                "framerate": self.framerate,
                 "exposure_us": "auto",
                 "gain": "auto"
             }
         if self.mode == "still":
             return {
                 "mode": "still",
-                "resolution": f'{self.get_param("camera.width")}x{self.get_param("camera.height")}',
+                "resolution": resolution,
                 "framerate": None,
-                "exposure_us": self.night_cfg["exposure_us"] if self.night_cfg else None,
-                "gain": self.night_cfg["gain"] if self.night_cfg else None
+                "exposure_us": self.night_cfg.exposure_us if self.night_cfg else None,
+                "gain": self.night_cfg.gain if self.night_cfg else None
             }
         return {"mode": "unknown"}
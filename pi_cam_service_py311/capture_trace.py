@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Iterator
+import cv2
+import numpy as np
+from metadata import FrameMetadata
+
+MAGIC = b"PCTRACE1"
+VERSION = 1
+
+# Record framing: type, payload length
+RECORD = struct.Struct("<BI")
+FRAME, COMMAND, THUMB = 1, 2, 3
+
+# frame_id, timestamp, dark_score, night_score (value fed to the night controller),
+# motion_score, night_mode (still mode at capture), capture duration, RSS in MiB
+FRAME_FIELDS = struct.Struct("<qdfffBff")
+# timestamp, duration, response bytes; followed by the command text
+COMMAND_FIELDS = struct.Struct("<dfI")
+# frame_id; followed by the JPEG of the grey analysis thumbnail
+THUMB_FIELDS = struct.Struct("<q")
+
+
+class TraceRecorder:
+    """
+    Records the capture loop into a compact binary trace, to replay field
+    problems off-device (replay.py): one fixed-size record per frame
+    (metadata, night score, capture time, RSS), one per trigger
+    command (with its duration) and optionally every thumb_every-th
+    analysis thumbnail as JPEG.
+
+    File: MAGIC, a length-prefixed JSON header (start time and config
+    snapshot), then records of (type, length, payload). A trace cut by a
+    crash is read up to its last complete record.
+    """
+
+    def __init__(self, cfg: dict, process=None) -> None:
+        self.cfg = cfg
+        self.dir = cfg["dir"]
+        self.process = process      # psutil.Process for RSS samples
+        self.lock = threading.Lock()
+        self.file = None
+        self.path: str | None = None
+        self.frames = 0
+        self.commands = 0
+        self.thumbs = 0
+        self.bytes = 0
+        self._rss_mb = 0.0
+        self._rss_ts = 0.0
+        self._flush_ts = 0.0
+
+    @property
+    def active(self) -> bool:
+        return self.file is not None
+
+    def start(self, config: dict) -> str:
+        with self.lock:
+            if self.file is not None:
+                return self.path
+            os.makedirs(self.dir, exist_ok=True)
+            self.path = os.path.join(self.dir, f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.bin")
+            header = json.dumps({"version": VERSION, "started": time.time(), "config": config}).encode()
+            self.file = open(self.path, "wb")
+            self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+            self.frames = self.commands = self.thumbs = 0
+            self.bytes = self.file.tell()
+        logging.info("Trace recording to %s", self.path)
+        return self.path
+
+    def stop(self) -> str | None:
+        with self.lock:
+            if self.file is None:
+                return None
+            self.file.close()
+            self.file = None
+        logging.info(
+            "Trace %s closed: %d frames, %d commands, %d thumbnails, %.1f MiB",
+            self.path, self.frames, self.commands, self.thumbs, self.bytes / (1024 * 1024)
+        )
+        return self.path
+
+    def _write(self, kind: int, payload: bytes) -> None:
+        # Caller holds the lock
+        self.file.write(RECORD.pack(kind, len(payload)) + payload)
+        self.bytes += RECORD.size + len(payload)
+        now = time.time()
+        if now - self._flush_ts >= 1.0:
+            self._flush_ts = now
+            self.file.flush()
+
+    def _rss(self, now: float) -> float:
+        if self.process is not None and now - self._rss_ts >= self.cfg["rss_interval_s"]:
+            self._rss_ts = now
+            self._rss_mb = self.process.memory_info().rss / (1024 * 1024)
+        return self._rss_mb
+
+    def frame(self, meta: FrameMetadata, night_score: float, capture_s: float, thumb: np.ndarray | None = None) -> None:
+        if self.file is None:
+            return
+        payload = FRAME_FIELDS.pack(
+            meta.frame_id, meta.timestamp, meta.dark_score, night_score, meta.motion_score,
+            meta.night_mode, capture_s, self._rss(meta.timestamp),
+        )
+        jpeg = None
+        every = self.cfg["thumb_every"]
+        if thumb is not None and every > 0 and meta.frame_id % every == 0:
+            # The analysis thumbnail is float32; JPEG takes 8-bit
+            thumb = np.clip(thumb, 0, 255).astype(np.uint8)
+            ok, encoded = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, self.cfg["thumb_quality"]])
+            jpeg = encoded.tobytes() if ok else None
+        with self.lock:
+            if self.file is None:
+                return
+            self._write(FRAME, payload)
+            self.frames += 1
+            if jpeg is not None:
+                self._write(THUMB, THUMB_FIELDS.pack(meta.frame_id) + jpeg)
+                self.thumbs += 1
+            self._check_size()
+
+    def command(self, cmd: str, started: float, duration_s: float, response) -> None:
+        if self.file is None:
+            return
+        size = len(response) if isinstance(response, str) else 0
+        payload = COMMAND_FIELDS.pack(started, duration_s, size) + cmd.encode()
+        with self.lock:
+            if self.file is None:
+                return
+            self._write(COMMAND, payload)
+            self.commands += 1
+
+    def _check_size(self) -> None:
+        if self.bytes >= self.cfg["max_mb"] * 1024 * 1024:
+            logging.warning("Trace %s reached %d MiB, recording stopped", self.path, self.cfg["max_mb"])
+            self.file.close()
+            self.file = None
+
+    def describe(self) -> dict:
+        return {
+            "recording": self.active,
+            "path": self.path,
+            "frames": self.frames,
+            "commands": self.commands,
+            "thumbnails": self.thumbs,
+            "mib": round(self.bytes / (1024 * 1024), 2),
+        }
+
+
+def read_trace(path: str) -> tuple[dict, Iterator[tuple]]:
+    """
+    Header of a trace and an iterator of its records:
+    ("frame", FrameMetadata, night_score, capture_s, rss_mb),
+    ("command", cmd, timestamp, duration_s, response_bytes),
+    ("thumb", frame_id, jpeg_bytes).
+    """
+    f = open(path, "rb")
+    if f.read(len(MAGIC)) != MAGIC:
+        f.close()
+        raise ValueError(f"{path} is not a trace file")
+    (length,) = struct.unpack("<I", f.read(4))
+    header = json.loads(f.read(length))
+
+    def records():
+        with f:
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    return
+                kind, length = RECORD.unpack(head)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                if kind == FRAME:
+                    frame_id, ts, dark, night_score, motion_score, night, capture_s, rss_mb = FRAME_FIELDS.unpack(payload)
+                    meta = FrameMetadata(
+                        frame_id=frame_id, timestamp=ts, dark_score=dark,
+                        night_mode=bool(night), motion_score=motion_score,
+                    )
+                    yield "frame", meta, night_score, capture_s, rss_mb
+                elif kind == COMMAND:
+                    ts, duration_s, size = COMMAND_FIELDS.unpack_from(payload)
+                    yield "command", payload[COMMAND_FIELDS.size:].decode(errors="replace"), ts, duration_s, size
+                elif kind == THUMB:
+                    (frame_id,) = THUMB_FIELDS.unpack_from(payload)
+                    yield "thumb", frame_id, payload[THUMB_FIELDS.size:]
+
+    return header, records()
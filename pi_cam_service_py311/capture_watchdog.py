@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# In-process recovery steps, one more per consecutive failure
+RECOVERY_STEPS = ("retry", "reset_controls", "restart")
+
+
+class CaptureWatchdog(threading.Thread):
+    """
+    Keeps the camera running without restarting the process (which would
+    lose the ring and drop every client).
+
+    Failed captures (capture_failed, from the capture loop) are recovered
+    in place with escalating steps: retry, re-apply the mode's controls,
+    then stop/configure/start. After max_attempts consecutive failures the
+    process exits with 102 as before.
+
+    The thread watches captures in flight, timed from the moment
+    CameraController.capture_once holds the camera lock (time spent behind
+    a calibration or an HDR bracket does not count). The deadline is
+    capture_timeout_s plus exposure_factor times the exposure in still
+    mode. Past abort_after deadlines the camera is stopped to unblock the
+    capture (the loop then recovers it as a failure); a capture still
+    stuck after exit_after_s ends the process.
+
+    An incident lasts from the first failure or overdue capture to the
+    next good frame; its duration gives the MTTR reported by health.
+    """
+
+    def __init__(self, cfg: dict, cam, store) -> None:
+        super().__init__(daemon=True, name="capture-watchdog")
+        self.cfg = cfg
+        self.cam = cam
+        self.store = store
+        self.lock = threading.Lock()
+        self.capture_started: float | None = None
+        self.last_frame = time.time()
+        self.failures = 0               # consecutive
+        self.incident_start: float | None = None
+        self.incidents = 0
+        self.repair_times: deque[float] = deque(maxlen=50)
+        self.attempts: deque[dict] = deque(maxlen=20)
+        self._aborted = False
+
+    def deadline_s(self) -> float:
+        settings = self.store.settings
+        deadline = settings.camera.capture_timeout_s
+        if self.cam.mode == "still":
+            deadline += self.cfg["exposure_factor"] * settings.night.exposure_us / 1e6
+        return deadline
+
+    # Capture loop side
+
+    def begin(self) -> None:
+        self.capture_started = time.time()
+
+    def beat(self) -> None:
+        now = time.time()
+        with self.lock:
+            self.capture_started = None
+            self.last_frame = now
+            self.failures = 0
+            self._aborted = False
+            if self.incident_start is not None:
+                repair = now - self.incident_start
+                self.repair_times.append(repair)
+                self.incident_start = None
+                logging.info("Camera recovered in %.1fs", repair)
+
+    def _open_incident(self, now: float) -> None:
+        if self.incident_start is None:
+            self.incident_start = now
+            self.incidents += 1
+
+    def capture_failed(self, error: Exception) -> None:
+        """Recover after a failed capture; raises SystemExit(102) when recovery is exhausted."""
+        now = time.time()
+        with self.lock:
+            self.capture_started = None
+            self._open_incident(now)
+            self.failures += 1
+            attempt = self.failures
+        if attempt > self.cfg["max_attempts"]:
+            logging.error("Camera capture failed %d times, recovery exhausted. Exit: %s", attempt - 1, error)
+            raise SystemExit(102)
+
+        step = RECOVERY_STEPS[min(attempt - 1, len(RECOVERY_STEPS) - 1)]
+        logging.error("Camera capture failed (attempt %d, %s): %s", attempt, step, error)
+        time.sleep(self.cfg["backoff_s"] * (attempt - 1))
+        ok = True
+        try:
+            if step == "reset_controls":
+                self.cam.reset_controls()
+            elif step == "restart":
+                self.cam.reconfigure()
+        except Exception as e:
+            ok = False
+            logging.error("Camera recovery step %s failed: %s", step, e)
+        self._record(step, str(error), ok)
+
+    def _record(self, step: str, reason: str, ok: bool) -> None:
+        with self.lock:
+            self.attempts.append({
+                "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "step": step,
+                "reason": reason,
+                "ok": ok,
+            })
+
+    # Watchdog thread
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.cfg["check_interval_s"])
+            started = self.capture_started
+            if started is None:
+                continue
+            now = time.time()
+            elapsed = now - started
+            deadline = self.deadline_s()
+            if elapsed < deadline:
+                continue
+
+            with self.lock:
+                self._open_incident(started + deadline)
+                aborted = self._aborted
+            if elapsed >= self.cfg["exit_after_s"]:
+                logging.error("Camera capture stuck for %.0fs, in-process recovery failed. Exit", elapsed)
+                logging.shutdown()
+                os._exit(102)
+            if not aborted and elapsed >= self.cfg["abort_after"] * deadline:
+                logging.error("Camera capture stuck for %.1fs (deadline %.1fs): stopping the camera", elapsed, deadline)
+                ok = True
+                try:
+                    self.cam.abort()
+                except Exception as e:
+                    ok = False
+                    logging.error("Camera abort failed: %s", e)
+                with self.lock:
+                    self._aborted = True
+                self._record("abort", f"capture overdue {elapsed:.1f}s > {deadline:.1f}s", ok)
+
+    # Reporting
+
+    def mttr_s(self) -> float | None:
+        return sum(self.repair_times) / len(self.repair_times) if self.repair_times else None
+
+    def health(self) -> str:
+        mttr = self.mttr_s()
+        return (
+            f"CAPTURE_INCIDENTS={self.incidents} CAPTURE_FAILING={int(self.incident_start is not None)} "
+            f"MTTR={'-' if mttr is None else f'{mttr:.1f}s'}"
+        )
+
+    def describe(self) -> dict:
+        with self.lock:
+            mttr = self.mttr_s()
+            return {
+                "deadline_s": round(self.deadline_s(), 1),
+                "capture_in_flight_s": round(time.time() - self.capture_started, 1) if self.capture_started else None,
+                "last_frame_age_s": round(time.time() - self.last_frame, 1),
+                "consecutive_failures": self.failures,
+                "incidents": self.incidents,
+                "incident_open_s": round(time.time() - self.incident_start, 1) if self.incident_start else None,
+                "mttr_s": round(mttr, 2) if mttr is not None else None,
+                "last_repairs_s": [round(t, 2) for t in self.repair_times][-10:],
+                "attempts": list(self.attempts),
+            }
@@ -0,0 +1,83 @@
+from datetime import datetime
+from retention import RetentionIndex
+
+COLUMNS = (
+    "path", "ts", "frame_id", "dark_score", "night", "motion_score",
+    "format", "kind", "stack_count", "size",
+)
+# Retention stores the kind as the file's class
+_SELECT = ", ".join("class AS kind" if c == "kind" else c for c in COLUMNS)
+
+
+def parse_time(value: str) -> float:
+    """Accept epoch seconds, "YYYYmmdd_HHMMSS", "YYYYmmdd" or ISO 8601."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y%m%d_%H%M%S", "%Y%m%d"):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    return datetime.fromisoformat(value).timestamp()
+
+
+class CaptureCatalog:
+    """
+    Queries over the saved files with their FrameMetadata. The rows are
+    the retention index's (RetentionIndex.add with meta): one database,
+    and files deleted by retention are gone from the catalog too. Files
+    adopted without metadata are not listed.
+    """
+
+    def __init__(self, index: RetentionIndex) -> None:
+        self.index = index
+
+    def query(
+        self,
+        start: float | None = None,
+        end: float | None = None,
+        night: bool | None = None,
+        fmt: str | None = None,
+        kind: str | None = None,
+        limit: int = 100,
+        newest_first: bool = False,
+    ) -> list[dict]:
+        where, args = ["frame_id IS NOT NULL"], []
+        if night is not None:
+            where.append("night = ?")
+            args.append(int(night))
+        if start is not None:
+            where.append("ts >= ?")
+            args.append(start)
+        if end is not None:
+            where.append("ts < ?")
+            args.append(end)
+        if fmt is not None:
+            where.append("format = ?")
+            args.append(fmt)
+        if kind is not None:
+            where.append("class = ?")
+            args.append(kind)
+
+        sql = f"SELECT {_SELECT} FROM files WHERE " + " AND ".join(where)
+        sql += f" ORDER BY ts {'DESC' if newest_first else 'ASC'} LIMIT ?"
+        args.append(limit)
+
+        with self.index.lock:
+            rows = self.index.db.execute(sql, args).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def query_command(self, args: list[str]) -> list[dict]:
+        """Parse "key=value" arguments of the query trigger command."""
+        opts = dict(a.split("=", 1) for a in args if "=" in a)
+        return self.query(
+            start=parse_time(opts["from"]) if "from" in opts else None,
+            end=parse_time(opts["to"]) if "to" in opts else None,
+            night=opts["night"] in ("1", "true", "yes") if "night" in opts else None,
+            fmt=opts.get("format"),
+            kind=opts.get("kind"),
+            limit=int(opts.get("limit", 100)),
+            newest_first=opts.get("order", "asc") == "desc",
+        )
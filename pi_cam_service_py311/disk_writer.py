@@ -0,0 +1,221 @@
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from typing import Callable
+
+# on_done(path, ok): called from the writer thread once a file is in place (ok) or has failed
+OnDone = Callable[[str, bool], None]
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write data next to path, fsync it and rename it into place."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DiskWriter(threading.Thread):
+    """
+    Background writer for encoded files.
+
+    Files are written to "<path>.tmp" in batches of up to fsync_batch
+    files (or whatever arrived within fsync_interval_s): all files of a
+    batch are written, then fsynced, then renamed into place, followed
+    by one fsync per directory. A power cut therefore leaves either the
+    complete file or a .tmp.
+    Each written file's on_done callback runs after its batch, with
+    ok=False if it could not be written or renamed. An entry replaced by
+    a later submit of the same path in the same batch gets no callback
+    and is counted in superseded.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        super().__init__(daemon=True)
+        self.cfg = cfg
+        self.queue: queue.Queue[tuple[str, bytes, OnDone | None]] = queue.Queue(maxsize=cfg["write_queue_size"])
+        self.lock = threading.Lock()
+
+        self.files_written = 0
+        self.bytes_written = 0
+        self.busy_s = 0.0
+        self.last_batch_ms = 0.0
+        self.dropped = 0
+        self.errors = 0
+        self.superseded = 0
+        self.pending = 0
+
+        self.paused = False
+        self._free_mb = None
+        self._last_space_check = 0.0
+
+    # Producer side
+
+    def submit(self, path: str, data: bytes, on_done: OnDone | None = None) -> bool:
+        with self.lock:
+            self.pending += 1
+        try:
+            self.queue.put((path, data, on_done), timeout=self.cfg["write_queue_timeout_s"])
+            return True
+        except queue.Full:
+            with self.lock:
+                self.pending -= 1
+                self.dropped += 1
+            logging.error("Disk writer queue full, dropping %s", path)
+            return False
+
+    def space_ok(self, directory: str) -> bool:
+        """False while free space is below export.min_free_mb (checked at most every few seconds)."""
+        now = time.time()
+        if now - self._last_space_check >= self.cfg["space_check_interval_s"]:
+            self._last_space_check = now
+            self._free_mb = shutil.disk_usage(directory).free / (1024 * 1024)
+            paused = self._free_mb < self.cfg["min_free_mb"]
+            if paused != self.paused:
+                if paused:
+                    logging.warning(
+                        "Free disk space %.0f MiB < %d MiB → pausing saves",
+                        self._free_mb, self.cfg["min_free_mb"]
+                    )
+                else:
+                    logging.info("Free disk space %.0f MiB → resuming saves", self._free_mb)
+            self.paused = paused
+        return not self.paused
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Wait until everything submitted so far is on disk and its on_done has run."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self.lock:
+                if self.pending == 0:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    # Writer thread
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.cfg["fsync_interval_s"]
+            while len(batch) < self.cfg["fsync_batch"]:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: list[tuple[str, bytes, OnDone | None]]) -> None:
+        start = time.time()
+        # Same path submitted twice in one batch: the last write wins and
+        # only its on_done runs; the earlier entries are counted as superseded
+        latest = {path: i for i, (path, _, _) in enumerate(batch)}
+        entries = [batch[i] for i in sorted(latest.values())]
+        superseded = len(batch) - len(entries)
+
+        # Write every file first, then fsync them together, so the flash
+        # sees one burst of writes per batch instead of one per file
+        opened: list[tuple[str, object]] = []
+        failed: set[str] = set()
+        nbytes = 0
+        for path, data, _ in entries:
+            tmp = path + ".tmp"
+            try:
+                f = open(tmp, "wb")
+            except OSError as e:
+                failed.add(path)
+                logging.error("Disk writer failed to write %s: %s", path, e)
+                continue
+            opened.append((path, f))
+            try:
+                f.write(data)
+                f.flush()
+                nbytes += len(data)
+            except OSError as e:
+                failed.add(path)
+                logging.error("Disk writer failed to write %s: %s", path, e)
+
+        for path, f in opened:
+            try:
+                if path not in failed:
+                    os.fsync(f.fileno())
+            except OSError as e:
+                failed.add(path)
+                logging.error("Disk writer failed to sync %s: %s", path, e)
+            finally:
+                f.close()
+
+        renamed: set[str] = set()
+        dirs = set()
+        for path, _, _ in entries:
+            tmp = path + ".tmp"
+            if path in failed:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                continue
+            try:
+                os.replace(tmp, path)
+                renamed.add(path)
+                dirs.add(os.path.dirname(path))
+            except OSError as e:
+                failed.add(path)
+                logging.error("Disk writer failed to rename %s: %s", tmp, e)
+        # One directory fsync makes all the renames of the batch durable
+        for d in dirs:
+            try:
+                fsync_dir(d)
+            except OSError:
+                pass
+
+        for path, _, on_done in entries:
+            if on_done is None:
+                continue
+            try:
+                on_done(path, path in renamed)
+            except Exception as e:
+                logging.error("Disk writer callback failed for %s: %s", path, e)
+
+        elapsed = time.time() - start
+        with self.lock:
+            self.pending -= len(batch)
+            self.files_written += len(renamed)
+            self.bytes_written += nbytes
+            self.errors += len(failed)
+            self.superseded += superseded
+            self.busy_s += elapsed
+            self.last_batch_ms = elapsed * 1000
+
+    def describe(self) -> dict:
+        with self.lock:
+            throughput = self.bytes_written / self.busy_s if self.busy_s > 0 else 0.0
+            return {
+                "queue_depth": self.queue.qsize(),
+                "pending": self.pending,
+                "files_written": self.files_written,
+                "bytes_written": self.bytes_written,
+                "throughput_kib_s": round(throughput / 1024, 1),
+                "last_batch_ms": round(self.last_batch_ms, 1),
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "superseded": self.superseded,
+                "free_mb": round(self._free_mb, 0) if self._free_mb is not None else None,
+                "paused": self.paused,
+            }
@@ -1,41 +1,170 @@
-
+import functools
+import io
+import logging
 import os
 import cv2
 import numpy as np
 from datetime import datetime
 from typing import List, Tuple
 from metadata import FrameMetadata
+from disk_writer import DiskWriter, write_atomic
+from retention import RetentionIndex
+from catalog import CaptureCatalog
+from archive import ARCHIVE_EXTENSIONS, write_archive
+
+EXPORT_FORMATS = ("jpg", "png", "npy")
 
 class Exporter:
     def __init__(self, cfg: dict) -> None:
         self.cfg = cfg
         self.base_dir = os.path.abspath(cfg["base_dir"])
         os.makedirs(self.base_dir, exist_ok=True)
+        self._remove_partial_files()
+
+        # Set by the memory governor under pressure
+        self.paused = False
+        self.disabled_formats: set[str] = set()
+
+        self.writer = DiskWriter(cfg)
+        if cfg["async_write"]:
+            self.writer.start()
+
+        # One index of saved files serves both retention and the catalog
+        self.index = None
+        self.retention = None
+        self.catalog = None
+        retention_cfg = cfg["retention"]
+        if retention_cfg["enable"] or cfg["catalog"]["enable"]:
+            self.index = RetentionIndex(
+                os.path.join(self.base_dir, retention_cfg["index_file"]),
+                retention_cfg["keep_s"] if retention_cfg["enable"] else {},
+                max_bytes=int(retention_cfg["max_bytes_mb"] * 1024 * 1024) if retention_cfg["enable"] else 0,
+                evict_order=retention_cfg["evict_order"],
+            )
+        if retention_cfg["enable"]:
+            self.retention = self.index
+            # Files saved before the index existed are never evicted unless "adopted" is in evict_order
+            self.retention.adopt(
+                self.base_dir,
+                lambda name: "adopted" if name.rsplit(".", 1)[-1] in EXPORT_FORMATS or name.endswith(ARCHIVE_EXTENSIONS) else None
+            )
+        if cfg["catalog"]["enable"]:
+            self.catalog = CaptureCatalog(self.index)
+
+    def _remove_partial_files(self) -> None:
+        # Leftovers of writes interrupted by a power cut
+        for entry in os.scandir(self.base_dir):
+            if entry.name.endswith(".tmp"):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def encode(img: np.ndarray, fmt: str) -> bytes | None:
+        if fmt == "npy":
+            buf = io.BytesIO()
+            np.save(buf, img)
+            return buf.getvalue()
+        ok, encoded = cv2.imencode("." + fmt, img)
+        return encoded.tobytes() if ok else None
+
+    def _write(self, path: str, data: bytes, on_done) -> bool:
+        """False if the file was dropped; on_done(path, ok) runs once it is on disk or has failed."""
+        if self.cfg["async_write"]:
+            return self.writer.submit(path, data, on_done)
+        try:
+            write_atomic(path, data)
+        except OSError as e:
+            logging.error("Failed to write %s: %s", path, e)
+            return False
+        on_done(path, True)
+        return True
 
-    def save(self, frames: List[Tuple[np.ndarray, FrameMetadata]], formats: list[str] | None = None) -> list[str]:
+    def _written(self, meta: FrameMetadata, fmt: str, kind: str, stack_count: int, size: int, path: str, ok: bool) -> None:
+        """Index row (retention and catalog), only for files that reached the disk."""
+        if not ok:
+            logging.error("Save of %s failed: file not written, not cataloged", path)
+            return
+        if self.index is not None:
+            self.index.add(path, kind, ts=meta.timestamp, size=size, meta=meta, fmt=fmt, stack_count=stack_count)
+        if self.retention is not None:
+            deleted = self.retention.enforce()
+            if deleted:
+                logging.info("Retention removed %d files", len(deleted))
+
+    def save(self, frames: List[Tuple[np.ndarray, FrameMetadata]], formats: list[str] | None = None, kind: str = "manual", stack_count: int = 1, suffix: str = "") -> list[str]:
+        """
+        kind is the retention class: "manual", "event", "auto" or "night".
+        stack_count is recorded in the catalog for stacked images.
+        suffix is appended to the file name, e.g. "_deep".
+        """
         saved: list[str] = []
+        if self.paused:
+            logging.warning("Save skipped: exports paused under memory pressure")
+            return saved
+        if not self.writer.space_ok(self.base_dir):
+            logging.warning("Save skipped: disk nearly full")
+            return saved
+
         use_formats = formats if formats is not None else self.cfg["formats"]
+        if "archive" in use_formats and "archive" not in self.disabled_formats and frames:
+            path = self.save_archive(frames, kind)
+            if path is not None:
+                saved.append(path)
         for img, meta in frames:
-            ts = datetime.fromtimestamp(meta.timestamp).strftime("%Y%m%d_%H%M%S")
-            base = f"{ts}_f{meta.frame_id}"
-            if "jpg" in use_formats:
-                fn = os.path.join(self.base_dir, base + ".jpg")
-                cv2.imwrite(fn, img)
-                saved.append(fn)
-            if "png" in use_formats:
-                fn = os.path.join(self.base_dir, base + ".png")
-                cv2.imwrite(fn, img)
-                saved.append(fn)
-            if "npy" in use_formats:
-                fn = os.path.join(self.base_dir, base + ".npy")
-                np.save(fn, img)
-                saved.append(fn)
+            for fn in self.paths(meta, use_formats, suffix):
+                fmt = fn.rsplit(".", 1)[-1]
+                data = self.encode(img, fmt)
+                if data is None:
+                    logging.error("Failed to encode frame %d as %s", meta.frame_id, fmt)
+                    continue
+                on_done = functools.partial(self._written, meta, fmt, kind, stack_count, len(data))
+                if self._write(fn, data, on_done):
+                    saved.append(fn)
         return saved
 
-    def stack_and_save(self, frames: List[Tuple[np.ndarray, FrameMetadata]], formats: list[str] | None = None) -> list[str]:
+    def paths(self, meta: FrameMetadata, formats: list[str] | None = None, suffix: str = "") -> list[str]:
+        """Files save() writes for one frame, in format order."""
+        use_formats = formats if formats is not None else self.cfg["formats"]
+        ts = datetime.fromtimestamp(meta.timestamp).strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(self.base_dir, f"{ts}_f{meta.frame_id}{suffix}")
+        return [
+            f"{base}.{fmt}" for fmt in EXPORT_FORMATS
+            if fmt in use_formats and fmt not in self.disabled_formats
+        ]
+
+    def save_archive(self, frames: List[Tuple[np.ndarray, FrameMetadata]], kind: str) -> str | None:
+        """
+        All frames in one chunked container (archive.py), streamed to disk
+        frame by frame in the calling thread. Cataloged once, with the
+        first frame's metadata and the frame count as stack_count.
+        """
+        first = frames[0][1]
+        ts = datetime.fromtimestamp(first.timestamp).strftime("%Y%m%d_%H%M%S")
+        base = os.path.join(self.base_dir, f"{ts}_f{first.frame_id}_x{len(frames)}")
+        try:
+            path = write_archive(base, frames, self.cfg["archive"])
+        except Exception as e:
+            logging.error("Failed to write archive of %d frames: %s", len(frames), e)
+            return None
+        # Written synchronously: registered once it is in place, like a finished async write
+        self._written(first, "archive", kind, len(frames), os.path.getsize(path), path, True)
+        return path
+
+    def stack_and_save(self, frames: List[Tuple[np.ndarray, FrameMetadata]], formats: list[str] | None = None, kind: str = "event") -> list[str]:
+        """One image averaged from frames; image formats only (an archive of one stacked frame is no archive)."""
         if not frames:
             return []
+        use_formats = formats if formats is not None else self.cfg["formats"]
+        formats = [fmt for fmt in use_formats if fmt != "archive"]
         imgs = [f[0].astype("float32") for f in frames]
         stacked = sum(imgs) / len(imgs)
         stacked = stacked.clip(0, 255).astype("uint8")
-        return self.save([(stacked, frames[-1][1])], formats)
+        return self.save([(stacked, frames[-1][1])], formats, kind, len(frames))
+
+    def describe(self) -> dict:
+        return self.writer.describe()
+
+    def describe_retention(self) -> dict | None:
+        return self.retention.describe() if self.retention is not None else None
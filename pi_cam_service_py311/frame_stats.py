@@ -0,0 +1,138 @@
+import math
+import numpy as np
+
+
+class RollingWindow:
+    """
+    EMA plus min/max/mean over the last N seconds of a scalar signal.
+    Samples are folded into one bucket (min, max, sum, count) per second
+    of ts, so the window covers its full length at any frame rate and
+    memory does not grow with time. Queries cover whole seconds: the
+    current one and the `seconds` before it. ts must not go backwards:
+    pass time.monotonic(), not the wall clock.
+    """
+
+    def __init__(self, seconds: float, alpha: float) -> None:
+        buckets = math.ceil(seconds) + 1
+        self.second = np.full(buckets, -1, dtype=np.int64)
+        self.lo = np.zeros(buckets)
+        self.hi = np.zeros(buckets)
+        self.sum = np.zeros(buckets)
+        self.count = np.zeros(buckets, dtype=np.int64)
+        self.newest = -1
+        self.alpha = alpha
+        self.ema: float | None = None
+        self.last: float | None = None
+
+    def push(self, ts: float, value: float) -> None:
+        second = int(ts)
+        i = second % len(self.second)
+        if self.second[i] != second:
+            self.second[i] = second
+            self.lo[i] = self.hi[i] = self.sum[i] = value
+            self.count[i] = 1
+        else:
+            self.lo[i] = min(self.lo[i], value)
+            self.hi[i] = max(self.hi[i], value)
+            self.sum[i] += value
+            self.count[i] += 1
+        self.newest = max(self.newest, second)
+        self.last = value
+        self.ema = value if self.ema is None else self.ema + self.alpha * (value - self.ema)
+
+    def _recent(self, seconds: float) -> np.ndarray:
+        return (self.count > 0) & (self.second >= self.newest - math.ceil(seconds))
+
+    def covers(self, seconds: float) -> bool:
+        """True once samples reach back over the whole window."""
+        recent = self._recent(seconds)
+        return bool(recent.any()) and int(self.second[recent].min()) <= self.newest - math.ceil(seconds)
+
+    def min(self, seconds: float) -> float | None:
+        recent = self._recent(seconds)
+        return float(self.lo[recent].min()) if recent.any() else None
+
+    def max(self, seconds: float) -> float | None:
+        recent = self._recent(seconds)
+        return float(self.hi[recent].max()) if recent.any() else None
+
+    def mean(self, seconds: float) -> float | None:
+        recent = self._recent(seconds)
+        return float(self.sum[recent].sum() / self.count[recent].sum()) if recent.any() else None
+
+    def describe(self, seconds: float) -> dict:
+        return {
+            "last": self.last,
+            "ema": self.ema,
+            "min": self.min(seconds),
+            "max": self.max(seconds),
+        }
+
+
+class FrameStats:
+    """
+    Per-frame statistics computed on the analysis thumbnail:
+    histogram, per-channel means, clipped-pixel fractions and sharpness
+    (variance of the Laplacian), plus rolling windows of the scalar signals.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        seconds = max(cfg["window_s"], cfg["overexposed_s"])
+        alpha = cfg["ema_alpha"]
+        self.brightness = RollingWindow(seconds, alpha)
+        self.clipped_high = RollingWindow(seconds, alpha)
+        self.clipped_low = RollingWindow(seconds, alpha)
+        self.sharpness = RollingWindow(seconds, alpha)
+
+        self.histogram = np.zeros(cfg["hist_bins"], dtype=np.int64)
+        self.channel_means = np.zeros(3)
+        self.frames = 0
+
+    def update(self, small: np.ndarray, gray: np.ndarray, ts: float) -> None:
+        """small: downscaled BGR uint8 frame, gray: its float32 grayscale, ts: time.monotonic()."""
+        pixels = small.reshape(-1, small.shape[-1]) if small.ndim == 3 else small.reshape(-1, 1)
+        self.channel_means = pixels.mean(axis=0)
+
+        bins = self.cfg["hist_bins"]
+        idx = gray.astype(np.int32).ravel() * bins // 256
+        self.histogram = np.bincount(idx, minlength=bins)
+
+        peak = pixels.max(axis=1)
+        low = pixels.min(axis=1)
+        n = peak.size
+        clipped_high = np.count_nonzero(peak >= self.cfg["clip_high"]) / n
+        clipped_low = np.count_nonzero(low <= self.cfg["clip_low"]) / n
+
+        lap = (
+            4 * gray[1:-1, 1:-1]
+            - gray[:-2, 1:-1] - gray[2:, 1:-1]
+            - gray[1:-1, :-2] - gray[1:-1, 2:]
+        )
+
+        self.brightness.push(ts, float(gray.mean()))
+        self.clipped_high.push(ts, clipped_high)
+        self.clipped_low.push(ts, clipped_low)
+        self.sharpness.push(ts, float(lap.var()))
+        self.frames += 1
+
+    def overexposed(self) -> bool:
+        """Clipped fraction stayed above the limit for the whole overexposed_s window."""
+        seconds = self.cfg["overexposed_s"]
+        # One clipped frame after a start or a mode change is not overexposure
+        if not self.clipped_high.covers(seconds):
+            return False
+        return self.clipped_high.min(seconds) > self.cfg["overexposed_fraction"]
+
+    def describe(self) -> dict:
+        window = self.cfg["window_s"]
+        return {
+            "frames": self.frames,
+            "window_s": window,
+            "brightness": self.brightness.describe(window),
+            "clipped_high": self.clipped_high.describe(window),
+            "clipped_low": self.clipped_low.describe(window),
+            "sharpness": self.sharpness.describe(window),
+            "channel_means_bgr": [round(float(v), 1) for v in self.channel_means],
+            "histogram": self.histogram.tolist(),
+        }
@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+
+def _pyramid_shapes(height: int, width: int, levels: int) -> list[tuple[int, int]]:
+    shapes = [(height, width)]
+    for _ in range(levels - 1):
+        height, width = (height + 1) // 2, (width + 1) // 2
+        shapes.append((height, width))
+    return shapes
+
+
+def fusion_weights(small: np.ndarray, contrast_w: float, saturation_w: float, exposure_w: float, sigma: float = 0.2) -> np.ndarray:
+    """
+    Mertens weights of a stack of small images (N, h, w, 3) in [0, 1]:
+    contrast (Laplacian of grey), saturation (std of the channels) and
+    well-exposedness, normalized to sum to 1 per pixel. Returns (N, h, w).
+    """
+    grey = small.mean(axis=3)
+    padded = np.pad(grey, ((0, 0), (1, 1), (1, 1)), mode="edge")
+    contrast = np.abs(
+        padded[:, :-2, 1:-1] + padded[:, 2:, 1:-1] + padded[:, 1:-1, :-2] + padded[:, 1:-1, 2:] - 4 * grey
+    )
+    saturation = small.std(axis=3)
+    exposedness = np.exp(-((small - 0.5) ** 2) / (2 * sigma ** 2)).prod(axis=3)
+
+    weights = contrast ** contrast_w * saturation ** saturation_w * exposedness ** exposure_w + 1e-12
+    weights /= weights.sum(axis=0, keepdims=True)
+    return weights.astype(np.float32)
+
+
+def exposure_fusion(images: list[np.ndarray], levels: int = 6, weight_level: int = 2,
+                    contrast_w: float = 1.0, saturation_w: float = 1.0, exposure_w: float = 1.0) -> np.ndarray:
+    """
+    Mertens exposure fusion of a bracket (uint8 images of the same size).
+
+    Weights are only computed at pyramid level weight_level (1/2**level of
+    the size), their Gaussian pyramid is built from there (finer levels are
+    upsampled, weights are smooth anyway). Images are blended one at a time
+    into an accumulated Laplacian pyramid, so memory is about two float32
+    pyramids whatever the bracket length.
+    """
+    height, width = images[0].shape[:2]
+    levels = max(1, min(levels, int(np.log2(min(height, width))) - 2))
+    weight_level = min(weight_level, levels - 1)
+    shapes = _pyramid_shapes(height, width, levels)
+
+    small_h, small_w = shapes[weight_level]
+    small = np.stack([
+        cv2.resize(img, (small_w, small_h), interpolation=cv2.INTER_AREA) for img in images
+    ]).astype(np.float32) / 255
+    weights = fusion_weights(small, contrast_w, saturation_w, exposure_w)
+    del small
+
+    acc = [np.zeros(shape + (3,), np.float32) for shape in shapes]
+    for img, weight in zip(images, weights):
+        # Gaussian pyramid of the weight, from the level it was computed at
+        w_pyr = [None] * levels
+        w_pyr[weight_level] = weight
+        for level in range(weight_level + 1, levels):
+            w_pyr[level] = cv2.pyrDown(w_pyr[level - 1], dstsize=shapes[level][::-1])
+        for level in range(weight_level - 1, -1, -1):
+            w_pyr[level] = cv2.resize(weight, shapes[level][::-1], interpolation=cv2.INTER_LINEAR)
+
+        # Laplacian pyramid of the image, blended level by level
+        current = img.astype(np.float32)
+        for level in range(levels - 1):
+            down = cv2.pyrDown(current, dstsize=shapes[level + 1][::-1])
+            current -= cv2.pyrUp(down, dstsize=shapes[level][::-1])
+            acc[level] += current * w_pyr[level][..., None]
+            current = down
+        acc[-1] += current * w_pyr[-1][..., None]
+
+    fused = acc[-1]
+    for level in range(levels - 2, -1, -1):
+        fused = cv2.pyrUp(fused, dstsize=shapes[level][::-1]) + acc[level]
+    fused += 0.5
+    return fused.clip(0, 255).astype(np.uint8)
+
+
+class HDRFusion:
+    """
+    Background pool for exposure fusion of `save hdr` brackets, with the
+    timings of the last bracket (capture and fusion) and the number of
+    brackets still queued or fusing.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        self.pool = ThreadPoolExecutor(max_workers=cfg["workers"], thread_name_prefix="hdr")
+        self.lock = threading.Lock()
+        self.last: dict | None = None
+        self.count = 0
+        self.pending = 0
+
+    def submit(self, job) -> None:
+        """Run job in the pool; nobody waits for it, so a failure is logged and recorded as the last result."""
+        with self.lock:
+            self.pending += 1
+
+        def run():
+            try:
+                job()
+            except Exception as e:
+                logging.error("HDR fusion failed: %s", e)
+                self.record(error=str(e))
+            finally:
+                with self.lock:
+                    self.pending -= 1
+
+        self.pool.submit(run)
+
+    def fuse(self, images: list[np.ndarray]) -> tuple[np.ndarray, float]:
+        start = time.time()
+        fused = exposure_fusion(
+            images,
+            levels=self.cfg["levels"],
+            weight_level=self.cfg["weight_level"],
+            contrast_w=self.cfg["contrast_weight"],
+            saturation_w=self.cfg["saturation_weight"],
+            exposure_w=self.cfg["exposure_weight"],
+        )
+        return fused, time.time() - start
+
+    def record(self, **result) -> None:
+        with self.lock:
+            if result.get("files"):
+                self.count += 1
+            self.last = result
+        logging.info("HDR: %s", result)
+
+    def describe(self) -> dict:
+        with self.lock:
+            return {"saved": self.count, "pending": self.pending, "last": self.last}
@@ -0,0 +1,308 @@
+"""
+Load test of the trigger port and the MJPEG server: concurrent /stream
+viewers, "health" pollers and "shortstream" pulls, all in one asyncio
+loop.
+
+    python3 loadtest.py --launch --viewers 8 --pollers 4 --pullers 2 --duration 60
+    python3 loadtest.py --host raspberrypi --viewers 4 --duration 30
+
+--launch starts the service from this directory on a synthetic camera
+(camera.synthetic), in a scratch directory with its own ports, and samples
+its CPU and RSS. Without it, the running service at --host is loaded.
+
+Prints a JSON report on stdout (use --output to also write it to a file),
+with the service version so runs can be compared across versions.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import psutil
+from bench_startup import query
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentiles(values: list[float]) -> dict | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": round(values[len(values) // 2], 4),
+        "p99": round(values[min(len(values) - 1, int(len(values) * 0.99))], 4),
+        "max": round(values[-1], 4),
+    }
+
+
+def service_version() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=SERVICE_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class LoadTest:
+    def __init__(self, args, mjpeg_fps: float) -> None:
+        self.args = args
+        self.mjpeg_fps = mjpeg_fps
+        self.deadline = 0.0
+        self.latencies: dict[str, list[float]] = {"health": [], "shortstream": []}
+        self.errors: dict[str, int] = {"health": 0, "shortstream": 0, "stream": 0}
+        self.shortstream_frames = 0
+        self.viewers: list[dict] = []
+        self.node: list[dict] = []
+
+    async def command(self, cmd: str) -> bytes:
+        reader, writer = await asyncio.open_connection(self.args.host, self.args.port)
+        try:
+            writer.write(cmd.encode())
+            await writer.drain()
+            return await reader.read()
+        finally:
+            writer.close()
+
+    async def poller(self) -> None:
+        while time.time() < self.deadline:
+            start = time.time()
+            try:
+                reply = await asyncio.wait_for(self.command("health"), self.args.timeout)
+                if not reply.startswith(b"RSS="):
+                    raise ValueError(reply[:80])
+                self.latencies["health"].append(time.time() - start)
+            except (OSError, ValueError, asyncio.TimeoutError):
+                self.errors["health"] += 1
+            await asyncio.sleep(self.args.poll_interval)
+
+    async def pull(self) -> None:
+        reader, writer = await asyncio.open_connection(self.args.host, self.args.port)
+        try:
+            writer.write(f"shortstream {self.args.shortstream_frames}".encode())
+            await writer.drain()
+            while True:
+                (size,) = struct.unpack(">I", await reader.readexactly(4))
+                if size == 0:
+                    break
+                await reader.readexactly(size)
+                self.shortstream_frames += 1
+            await reader.read()     # STREAM_DONE line
+        finally:
+            writer.close()
+
+    async def puller(self) -> None:
+        while time.time() < self.deadline:
+            start = time.time()
+            try:
+                await asyncio.wait_for(self.pull(), self.args.timeout)
+                self.latencies["shortstream"].append(time.time() - start)
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError, struct.error):
+                self.errors["shortstream"] += 1
+            await asyncio.sleep(self.args.pull_interval)
+
+    async def viewer(self, index: int) -> None:
+        stats = {"viewer": index, "frames": 0, "bytes": 0, "repeated": 0, "dropped": 0, "min_quality": None, "fps": 0.0}
+        self.viewers.append(stats)
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.args.host, self.args.mjpeg_port), self.args.timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            self.errors["stream"] += 1
+            return
+        writer.write(f"GET /stream HTTP/1.1\r\nHost: {self.args.host}\r\n\r\n".encode())
+        await writer.drain()
+        first = last = None
+        last_id = None
+        try:
+            await reader.readuntil(b"\r\n\r\n")     # response headers
+            while time.time() < self.deadline:
+                headers = {}
+                block = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.args.timeout)
+                for line in block.decode(errors="replace").split("\r\n"):
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                size = int(headers["content-length"])
+                await reader.readexactly(size)
+
+                now = time.time()
+                frame_id = headers.get("x-frame-id")
+                if frame_id == last_id:
+                    stats["repeated"] += 1
+                last_id = frame_id
+                if last is not None:
+                    # Frames missing at the nominal rate
+                    stats["dropped"] += max(0, round((now - last) * self.mjpeg_fps) - 1)
+                first = first or now
+                last = now
+                stats["frames"] += 1
+                stats["bytes"] += size
+                quality = int(headers.get("x-quality", 0))
+                stats["min_quality"] = quality if stats["min_quality"] is None else min(stats["min_quality"], quality)
+        except (OSError, ValueError, KeyError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            self.errors["stream"] += 1
+        finally:
+            writer.close()
+        stats["fps"] = round((stats["frames"] - 1) / (last - first), 2) if first and last > first else 0.0
+
+    async def monitor(self, pid: int) -> None:
+        process = psutil.Process(pid)
+        process.cpu_percent()
+        start = time.time()
+        while time.time() < self.deadline:
+            await asyncio.sleep(self.args.sample_interval)
+            try:
+                self.node.append({
+                    "t": round(time.time() - start, 1),
+                    "cpu_percent": process.cpu_percent(),
+                    "rss_mb": round(process.memory_info().rss / (1024 * 1024), 1),
+                    "threads": process.num_threads(),
+                })
+            except psutil.Error:
+                return
+
+    async def run(self, pid: int | None) -> None:
+        self.deadline = time.time() + self.args.duration
+        tasks = [self.viewer(i) for i in range(self.args.viewers)]
+        tasks += [self.poller() for _ in range(self.args.pollers)]
+        tasks += [self.puller() for _ in range(self.args.pullers)]
+        if pid is not None:
+            tasks.append(self.monitor(pid))
+        await asyncio.gather(*tasks)
+
+    def report(self) -> dict:
+        fps = [v["fps"] for v in self.viewers]
+        node = None
+        if self.node:
+            node = {
+                "cpu_percent_mean": round(sum(s["cpu_percent"] for s in self.node) / len(self.node), 1),
+                "cpu_percent_max": max(s["cpu_percent"] for s in self.node),
+                "rss_mb_first": self.node[0]["rss_mb"],
+                "rss_mb_max": max(s["rss_mb"] for s in self.node),
+                "samples": self.node,
+            }
+        return {
+            "latency_s": {name: percentiles(values) for name, values in self.latencies.items()},
+            "errors": self.errors,
+            "shortstream_frames": self.shortstream_frames,
+            "viewers": {
+                "mjpeg_fps": self.mjpeg_fps,
+                "fps_min": min(fps) if fps else None,
+                "fps_mean": round(sum(fps) / len(fps), 2) if fps else None,
+                "dropped": sum(v["dropped"] for v in self.viewers),
+                "repeated": sum(v["repeated"] for v in self.viewers),
+                "per_viewer": self.viewers,
+            },
+            "node": node,
+        }
+
+
+def launch(args) -> tuple[subprocess.Popen, str, dict]:
+    """Start the service on a synthetic camera in a scratch directory; returns once it captures."""
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    with open(os.path.join(SERVICE_DIR, "config.json")) as f:
+        cfg = json.load(f)
+    cfg["camera"]["synthetic"] = True
+    cfg["network"]["trigger_port"] = args.port
+    cfg["mjpeg_server"]["enable"] = True
+    cfg["mjpeg_server"]["port"] = args.mjpeg_port
+    with open(os.path.join(workdir, "config.json"), "w") as f:
+        f.write(json.dumps(cfg, indent=4, sort_keys=True))
+
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SERVICE_DIR, "main.py")],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"service exited with code {proc.returncode} (logs in {workdir})")
+        try:
+            if json.loads(query(args.port, "startup"))["first_frame_s"] is not None:
+                return proc, workdir, cfg
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise SystemExit(f"service did not capture within 60s (logs in {workdir})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--launch", action="store_true", help="start the service on a synthetic camera")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="trigger port (default: from config.json)")
+    parser.add_argument("--mjpeg-port", type=int, default=None, help="MJPEG port (default: from config.json)")
+    parser.add_argument("--viewers", type=int, default=4, help="concurrent /stream viewers")
+    parser.add_argument("--pollers", type=int, default=2, help="concurrent health pollers")
+    parser.add_argument("--pullers", type=int, default=1, help="concurrent shortstream pullers")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between health polls per poller")
+    parser.add_argument("--pull-interval", type=float, default=5.0, help="seconds between shortstream pulls per puller")
+    parser.add_argument("--shortstream-frames", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="CPU/RSS sampling period")
+    parser.add_argument("--pid", type=int, default=None, help="service PID to sample (local service without --launch)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory of --launch")
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with open(os.path.join(SERVICE_DIR, "config.json")) as f:
+        cfg = json.load(f)
+    args.port = args.port or cfg["network"]["trigger_port"]
+    args.mjpeg_port = args.mjpeg_port or cfg["mjpeg_server"]["port"]
+
+    started = time.strftime("%Y-%m-%d %H:%M:%S")
+    proc = workdir = None
+    pid = args.pid
+    if args.launch:
+        args.host = "127.0.0.1"
+        proc, workdir, cfg = launch(args)
+        pid = proc.pid
+    try:
+        test = LoadTest(args, cfg["mjpeg_server"]["fps"])
+        asyncio.run(test.run(pid))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "version": service_version(),
+        "started": started,
+        "params": {
+            "launch": args.launch, "host": args.host, "viewers": args.viewers, "pollers": args.pollers,
+            "pullers": args.pullers, "duration_s": args.duration, "poll_interval_s": args.poll_interval,
+            "pull_interval_s": args.pull_interval, "shortstream_frames": args.shortstream_frames,
+        },
+        **test.report(),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    latency = report["latency_s"]["health"]
+    print(
+        f"health p50/p99 {latency['p50'] if latency else '-'}/{latency['p99'] if latency else '-'}s, "
+        f"viewer fps min {report['viewers']['fps_min']}, dropped {report['viewers']['dropped']}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,39 @@
-import concurrent.futures
-import gc
+import time
+
+STARTED = time.time()
+
+import atexit
 import json
 import logging
-import time
+import multiprocessing
+import struct
+import threading
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 
-import numpy as np
-import psutil
-import io
-import struct
-import cv2
-
-from camera_controller import CameraController
-from exporter import Exporter
-from night_mode import NightModeController
-from ring_buffer import RingBuffer
+# Light modules only: numpy, cv2, psutil and picamera2 are imported
+# by the startup phases below, after the trigger server is listening.
+from settings import ConfigStore
 from trigger_server import TriggerServer
-from metadata import FrameMetadata
 
-def update_cfg(cfg: dict, key_path: str, value) -> bool:
-    """
-    Update a nested cfg key with a new value.
-    key_path: e.g., "camera.framerate" or "night.bright_threshold"
-    value: new value (converted to appropriate type if needed)
-    Returns True if updated, False if key not found.
-    """
-    keys = key_path.split(".")
-    sub = cfg
-    for k in keys[:-1]:
-        if k not in sub:
-            return False
-        sub = sub[k]
-    last_key = keys[-1]
-    if last_key not in sub:
-        return False
-
-    current_type = type(sub[last_key])
-    if current_type is bool:
-        # accept 1/0, true/false
-        sub[last_key] = str(value).lower() in ("1", "true", "yes")
-    else:
-        sub[last_key] = current_type(value)
+def get_frames_for_save(ring: "RingBuffer", cfg: dict) -> "list[tuple[np.ndarray, FrameMetadata]]":
+    frames = get_save_window(ring, cfg)
+    if not frames or not cfg["export"]["stack_dark_frames"]:
+        return frames
+    return stack_window(frames, cfg)
+
+
+def get_save_window(ring: "RingBuffer", cfg: dict) -> "list[tuple[np.ndarray, FrameMetadata]]":
+    """The last save_before_s of the ring."""
+    return ring.get_last(int(cfg["export"]["save_before_s"] * cfg["camera"]["framerate"]))
 
-    return True
 
-def get_frames_for_save(ring: RingBuffer, cfg: dict) -> list[tuple[np.ndarray, FrameMetadata]]:
+def stack_window(frames: list, cfg: dict) -> list:
+    """The stack_count frames of a save window that are stacked."""
     fps = cfg["camera"]["framerate"]
     save_before_s = cfg["export"]["save_before_s"]
     stack_count = cfg["export"]["stack_count"]
 
-    total_frames = int(save_before_s * fps)
-    frames = ring.get_last(total_frames)
-
-    if not frames:
-        return []
-
-    if not cfg["export"]["stack_dark_frames"]:
-        return frames
-
     center_idx = max(0, len(frames) - int(fps * save_before_s))
 
     half_stack = stack_count // 2
@@ -67,6 +42,35 @@ def get_frames_for_save(ring: RingBuffer, cfg: dict) -> list[tuple[np.ndarray, F
 
     return frames[start_idx:end_idx]
 
+
+def save_past_frames(ring: "RingBuffer", exporter: "Exporter", cfg: dict, formats: list[str] | None = None) -> dict:
+    """
+    pastStack: save the last save_before_s of the ring. An archive always
+    holds the whole window as captured; with stack_dark_frames the image
+    formats get one image stacked from stack_count frames of it, otherwise
+    one image per frame. Returns the window, the frames used for images
+    and the saved files.
+    """
+    use_formats = formats if formats is not None else cfg["export"]["formats"]
+    image_formats = [fmt for fmt in use_formats if fmt != "archive"]
+    window = get_save_window(ring, cfg)
+    result = {"window": window, "images_from": [], "stacked": False, "archive": None, "images": []}
+    if not window:
+        return result
+
+    if "archive" in use_formats:
+        saved = exporter.save(window, ["archive"], "event")
+        result["archive"] = saved[0] if saved else None
+    if image_formats:
+        if cfg["export"]["stack_dark_frames"]:
+            result["images_from"] = stack_window(window, cfg)
+            result["stacked"] = True
+            result["images"] = exporter.stack_and_save(result["images_from"], image_formats)
+        else:
+            result["images_from"] = window
+            result["images"] = exporter.save(window, image_formats, "event")
+    return result
+
 def setup_logging(cfg: dict) -> None:
     log_level = getattr(logging, cfg["logging"]["level"].upper(), logging.INFO)
 
@@ -104,10 +108,14 @@ def setup_logging(cfg: dict) -> None:
     logger.addHandler(console)
     logger.addHandler(file)
 
-def adjust_ring_size(cfg: dict) -> int:
+def adjust_ring_size(cfg: dict, reclaimable_bytes: int = 0) -> int:
+    """reclaimable_bytes: memory of the current ring that is freed by a live resize."""
+    import numpy as np
+    import psutil
+
     vm = psutil.virtual_memory()
 
-    usable_bytes = int(vm.available * 0.50)
+    usable_bytes = int((vm.available + reclaimable_bytes) * 0.50)
 
     # Determine ring image resolution
     source = ""
@@ -159,28 +167,6 @@ def adjust_ring_size(cfg: dict) -> int:
     )
 
     return effective
-    
-# Configuration
-
-with open("config.json") as f:
-    cfg = json.load(f)
-
-setup_logging(cfg)
-
-# Initialize components
-
-effective_ring_size = adjust_ring_size(cfg)
-ring = RingBuffer(effective_ring_size)
-exporter = Exporter(cfg["export"])
-cam = CameraController(cfg, ring)
-night_ctrl = NightModeController(cfg["night"])
-
-process = psutil.Process()
-last_mem_log = 0
-last_auto_save = 0
-
-CAPTURE_TIMEOUT = cfg["camera"].get("capture_timeout_s", 4.0)
-MAX_RSS_MB = 350  # hard safety limit for Pi 1B+
 
 # Helper
 
@@ -190,366 +176,968 @@ def log_mode_change(old, new):
         if old is None or old.get(k) != new.get(k):
             logging.info("  %s: %s → %s", k, old.get(k) if old else None, new[k])
 
-def log_memory(prefix=""):
-    rss = process.memory_info().rss / (1024*1024)
-    swap = psutil.swap_memory().percent
-    logging.info("%sRSS=%.1f MiB | SWAP=%.1f%%", prefix, rss, swap)
-    return rss, swap
 
-# Start camera
+class CameraService:
+    """
+    The camera service as an object, so it can be imported and driven
+    from other scripts. start() brings it up in timed phases:
+
+    - config: read config.json, set up logging and the config store
+    - trigger: trigger server listening (answers NOT_READY until ready)
+    - imports: numpy, cv2, psutil and the component modules
+    - components: ring sizing, shared ring, exporter, analysis, governor
+    - camera: picamera2 import, camera open and start
+    - mjpeg: MJPEG server or worker process
+
+    run() is the capture loop; the time of its first frame completes
+    the startup report (startup command, logged once).
+    """
+
+    def __init__(self, config_path: str = "config.json", started: float | None = None) -> None:
+        self.config_path = config_path
+        self.started = STARTED if started is None else started
+        self.phases: list[tuple[str, float]] = []   # (name, duration_s)
+        self.phase = "init"
+        self.ready = False
+        self.trigger_ready_s: float | None = None
+        self.first_frame_s: float | None = None
+
+        self.cfg = None
+        self.store = None
+        self.shared_ring = None
+        self.mjpeg_fps_value = None     # fps shared with the MJPEG worker process
+        self.ring = None
+        self.exporter = None
+        self.motion = None
+        self.stats = None
+        self.calibration = None
+        self.accumulator = None
+        self.timelapse = None
+        self.hdr = None
+        self.rois = None
+        self.cam = None
+        self.watchdog = None
+        self.night_ctrl = None
+        self.process = None
+        self.governor = None
+        self.profiler = None
+        self.trace = None
+        self.applied_geometry = None
+        self.last_auto_save = 0
+
+    # Startup
+
+    def _run_phase(self, name: str, func) -> None:
+        self.phase = name
+        start = time.time()
+        func()
+        self.phases.append((name, time.time() - start))
+
+    def start(self) -> None:
+        self._run_phase("config", self._load_config)
+        self._run_phase("trigger", self._start_trigger)
+        self.trigger_ready_s = time.time() - self.started
+        logging.info("Trigger server ready after %.2fs", self.trigger_ready_s)
+        self._run_phase("imports", self._import_modules)
+        self._run_phase("components", self._create_components)
+        self._run_phase("camera", self._start_camera)
+        self._run_phase("mjpeg", self._start_mjpeg)
+        self._add_memory_steps()
+        self.phase = "first_frame"
+        self.ready = True
+
+    def _load_config(self) -> None:
+        with open(self.config_path) as f:
+            self.cfg = json.load(f)
+        setup_logging(self.cfg)
+        self.store = ConfigStore(self.cfg)
+
+    def _start_trigger(self) -> None:
+        TriggerServer(self.cfg["network"]["trigger_port"], self.handle_trigger).start()
+        logging.info("Trigger server started")
+
+    def _import_modules(self) -> None:
+        # Only loaded here so their cost is reported as its own phase
+        import cv2
+        import numpy
+        import psutil
+        import archive
+        import calibration
+        import camera_controller
+        import capture_watchdog
+        import capture_trace
+        import exporter
+        import frame_stats
+        import hdr
+        import memory_governor
+        import motion
+        import night_accumulator
+        import night_mode
+        import profiling
+        import ring_buffer
+        import roi
+        import shm_ring
+        import timelapse
+
+    def _create_components(self) -> None:
+        import psutil
+        from calibration import DarkCalibration
+        from capture_trace import TraceRecorder
+        from exporter import Exporter
+        from frame_stats import FrameStats
+        from hdr import HDRFusion
+        from memory_governor import MemoryGovernor
+        from motion import MotionDetector
+        from night_accumulator import NightAccumulator
+        from night_mode import NightModeController
+        from profiling import Profiler
+        from ring_buffer import RingBuffer
+        from roi import RoiSet
+        from shm_ring import SharedRing
+        from timelapse import TimelapseWriter
+
+        cfg = self.cfg
+        effective_ring_size = adjust_ring_size(cfg)
+
+        # Optional shared-memory mirror of the newest ring frames for worker processes
+        shared_cfg = cfg["ring"]["shared_memory"]
+        if shared_cfg["enable"]:
+            ring_settings = self.store.settings.ring
+            slot_bytes = ring_settings.width * ring_settings.height * 3
+            self.shared_ring = SharedRing(shared_cfg["name"], shared_cfg["slots"], slot_bytes)
+            atexit.register(self.shared_ring.close)
+            logging.info(
+                "Shared-memory ring '%s': %d slots, %.1f MiB",
+                shared_cfg["name"], shared_cfg["slots"], shared_cfg["slots"] * slot_bytes / (1024 * 1024)
+            )
+
+        self.ring = RingBuffer(effective_ring_size, self.shared_ring)
+        self.exporter = Exporter(cfg["export"])
+        self.motion = MotionDetector(cfg["motion"]) if cfg["motion"]["enable"] else None
+        self.stats = FrameStats(cfg["stats"]) if cfg["stats"]["enable"] else None
+        self.calibration = DarkCalibration(cfg["calibration"]) if cfg["calibration"]["enable"] else None
+        self.night_ctrl = NightModeController(self.store.settings.night)
+        if cfg["accumulator"]["enable"]:
+            self.accumulator = NightAccumulator(cfg["accumulator"])
+            # A night that ended while the service was down
+            if self.accumulator.stale(time.time()):
+                self.finish_night()
+        self.timelapse = TimelapseWriter(cfg["timelapse"]) if cfg["timelapse"]["enable"] else None
+        self.hdr = HDRFusion(cfg["hdr"])
+        self.rois = RoiSet(cfg["roi"])
+
+        self.process = psutil.Process()
+        self.governor = MemoryGovernor(cfg["memory"], self.process)
+        self.profiler = Profiler(cfg["profiling"])
+        self.trace = TraceRecorder(cfg["trace"], self.process)
+        if cfg["trace"]["enable"]:
+            self.trace.start(cfg)
+
+    def _start_camera(self) -> None:
+        from camera_controller import CameraController
+        from capture_watchdog import CaptureWatchdog
+
+        store = self.store
+        self.cam = CameraController(store, self.ring, self.motion, self.stats, self.calibration)
+        self.applied_geometry = (store.settings.camera, store.settings.ring)
+
+        # Live config changes
+        store.subscribe("camera.framerate", lambda key_path, settings: self.cam.update_settings())
+        store.subscribe("night.", lambda key_path, settings: setattr(self.night_ctrl, "cfg", settings.night))
+        store.subscribe("ring.size", self.apply_ring_geometry, transactional=True)
+        store.subscribe("ring.downscale.", self.apply_ring_geometry, transactional=True)
+        store.subscribe("camera.width", self.apply_ring_geometry, transactional=True)
+        store.subscribe("camera.height", self.apply_ring_geometry, transactional=True)
+
+        self.cam.start_video()
+        log_mode_change(None, self.cam.describe_mode())
+
+        if self.cfg["watchdog"]["enable"]:
+            self.watchdog = CaptureWatchdog(self.cfg["watchdog"], self.cam, store)
+            self.cam.watchdog = self.watchdog
+            self.watchdog.start()
+
+    def _start_mjpeg(self) -> None:
+        mjpeg_cfg = self.cfg.get("mjpeg_server", {})
+        if not mjpeg_cfg.get("enable", False):
+            return
+
+        from mjpeg_server import MJPEGServer, serve_shared
+
+        mjpeg_port = mjpeg_cfg.get("port", 8080)
+        mjpeg_fps = mjpeg_cfg.get("fps", 2)
+        cache_size = mjpeg_cfg.get("snapshot_cache", 16)
+        adaptive = mjpeg_cfg.get("adaptive")
+
+        if self.shared_ring is not None and mjpeg_cfg.get("worker_process", False):
+            # JPEG encoding runs in its own process, reading frames from shared memory.
+            # Spawned, not forked: the capture, trigger and watchdog threads are running
+            # and the log handlers belong to this process (the worker logs to its own file).
+            ctx = multiprocessing.get_context("spawn")
+            self.mjpeg_fps_value = ctx.Value("d", mjpeg_fps, lock=False)
+            ctx.Process(
+                target=serve_shared,
+                args=(self.shared_ring.name, mjpeg_port, mjpeg_fps, cache_size, adaptive, self.cfg["roi"]),
+                kwargs={
+                    "fps_value": self.mjpeg_fps_value,
+                    "log_file": "logs/mjpeg_worker.log",
+                    "log_level": logging.getLogger().level,
+                },
+                name="mjpeg-worker",
+                daemon=True,
+            ).start()
+        else:
+            MJPEGServer(mjpeg_port, self.ring, fps=mjpeg_fps, cache_size=cache_size, adaptive=adaptive, rois=self.rois).start()
+        self.store.subscribe("mjpeg_server.fps", lambda key_path, settings: self.set_mjpeg_fps(settings.mjpeg.fps))
+        RESET = "\033[0m"
+        GREEN = "\033[32m"
+        YELLOW = "\033[33m"
+        logging.info(f"MJPEG server started on port {mjpeg_port}")
+        logging.info(
+            f"Open {GREEN}http://raspberrypi:{mjpeg_port}/stream{RESET} "
+            f"in VLC, MJPEG-supported browsers ({mjpeg_fps} FPS) "
+            f"or with {YELLOW}python3 client.py{RESET}"
+        )
 
-cam.start_video()
-log_mode_change(None, cam.describe_mode())
+    def describe_startup(self) -> dict:
+        return {
+            "ready": self.ready,
+            "phase": self.phase,
+            "phases_ms": {name: round(duration * 1000, 1) for name, duration in self.phases},
+            "trigger_ready_s": round(self.trigger_ready_s, 3) if self.trigger_ready_s is not None else None,
+            "first_frame_s": round(self.first_frame_s, 3) if self.first_frame_s is not None else None,
+            "uptime_s": round(time.time() - self.started, 1),
+        }
+
+    def _log_startup(self) -> None:
+        logging.info(
+            "Startup: %s | trigger ready %.2fs, first frame %.2fs",
+            ", ".join(f"{name} {duration * 1000:.0f} ms" for name, duration in self.phases),
+            self.trigger_ready_s, self.first_frame_s
+        )
 
-# Trigger handler
+    # Live config changes
+
+    def log_memory(self, prefix=""):
+        import psutil
+
+        rss = self.process.memory_info().rss / (1024*1024)
+        swap = psutil.swap_memory().percent
+        logging.info("%sRSS=%.1f MiB | SWAP=%.1f%%", prefix, rss, swap)
+        return rss, swap
+
+    def apply_ring_geometry(self, key_path, settings):
+        """
+        Reconfigure the camera and reallocate the ring in one step.
+        Called again with the previous settings if the change is rolled back.
+        """
+        cam, ring = self.cam, self.ring
+        camera, ring_settings = settings.camera, settings.ring
+        old_camera, old_ring = self.applied_geometry
+        if (camera, ring_settings) == self.applied_geometry:
+            return
+
+        with cam.lock:
+            if (camera.width, camera.height) != (old_camera.width, old_camera.height):
+                self.applied_geometry = (camera, old_ring)
+                before = cam.describe_mode()
+                cam.reconfigure()
+                log_mode_change(before, cam.describe_mode())
+
+            if self.shared_ring is not None:
+                # Sized for one ring image: worker processes follow the new segment
+                self.shared_ring.resize(ring_settings.width * ring_settings.height * 3)
+            size = adjust_ring_size(self.cfg, reclaimable_bytes=ring.nbytes())
+            kept = ring.resize(size, (ring_settings.width, ring_settings.height))
+        self.applied_geometry = (camera, ring_settings)
+        logging.info(
+            "Ring reallocated: %d slots of %dx%d, %d recent frames kept",
+            size, ring_settings.width, ring_settings.height, kept
+        )
 
-def on_trigger(cmd: str, conn=None) -> str:
-    cmd = cmd.strip()
-    
-    if cmd == "dump_cam_exposure":
+    # HDR bracket
+
+    def save_hdr(self, formats: list[str] | None) -> str:
+        """
+        Capture an exposure bracket (camera held one exposure at a time),
+        then fuse and save it in the HDR pool. Replies once the bracket is
+        captured, with the file the fusion will write: the trigger port is
+        not held while fusing ("hdr" shows the result).
+        """
+        hdr_cfg = self.cfg["hdr"]
+        # Names the file and tags it in the catalog
+        if self.cam.last_frame is None:
+            return "ERROR: no frame captured yet"
+        start = time.time()
         try:
-            # Force a capture to get fresh metadata
-            _ = cam.cam.capture_array()
-            meta = cam.cam.capture_metadata()
-            return {
-                "ExposureTime": meta.get("ExposureTime"),
-                "AnalogueGain": meta.get("AnalogueGain"),
-                "AeEnable": meta.get("AeEnable"),
-            }
-            
+            bracket = self.cam.capture_bracket(hdr_cfg["evs"], hdr_cfg["settle_frames"])
         except Exception as e:
-            return f"ERROR dumping camera controls: {e}"
-    if cmd == "dump_cam_controls":
-        try:
-            # Force a capture to get fresh metadata
-            _ = cam.cam.capture_array()
-            meta = cam.cam.capture_metadata()
-
-            controls = cam.cam.camera_controls
-            out = {}
-
-            for name, ctrl in controls.items():
-                out[name] = {
-                    "min": getattr(ctrl, "min", None),
-                    "max": getattr(ctrl, "max", None),
-                    "default": getattr(ctrl, "default", None),
-                    "value": meta.get(name, None),
-                }
+            logging.error("HDR bracket capture failed: %s", e)
+            return f"ERROR: HDR bracket capture failed: {e}"
+        capture_s = time.time() - start
+        meta = self.cam.last_frame[1]
+
+        paths = self.exporter.paths(meta, formats, suffix="_hdr")
+        if not paths:
+            return "NOT_SAVED: no image format selected"
+
+        def fuse_and_save():
+            fused, fusion_s = self.hdr.fuse([img for img, _ in bracket])
+            saved = self.exporter.save([(fused, meta)], formats, "manual", len(bracket), suffix="_hdr")
+            self.hdr.record(
+                files=saved,
+                exposures_us=[exposure for _, exposure in bracket],
+                capture_s=round(capture_s, 3),
+                fusion_s=round(fusion_s, 3),
+            )
 
-            return json.dumps(out, indent=2, sort_keys=True)
+        self.hdr.submit(fuse_and_save)
+        return (
+            f"HDR_PENDING {paths[0]} | bracket of {len(bracket)} "
+            f"(exposures {', '.join(str(exposure) for _, exposure in bracket)} us) "
+            f"captured in {capture_s:.2f}s, fusing (see 'hdr')"
+        )
 
-        except Exception as e:
-            return f"ERROR dumping camera controls: {e}"
+    # Dark calibration
+
+    def calibrate_dark(self, frames: int) -> str:
+        """
+        Capture dark frames at the night exposure and gain (lens covered).
+        Holds the camera for frames x exposure, the ring is paused meanwhile.
+        """
+        cam = self.cam
+        with cam.lock:
+            was_video = cam.mode != "still"
+            if was_video:
+                cam.start_still(self.store.settings.night)
+            night = cam.night_cfg
+            try:
+                return self.calibration.build(cam.capture_dark, frames, night.exposure_us, night.gain)
+            except Exception as e:
+                self.calibration.build_status = f"failed: {e}"
+                logging.error("Dark calibration failed: %s", e)
+                return self.calibration.build_status
+            finally:
+                if was_video:
+                    cam.start_video()
+
+    # All-night accumulation
+
+    def finish_night(self) -> list[str]:
+        count = self.accumulator.count
+        result = self.accumulator.finish()
+        if result is None:
+            return []
+        deep, trails, meta = result
+        formats = self.cfg["accumulator"]["formats"]
+        saved = self.exporter.save([(deep, meta)], formats, "night", count, suffix="_deep")
+        saved += self.exporter.save([(trails, meta)], formats, "night", count, suffix="_trails")
+        logging.info("Night accumulator: %d frames → %s", count, saved)
+        return saved
+
+    # Memory governor steps, applied in order under pressure and reverted in reverse order
+
+    def shrink_ring(self):
+        size = max(1, int(self.ring.buffer.maxlen * self.cfg["memory"]["ring_shrink_factor"]))
+        with self.cam.lock:
+            self.ring.resize(size)
+        logging.warning("Ring shrunk to %d slots", size)
+
+    def restore_ring(self):
+        """
+        Grow the ring back only as far as the RSS watermarks allow: the
+        frames that fit between the non-ring RSS and the middle of
+        rss_low_mb..rss_high_mb, so a restored ring does not push RSS
+        straight back over rss_high_mb and shrink again.
+        """
+        memory_cfg = self.cfg["memory"]
+        ring_settings = self.store.settings.ring
+        frame_bytes = ring_settings.width * ring_settings.height * 3
+        with self.cam.lock:
+            ring_bytes = self.ring.nbytes()
+            rss_mb, _ = self.governor.sample()
+            non_ring_bytes = rss_mb * 1024 * 1024 - ring_bytes
+            target_bytes = (memory_cfg["rss_low_mb"] + memory_cfg["rss_high_mb"]) / 2 * 1024 * 1024
+            budget = max(0, int((target_bytes - non_ring_bytes) // frame_bytes))
+            current = self.ring.buffer.maxlen
+            size = max(current, min(adjust_ring_size(self.cfg, reclaimable_bytes=ring_bytes), budget))
+            if size != current:
+                self.ring.resize(size)
+        logging.info(
+            "Ring restored to %d slots (RSS %.1f MiB, %.1f MiB outside the ring, budget %d slots)",
+            size, rss_mb, non_ring_bytes / (1024 * 1024), budget
+        )
 
-    if cmd.startswith("set"):
-        parts = cmd.split(maxsplit=2)
-        if len(parts) < 3:
-            return "ERROR: usage set <key_path> <value>"
+    def set_mjpeg_fps(self, fps):
+        from mjpeg_server import MJPEGHandler
 
-        key_path, value = parts[1], parts[2]
+        MJPEGHandler.fps = fps
+        if self.mjpeg_fps_value is not None:
+            self.mjpeg_fps_value.value = fps
+        logging.info("MJPEG fps set to %.1f", fps)
 
-        # Read old value for logging
-        try:
-            keys = key_path.split(".")
-            sub = cfg
-            for k in keys[:-1]:
-                sub = sub[k]
-            last_key = keys[-1]
-            old_value = sub.get(last_key, None)
-        except Exception:
-            old_value = None
-
-        # Update cfg
-        success = update_cfg(cfg, key_path, value)
-
-        if success:
-            # Apply live changes to the camera if relevant
+    def pause_exports(self, paused):
+        self.exporter.paused = paused
+
+    def restart_for_memory(self):
+        logging.critical(
+            "RSS %.1f MiB / SWAP %.1f%% still high after all degradation steps → exiting for restart",
+            self.governor.rss_mb, self.governor.swap_percent
+        )
+        raise SystemExit(42)
+
+    def _add_memory_steps(self) -> None:
+        governor, exporter, store = self.governor, self.exporter, self.store
+        governor.add_step("shrink_ring", self.shrink_ring, self.restore_ring)
+        governor.add_step(
+            "drop_mjpeg_fps",
+            lambda: self.set_mjpeg_fps(min(store.settings.mjpeg.fps, self.cfg["memory"]["min_mjpeg_fps"])),
+            lambda: self.set_mjpeg_fps(store.settings.mjpeg.fps),
+        )
+        governor.add_step("disable_png", lambda: exporter.disabled_formats.add("png"), lambda: exporter.disabled_formats.discard("png"))
+        governor.add_step("pause_exports", lambda: self.pause_exports(True), lambda: self.pause_exports(False))
+        governor.add_step("restart", self.restart_for_memory)
+
+    # Trigger handler
+
+    def on_trigger(self, cmd: str, conn=None) -> str:
+        cmd = cmd.strip()
+
+        if cmd == "startup":
+            return self.describe_startup()
+
+        # Commands below need the components; the trigger port is up before them
+        if not self.ready:
+            return f"NOT_READY: starting ({self.phase}, {time.time() - self.started:.1f}s)"
+
+        cfg, store, cam, ring = self.cfg, self.store, self.cam, self.ring
+        exporter, motion, stats = self.exporter, self.motion, self.stats
+        night_ctrl, governor, profiler = self.night_ctrl, self.governor, self.profiler
+
+        if cmd == "dump_cam_exposure":
             try:
-                cam.update_settings()
-                logging.info(
-                    "Parameter updated via trigger: %s : %s → %s",
-                    key_path, old_value, value
-                )
+                # Force a capture to get fresh metadata
+                _ = cam.cam.capture_array()
+                meta = cam.cam.capture_metadata()
+                return {
+                    "ExposureTime": meta.get("ExposureTime"),
+                    "AnalogueGain": meta.get("AnalogueGain"),
+                    "AeEnable": meta.get("AeEnable"),
+                }
+
             except Exception as e:
-                logging.warning(
-                    "Parameter updated but failed to apply live: %s : %s → %s | %s",
-                    key_path, old_value, value, e
-                )
+                return f"ERROR dumping camera controls: {e}"
+        if cmd == "dump_cam_controls":
+            try:
+                # Force a capture to get fresh metadata
+                _ = cam.cam.capture_array()
+                meta = cam.cam.capture_metadata()
 
-            return f"OK: changed {key_path} from {old_value} to {value}"
-        else:
-            logging.warning("Failed to update parameter via trigger: %s → %s", key_path, value)
-            return f"ERROR: invalid key {key_path}"
+                controls = cam.cam.camera_controls
+                out = {}
 
-    if cmd.startswith("overwrite_config"):
-        try:
-            dump_file = Path("config.json")  # file to generate
-            # Write current cfg to JSON with indentation
-            with dump_file.open("w") as f:
-                json.dump(cfg, f, indent=4, sort_keys=True)
-            
-            logging.info("Current configuration dumped to %s", dump_file)
-            return f"OK: configuration dumped to {dump_file}"
+                for name, ctrl in controls.items():
+                    out[name] = {
+                        "min": getattr(ctrl, "min", None),
+                        "max": getattr(ctrl, "max", None),
+                        "default": getattr(ctrl, "default", None),
+                        "value": meta.get(name, None),
+                    }
 
-        except Exception as e:
-            logging.error("Failed to dump configuration: %s", e)
-            return f"ERROR: failed to dump configuration: {e}"
-        
-    if cmd.startswith("dump_config"):
-        try:
-            # Serialize the current cfg to JSON with indentation
-            cfg_json = json.dumps(cfg, indent=4, sort_keys=True)
-            logging.info("Configuration sent to trigger client")
-            return cfg_json
-        except Exception as e:
-            logging.error("Failed to serialize configuration: %s", e)
-            return f"ERROR: failed to get configuration: {e}"
-        
-    if cmd.startswith("save"):
-        parts = cmd.split()
-        formats = parts[1:] if len(parts) > 1 else None
-
-        # Capture full-resolution image directly
-        img = cam.capture_fullres()
-        meta = ring.get_last(1)[0][1]
-        saved_files = exporter.save([(img, meta)], formats)
-        del img
-
-        age_s = time.time() - meta.timestamp  # time since capture
-
-        msg = ""
-        if saved_files:
-            msg = f"Saved single full-resolution image: {saved_files[0]} (timestamp: {meta.timestamp:.3f}, age: {age_s:.2f}s)"
-        else:
-            msg = "NOT_SAVED"
+                return json.dumps(out, indent=2, sort_keys=True)
 
-        logging.info(msg)
-        return msg
+            except Exception as e:
+                return f"ERROR dumping camera controls: {e}"
 
-    if cmd.startswith("pastStack"):
-        parts = cmd.split()
-        formats = parts[1:] if len(parts) > 1 else None
+        if cmd.startswith("set"):
+            parts = cmd.split(maxsplit=2)
+            if len(parts) < 3:
+                return "ERROR: usage set <key_path> <value>"
 
-        frames_to_save = get_frames_for_save(ring, cfg)
-        if not frames_to_save:
-            msg = "NO_FRAMES"
-            logging.info(msg)
-            return msg
+            key_path, value = parts[1], parts[2]
 
-        now = time.time()
-        first_frame = frames_to_save[0][1]
-        last_frame = frames_to_save[-1][1]
-        age_first = now - first_frame.timestamp
-        age_last = now - last_frame.timestamp
+            # Read old value for logging
+            old_value = store.get(key_path)
 
-        # Determine whether stacking is applied
-        if cfg["export"]["stack_dark_frames"]:
-            saved_files = exporter.stack_and_save(frames_to_save, formats)
-            if saved_files:
-                msg = (
-                    f"Saved stacked image: {saved_files[0]} | stack of {len(frames_to_save)} frames | "
-                    f"first frame timestamp: {first_frame.timestamp:.3f} (age: {age_first:.2f}s) | "
-                    f"last frame timestamp: {last_frame.timestamp:.3f} (age: {age_last:.2f}s)"
-                    f"(export.save_before_s: {cfg['export']['save_before_s']:.3f} s)"
-                )
-            else:
-                msg = "NOT_SAVED"
-        else:
-            saved_files = exporter.save(frames_to_save, formats)
-            if saved_files:
-                msg = (
-                    f"Saved {len(saved_files)} separate images from ring buffer, "
-                    f"starting at timestamp: {first_frame.timestamp:.3f} (age: {age_first:.2f}s)"
-                    f"(export.save_before_s: {cfg['export']['save_before_s']:.3f} s)"
-                    f"bright_threshold: > {cfg['night']['bright_threshold']} "
+            # Update cfg, subscribers apply the change live
+            try:
+                success = store.set(key_path, value)
+            except ValueError as e:
+                logging.warning("Rejected parameter via trigger: %s → %s | %s", key_path, value, e)
+                return f"ERROR: invalid value for {key_path}: {e}"
+
+            if success:
+                logging.info(
+                    "Parameter updated via trigger: %s : %s → %s",
+                    key_path, old_value, value
                 )
+                return f"OK: changed {key_path} from {old_value} to {value}"
             else:
-                msg = "NOT_SAVED"
+                logging.warning("Failed to update parameter via trigger: %s → %s", key_path, value)
+                return f"ERROR: invalid key {key_path}"
 
-        logging.info(msg)
-        return msg
+        if cmd.startswith("overwrite_config"):
+            try:
+                dump_file = Path(self.config_path)  # file to generate
+                # Write current cfg to JSON with indentation
+                with dump_file.open("w") as f:
+                    json.dump(cfg, f, indent=4, sort_keys=True)
 
-    if cmd == "night_level":
-        if not ring.buffer:
-            return "NO_DATA"
+                logging.info("Current configuration dumped to %s", dump_file)
+                return f"OK: configuration dumped to {dump_file}"
 
-        meta = ring.buffer[-1][1]
-        status = "NIGHT" if night_ctrl.active else "DAY"
-        relavantCriterion = cfg['night']['bright_threshold'] if night_ctrl.active else cfg['night']['dark_threshold']
-        return (
-            f"LEVEL={meta.dark_score:.1f} "
-            f"relevant threshold={relavantCriterion} "
-            f"dark_threshold: < {cfg['night']['dark_threshold']} "
-            f"bright_threshold: > {cfg['night']['bright_threshold']} "
-            f"STATUS={status}"
-        )
-        
-    if cmd == "health":
-        rss, swap = log_memory("HEALTH ")
-        return f"RSS={rss:.1f}MiB SWAP={swap:.1f}%"
-    
-    # Example for streaming
-    if cmd.startswith("shortstream"):
-        if conn is None:
-            return "ERROR_NO_CONNECTION"
-
-        parts = cmd.split()
-        max_frames = int(parts[1]) if len(parts) > 1 else 10
-
-        frames_available = ring.get_last(max_frames)
-        frames_sent = 0
-
-        for img, meta in frames_available:
+            except Exception as e:
+                logging.error("Failed to dump configuration: %s", e)
+                return f"ERROR: failed to dump configuration: {e}"
+
+        if cmd.startswith("dump_config"):
             try:
-                success, encoded = cv2.imencode(".jpg", img)
-                if not success:
-                    continue
-                data = encoded.tobytes()
-                size = len(data)
-                conn.sendall(struct.pack(">I", size))
-                conn.sendall(data)
-                frames_sent += 1
+                # Serialize the current cfg to JSON with indentation
+                cfg_json = json.dumps(cfg, indent=4, sort_keys=True)
+                logging.info("Configuration sent to trigger client")
+                return cfg_json
             except Exception as e:
-                logging.error("Error sending frame: %s", e)
+                logging.error("Failed to serialize configuration: %s", e)
+                return f"ERROR: failed to get configuration: {e}"
 
-        # End-of-stream marker
-        try:
-            conn.sendall(struct.pack(">I", 0))
-        except:
-            pass
+        if cmd.startswith("save hdr"):
+            return self.save_hdr(cmd.split()[2:] or None)
 
-        skipped = len(frames_available) - frames_sent
-        msg = f"STREAM_DONE: sent={frames_sent}, skipped={skipped}, available={len(frames_available)}"
-        logging.info(msg)
-        return msg
+        if cmd.startswith("save"):
+            parts = cmd.split()
+            formats = parts[1:] if len(parts) > 1 else None
 
-    return "UNKNOWN_COMMAND"
+            # Capture full-resolution image directly
+            img = cam.capture_fullres()
+            meta = ring.get_last(1)[0][1]
+            saved_files = exporter.save([(img, meta)], formats)
+            del img
 
+            age_s = time.time() - meta.timestamp  # time since capture
 
-# Start trigger server
-TriggerServer(cfg["network"]["trigger_port"], on_trigger).start()
-logging.info("Trigger server started")
+            msg = ""
+            if saved_files:
+                msg = f"Saved single full-resolution image: {saved_files[0]} (timestamp: {meta.timestamp:.3f}, age: {age_s:.2f}s)"
+            else:
+                msg = "NOT_SAVED"
 
-# Start MJPEG Server
-from mjpeg_server import MJPEGServer
+            logging.info(msg)
+            return msg
 
-mjpeg_cfg = cfg.get("mjpeg_server", {})
-if mjpeg_cfg.get("enable", False):
-    mjpeg_port = mjpeg_cfg.get("port", 8080)
-    mjpeg_fps = mjpeg_cfg.get("fps", 2)
+        if cmd.startswith("pastStack"):
+            parts = cmd.split()
+            formats = parts[1:] if len(parts) > 1 else None
+
+            result = save_past_frames(ring, exporter, cfg, formats)
+            if not result["window"]:
+                msg = "NO_FRAMES"
+                logging.info(msg)
+                return msg
+
+            now = time.time()
+            replies = []
+            if result["archive"]:
+                window = result["window"]
+                replies.append(
+                    f"Saved archive of {len(window)} frames: {result['archive']} | "
+                    f"first frame timestamp: {window[0][1].timestamp:.3f} (age: {now - window[0][1].timestamp:.2f}s) | "
+                    f"last frame timestamp: {window[-1][1].timestamp:.3f} (age: {now - window[-1][1].timestamp:.2f}s)"
+                )
+            saved_files = result["images"]
+            if saved_files:
+                first_frame = result["images_from"][0][1]
+                last_frame = result["images_from"][-1][1]
+                age_first = now - first_frame.timestamp
+                age_last = now - last_frame.timestamp
+                if result["stacked"]:
+                    replies.append(
+                        f"Saved stacked image: {saved_files[0]} | stack of {len(result['images_from'])} frames | "
+                        f"first frame timestamp: {first_frame.timestamp:.3f} (age: {age_first:.2f}s) | "
+                        f"last frame timestamp: {last_frame.timestamp:.3f} (age: {age_last:.2f}s)"
+                        f"(export.save_before_s: {cfg['export']['save_before_s']:.3f} s)"
+                    )
+                else:
+                    replies.append(
+                        f"Saved {len(saved_files)} separate images from ring buffer, "
+                        f"starting at timestamp: {first_frame.timestamp:.3f} (age: {age_first:.2f}s)"
+                        f"(export.save_before_s: {cfg['export']['save_before_s']:.3f} s)"
+                        f"bright_threshold: > {cfg['night']['bright_threshold']} "
+                    )
+            msg = "; ".join(replies) if replies else "NOT_SAVED"
 
-    MJPEGServer(mjpeg_port, ring, fps=mjpeg_fps).start()
-    RESET = "\033[0m"
-    GREEN = "\033[32m"
-    YELLOW = "\033[33m"
-    logging.info(f"MJPEG server started on port {mjpeg_port}")
-    logging.info(
-        f"Open {GREEN}http://raspberrypi:{mjpeg_port}/stream{RESET} "
-        f"in VLC, MJPEG-supported browsers ({mjpeg_fps} FPS) "
-        f"or with {YELLOW}python3 client.py{RESET}"
-    )
+            logging.info(msg)
+            return msg
 
-# Main loop with timeout handling
-logging.info("Starting main capture loop")
-while True:
-    try:
-        # test health
-        rss, swap = log_memory() if time.time() - last_mem_log > 60 else (None, None)
-        last_mem_log = time.time()
-
-        if swap is not None:
-            if swap > 85:
-                logging.error("Critical swap %.1f%% → forcing GC + pause", swap)
-                gc.collect()
-                time.sleep(3)
-                continue
-
-            if swap > 70:
-                logging.warning("High swap %.1f%% → slowing capture", swap)
-                time.sleep(1.5)
-        start = time.time()
+        if cmd == "night_level":
+            # The last capture: a skipped near-duplicate is not in the ring
+            if cam.last_frame is None:
+                return "NO_DATA"
+
+            meta = cam.last_frame[1]
+            status = "NIGHT" if night_ctrl.active else "DAY"
+            relavantCriterion = cfg['night']['bright_threshold'] if night_ctrl.active else cfg['night']['dark_threshold']
+            smoothed = ""
+            if stats is not None and stats.frames:
+                window = cfg["stats"]["window_s"]
+                smoothed = (
+                    f"EMA={stats.brightness.ema:.1f} "
+                    f"MIN={stats.brightness.min(window):.1f} "
+                    f"MAX={stats.brightness.max(window):.1f} "
+                    f"(last {window}s) "
+                    f"CLIPPED={stats.clipped_high.last * 100:.1f}% "
+                )
+            return (
+                f"LEVEL={meta.dark_score:.1f} "
+                f"{smoothed}"
+                f"relevant threshold={relavantCriterion} "
+                f"dark_threshold: < {cfg['night']['dark_threshold']} "
+                f"bright_threshold: > {cfg['night']['bright_threshold']} "
+                f"STATUS={status}"
+            )
+
+        if cmd == "stats":
+            if stats is None:
+                return "STATS_DISABLED"
+            return stats.describe()
+
+        if cmd == "motion":
+            if motion is None:
+                return "MOTION_DISABLED"
+            return motion.describe()
+
+        if cmd == "health":
+            rss, swap = self.log_memory("HEALTH ")
+            w = exporter.describe()
+            return (
+                f"RSS={rss:.1f}MiB SWAP={swap:.1f}% "
+                f"WRITE_QUEUE={w['queue_depth']} WRITE_KIBS={w['throughput_kib_s']:.1f} "
+                f"FREE={w['free_mb']}MiB SAVES_PAUSED={int(w['paused'])} "
+                f"MEM_LEVEL={governor.level}"
+                + (f" {self.watchdog.health()}" if self.watchdog is not None else "")
+            )
+
+        if cmd == "memory":
+            return governor.describe()
+
+        if cmd.startswith("profile"):
+            parts = cmd.split()
+            action = parts[1] if len(parts) > 1 else "status"
+            usage = "ERROR: usage profile start [seconds] [sample|cprofile] | stop | status"
+            if action == "start":
+                try:
+                    seconds = float(parts[2]) if len(parts) > 2 else cfg["profiling"]["default_seconds"]
+                except ValueError:
+                    return usage
+                if not 0 < seconds < float("inf"):
+                    return "ERROR: profile seconds must be positive"
+                mode = parts[3] if len(parts) > 3 else "sample"
+                return profiler.start(seconds, mode)
+            if action == "stop":
+                return profiler.stop()
+            if action == "status":
+                return profiler.status()
+            return usage
+
+        if cmd.startswith("tracemalloc"):
+            parts = cmd.split()
+            return profiler.tracemalloc_command(parts[1] if len(parts) > 1 else "")
+
+        if cmd == "threads":
+            return profiler.dump_threads()
+
+        if cmd == "writer":
+            return exporter.describe()
+
+        if cmd.startswith("accumulator"):
+            if self.accumulator is None:
+                return "ACCUMULATOR_DISABLED"
+            if cmd.split()[1:] == ["finish"]:
+                saved = self.finish_night()
+                return f"Saved night images: {saved}" if saved else "NOT_SAVED"
+            return self.accumulator.describe()
+
+        if cmd.startswith("trace"):
+            parts = cmd.split()
+            action = parts[1] if len(parts) > 1 else "status"
+            if action == "start":
+                return f"TRACE_STARTED {self.trace.start(cfg)}"
+            if action == "stop":
+                path = self.trace.stop()
+                return f"TRACE_STOPPED {path}" if path else "NOT_RECORDING"
+            if action == "status":
+                return self.trace.describe()
+            return "ERROR: usage trace start | stop | status"
+
+        if cmd == "watchdog":
+            if self.watchdog is None:
+                return "WATCHDOG_DISABLED"
+            return self.watchdog.describe()
+
+        if cmd == "roi":
+            return self.rois.describe(store.settings.mjpeg.fps)
+
+        if cmd == "hdr":
+            return self.hdr.describe()
+
+        if cmd == "timelapse":
+            if self.timelapse is None:
+                return "TIMELAPSE_DISABLED"
+            return self.timelapse.describe()
+
+        if cmd.startswith("calibrate"):
+            if self.calibration is None:
+                return "CALIBRATION_DISABLED"
+            parts = cmd.split()
+            action = parts[1] if len(parts) > 1 else "status"
+            usage = "ERROR: usage calibrate dark [frames] | status"
+            if action == "dark":
+                if self.calibration.build_status.startswith("capturing"):
+                    return f"ERROR: calibration running ({self.calibration.build_status})"
+                try:
+                    frames = int(parts[2]) if len(parts) > 2 else cfg["calibration"]["frames"]
+                except ValueError:
+                    return usage
+                if frames < 1:
+                    return "ERROR: calibrate dark needs at least 1 frame"
+                self.calibration.build_status = f"capturing 0/{frames}"
+                threading.Thread(target=self.calibrate_dark, args=(frames,), name="calibration", daemon=True).start()
+                night = store.settings.night
+                return (
+                    f"CALIBRATION_STARTED frames={frames} exposure_us={night.exposure_us} gain={night.gain:g} "
+                    f"(keep the lens covered, about {frames * night.exposure_us / 1e6:.0f}s; see 'calibrate status')"
+                )
+            if action == "status":
+                return self.calibration.describe()
+            return usage
 
+        if cmd.startswith("query"):
+            if exporter.catalog is None:
+                return "CATALOG_DISABLED"
+            try:
+                return exporter.catalog.query_command(cmd.split()[1:])
+            except (ValueError, KeyError) as e:
+                return f"ERROR: usage query from=<time> to=<time> night=0|1 format=<fmt> kind=<kind> limit=<n> order=asc|desc ({e})"
+
+        if cmd == "retention":
+            return exporter.describe_retention() or "RETENTION_DISABLED"
+
+        # Example for streaming
+        if cmd.startswith("shortstream"):
+            import cv2
+
+            if conn is None:
+                return "ERROR_NO_CONNECTION"
+
+            parts = cmd.split()
+            roi = None
+            args = [part for part in parts[1:] if not part.startswith("roi=")]
+            for part in parts[1:]:
+                if part.startswith("roi="):
+                    roi = self.rois.get(part[4:])
+                    if roi is None:
+                        return f"ERROR: unknown ROI {part[4:]} (see 'roi')"
+            try:
+                max_frames = int(args[0]) if args else 10
+            except ValueError:
+                return "ERROR: usage shortstream [frames] [roi=<name>]"
+            if max_frames < 1 or len(args) > 1:
+                return "ERROR: usage shortstream [frames] [roi=<name>]"
+
+            frames_available = ring.get_last(max_frames)
+            frames_sent = 0
+
+            for img, meta in frames_available:
+                try:
+                    # A ROI is a view of the ring frame: only its pixels are encoded
+                    success, encoded = cv2.imencode(".jpg", roi.crop(img) if roi is not None else img)
+                    if not success:
+                        continue
+                    data = encoded.tobytes()
+                    size = len(data)
+                    conn.sendall(struct.pack(">I", size))
+                    conn.sendall(data)
+                    frames_sent += 1
+                except Exception as e:
+                    logging.error("Error sending frame: %s", e)
+
+            # End-of-stream marker
+            try:
+                conn.sendall(struct.pack(">I", 0))
+            except:
+                pass
+
+            skipped = len(frames_available) - frames_sent
+            msg = f"STREAM_DONE: sent={frames_sent}, skipped={skipped}, available={len(frames_available)}"
+            logging.info(msg)
+            return msg
+
+        return "UNKNOWN_COMMAND"
+
+    def add_timelapse(self, img, meta) -> None:
+        if self.timelapse is None:
+            return
         try:
-            cam.capture_once()
+            self.timelapse.add(img, meta.timestamp, meta.dark_score, meta.frame_id)
         except Exception as e:
-            RESET = "\033[0m"
-            RED = "\033[31m"
-            YELLOW = "\033[33m"
-            logging.error("{RED}Camera capture failed. Exit{RESET}: %s", e)
-            raise SystemExit(102)
-
-        duration = time.time() - start
-        # Take into account the exposure time during night
-        if cam.mode == "still":
-            duration -= cfg["night"]["exposure_us"] / 1000000
-        if duration > CAPTURE_TIMEOUT:
-            logging.warning(
-                "Camera capture slow (%.1fs > %.1fs)",
-                duration, CAPTURE_TIMEOUT
-            )
-            
+            logging.error(f"Timelapse append failed: {e}")
 
+    def handle_trigger(self, cmd: str, conn) -> str:
+        start = time.time()
+        response = self.on_trigger(cmd, conn)
+        if self.trace is not None and self.trace.active:
+            self.trace.command(cmd, start, time.time() - start, response)
+        return response
+
+    # Main loop with timeout handling
+
+    def run(self) -> None:
+        cfg, store, cam, ring = self.cfg, self.store, self.cam, self.ring
+        exporter, motion, stats = self.exporter, self.motion, self.stats
+        night_ctrl, governor, profiler = self.night_ctrl, self.governor, self.profiler
+        accumulator, trace, watchdog = self.accumulator, self.trace, self.watchdog
+        rois = self.rois
+
+        logging.info("Starting main capture loop")
+        while True:
+            try:
+                # Memory pressure: degrade step by step, restart only as the last step
+                governor.poll()
+                profiler.capture_hook()
+
+                settings = store.settings
+                start = time.time()
+
+                try:
+                    captured = cam.capture_once()
+                except Exception as e:
+                    if watchdog is not None:
+                        # Recovers in place, exits with 102 once recovery is exhausted
+                        watchdog.capture_failed(e)
+                        continue
+                    RESET = "\033[0m"
+                    RED = "\033[31m"
+                    YELLOW = "\033[33m"
+                    logging.error("{RED}Camera capture failed. Exit{RESET}: %s", e)
+                    raise SystemExit(102)
+                if watchdog is not None:
+                    watchdog.beat()
+
+                if self.first_frame_s is None:
+                    self.first_frame_s = time.time() - self.started
+                    self.phase = "running"
+                    self._log_startup()
+
+                duration = time.time() - start
+                capture_s = duration
+                # Take into account the exposure time during night
+                if cam.mode == "still":
+                    duration -= settings.night.exposure_us / 1000000
+                if duration > settings.camera.capture_timeout_s:
+                    logging.warning(
+                        "Camera capture slow (%.1fs > %.1fs)",
+                        duration, settings.camera.capture_timeout_s
+                    )
+
+
+
+                # Always evaluate brightness, regardless of camera mode, on the
+                # frame just captured (a skipped near-duplicate is not in the ring)
+                if stats is not None and settings.night.use_smoothed_score:
+                    night_score = stats.brightness.ema
+                else:
+                    night_score = captured.dark_score
+                event = night_ctrl.update(night_score)
+                if rois.rois:
+                    rois.update(*cam.last_frame, settings.mjpeg.fps)
+
+                if event == "ENTER" and cam.mode != "still":
+                    logging.info("Night detected *************************************")
+                    before = cam.describe_mode()
+                    cam.start_still(settings.night)
+                    after = cam.describe_mode()
+                    log_mode_change(before, after)
+
+                elif event == "EXIT" and cam.mode != "video":
+                    logging.info("Day detected *************************************")
+                    before = cam.describe_mode()
+                    cam.start_video()
+                    after = cam.describe_mode()
+                    log_mode_change(before, after)
+
+                overexposed = stats.overexposed() if stats is not None else captured.dark_score > 245
+                if overexposed and cam.mode == "video":
+                    logging.error("Overexposed frame detected → forcing video reset")
+                    cam.start_video()
+
+                # All-night deep and star-trail images, saved at dawn
+                if accumulator is not None:
+                    if night_ctrl.active and cam.mode == "still":
+                        accumulator.add(*cam.last_frame)
+                    elif event == "EXIT" or accumulator.stale(time.time()):
+                        self.finish_night()
+
+                if trace.active:
+                    trace.frame(captured, night_score, capture_s, cam.thumb)
+
+                # Motion events
+                if motion is not None and motion.last_event == "START":
+                    logging.info("Motion detected (%.1f%% of frame changed)", motion.score * 100)
+                    if cfg["motion"]["save_on_motion"]:
+                        frames = ring.get_last(1)
+                        if frames:
+                            try:
+                                saved = exporter.save(frames, cfg["motion"]["formats"], "event")
+                                logging.info(f"Motion save: {saved}")
+                            except Exception as e:
+                                logging.error(f"Motion save failed: {e}")
+                elif motion is not None and motion.last_event == "END":
+                    logging.info("Motion ended")
+
+                # Auto-save logic
+                now = time.time()
+                interval = settings.export.auto_save_interval_s
+                if interval > 0 and now - self.last_auto_save >= interval and (
+                    motion is None
+                    or not cfg["motion"]["skip_duplicate_autosave"]
+                    or cam.thumb is None
+                    or motion.changed_since("auto_save", cam.thumb)
+                ):
+                    if settings.export.auto_save_use_ring:
+                        # save image from ring // may require to move the  exept below aboveAuto-save logic
+                        frames = ring.get_last(1)
+                        if frames:
+                            try:
+                                saved = exporter.save(frames, "jpg", "auto")
+                                logging.info(f"Auto-save from ring: {saved}")
+                            except Exception as e:
+                                logging.error(f"Auto-save from ring failed: {e}")
+                            self.add_timelapse(*frames[0])
+                    else:
+                        # NOT saving image from ring. Retake another image
+                        img = cam.capture_fullres()
+                        exporter.save([(img, captured)], "jpg", "auto")
+                        self.add_timelapse(img, captured)
+                        del img
+                        logging.info("Auto-save fresh image")
+                    self.last_auto_save = now
+                elif interval > 0 and now - self.last_auto_save >= interval:
+                    logging.info("Auto-save skipped: scene unchanged since last auto-save")
+                    self.last_auto_save = now
+
+                # Slow down capture in still mode
+                if cam.mode == "still":
+                    time.sleep(2)
 
-        event = None
-        if ring.buffer:
-            _, meta = ring.buffer[-1]
-            # Always evaluate brightness, regardless of camera mode
-            event = night_ctrl.update(meta.dark_score)
+            except Exception as e:
+                logging.error("Camera loop error: %s", e)
+                time.sleep(2)
 
-            if event == "ENTER" and cam.mode != "still":
-                logging.info("Night detected *************************************")
-                before = cam.describe_mode()
-                cam.start_still(cfg["night"])
-                after = cam.describe_mode()
-                log_mode_change(before, after)
 
-            elif event == "EXIT" and cam.mode != "video":
-                logging.info("Day detected *************************************")
-                before = cam.describe_mode()
-                cam.start_video()
-                after = cam.describe_mode()
-                log_mode_change(before, after)
-                
-            if meta.dark_score > 245 and cam.mode == "video":
-                logging.error("Overexposed frame detected → forcing video reset")
-                cam.start_video()
-                
-        # Auto-save logic
-        now = time.time()
-        interval = cfg["export"].get("auto_save_interval_s", 0)
-        if interval > 0 and now - last_auto_save >= interval:
-            if cfg["export"].get("auto_save_use_ring", False):                
-                # save image from ring // may require to move the  exept below aboveAuto-save logic 
-                frames = ring.get_last(1)
-                if frames:
-                    try:
-                        saved = exporter.save(frames, "jpg")
-                        logging.info(f"Auto-save from ring: {saved}")
-                    except Exception as e:
-                        logging.error(f"Auto-save from ring failed: {e}")
-            else:
-                # NOT saving image from ring. Retake another image
-                img = cam.capture_fullres()
-                meta = ring.get_last(1)[0][1]
-                exporter.save([(img, meta)], "jpg")
-                del img
-                logging.info("Auto-save fresh image")
-            last_auto_save = now
-
-        # --- HARD SAFETY EXIT ---
-        
-        rss = process.memory_info().rss / (1024*1024)
-        if rss > MAX_RSS_MB:
-            logging.critical(
-                "RSS %.1f MiB exceeded limit %d → exiting for restart",
-                rss, MAX_RSS_MB
-            )
-            raise SystemExit(42)
+def main() -> None:
+    service = CameraService()
+    service.start()
+    service.run()
 
-        # Slow down capture in still mode
-        if cam.mode == "still":
-            time.sleep(2)
 
-    except Exception as e:
-        logging.error("Camera loop error: %s", e)
-        time.sleep(2)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import gc
+import logging
+import time
+from collections import deque
+from typing import Callable
+import psutil
+
+
+class MemoryGovernor:
+    """
+    Samples RSS and swap every sample_interval_s and degrades the service
+    one step at a time while memory stays high: each step is applied after
+    step_interval_s of pressure (every sample above rss_critical_mb) and
+    reverted, last first, after recover_s below the low watermarks.
+    """
+
+    def __init__(self, cfg: dict, process: psutil.Process) -> None:
+        self.cfg = cfg
+        self.process = process
+        self.steps: list[tuple[str, Callable[[], None], Callable[[], None] | None]] = []
+        self.level = 0
+        self.rss_mb = 0.0
+        self.swap_percent = 0.0
+        self.history: deque[tuple[float, str]] = deque(maxlen=50)
+
+        self._last_sample = 0.0
+        self._last_log = 0.0
+        self._last_change = 0.0
+        self._calm_since: float | None = None
+
+    def add_step(self, name: str, apply: Callable[[], None], revert: Callable[[], None] | None = None) -> None:
+        self.steps.append((name, apply, revert))
+
+    def sample(self) -> tuple[float, float]:
+        self.rss_mb = self.process.memory_info().rss / (1024 * 1024)
+        self.swap_percent = psutil.swap_memory().percent
+        return self.rss_mb, self.swap_percent
+
+    def poll(self, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        if now - self._last_sample < self.cfg["sample_interval_s"]:
+            return
+        self._last_sample = now
+        rss, swap = self.sample()
+
+        if now - self._last_log >= self.cfg["log_interval_s"]:
+            self._last_log = now
+            logging.info("RSS=%.1f MiB | SWAP=%.1f%% | memory level %d", rss, swap, self.level)
+
+        critical = rss > self.cfg["rss_critical_mb"]
+        high = critical or rss > self.cfg["rss_high_mb"] or swap > self.cfg["swap_high_percent"]
+        low = rss < self.cfg["rss_low_mb"] and swap < self.cfg["swap_low_percent"]
+
+        if high:
+            self._calm_since = None
+            if critical or now - self._last_change >= self.cfg["step_interval_s"]:
+                self._step_up(now)
+        elif low and self.level > 0:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.cfg["recover_s"]:
+                self._step_down(now)
+                self._calm_since = now
+        else:
+            self._calm_since = None
+
+    def _step_up(self, now: float) -> None:
+        if self.level >= len(self.steps):
+            return
+        name, apply, _ = self.steps[self.level]
+        self.level += 1
+        self._last_change = now
+        self.history.append((now, f"+{name}"))
+        logging.warning(
+            "Memory pressure (RSS=%.1f MiB, SWAP=%.1f%%) → step %d: %s",
+            self.rss_mb, self.swap_percent, self.level, name
+        )
+        gc.collect()
+        apply()
+
+    def _step_down(self, now: float) -> None:
+        name, _, revert = self.steps[self.level - 1]
+        self.level -= 1
+        self._last_change = now
+        self.history.append((now, f"-{name}"))
+        logging.info(
+            "Memory recovered (RSS=%.1f MiB, SWAP=%.1f%%) → reverting step %d: %s",
+            self.rss_mb, self.swap_percent, self.level + 1, name
+        )
+        if revert is not None:
+            revert()
+
+    def describe(self) -> dict:
+        return {
+            "level": self.level,
+            "active_steps": [name for name, _, _ in self.steps[:self.level]],
+            "rss_mb": round(self.rss_mb, 1),
+            "swap_percent": round(self.swap_percent, 1),
+            "history": [
+                {"time": round(ts, 1), "step": step} for ts, step in list(self.history)[-10:]
+            ],
+        }
@@ -7,3 +7,4 @@ class FrameMetadata:
     timestamp: float
     dark_score: float
     night_mode: bool
+    motion_score: float = 0.0
@@ -1,26 +1,252 @@
+import re
+import sys
 import threading
 import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
 import cv2
 import logging
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FRAME_PATH = re.compile(r"^/frames/(\d+)\.jpg$")
+
+
+class FrameCache:
+    """JPEG encodings of the most recent frames, keyed by (frame_id, tier, roi) and shared by all clients."""
+
+    def __init__(self, capacity: int = 16) -> None:
+        self.capacity = capacity
+        self.items: OrderedDict[tuple[int, int, str | None], bytes] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[int, int, str | None]) -> bytes | None:
+        with self.lock:
+            data = self.items.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.items.move_to_end(key)
+            return data
+
+    def put(self, key: tuple[int, int, str | None], data: bytes) -> None:
+        with self.lock:
+            self.items[key] = data
+            self.items.move_to_end(key)
+            while len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+
+
+class ClientPacer:
+    """
+    Per-client stream quality from measured write times.
+
+    Each frame's write time is compared with the frame interval (its
+    load). While the smoothed load stays above slow_load the client
+    moves to the next tier (lower JPEG quality, then smaller scale),
+    and once on the last tier its fps is lowered down to min_fps. While
+    it stays below fast_load the fps is raised back first, then the tier.
+    At most one change every hold_frames frames, unless a single frame
+    takes longer to write than the frame interval.
+    """
+
+    def __init__(self, cfg: dict, name: str) -> None:
+        self.cfg = cfg
+        self.name = name
+        self.tier = 0
+        self.fps: float | None = None      # None: follow the server fps
+        self.load = 0.0
+        self.drain_kib_s = 0.0
+        self.changes = 0
+        self._since_change = 0
+
+    def frame_fps(self, server_fps: float) -> float:
+        return server_fps if self.fps is None else min(self.fps, server_fps)
+
+    def update(self, nbytes: int, write_s: float, server_fps: float) -> None:
+        fps = self.frame_fps(server_fps)
+        load = write_s * fps
+        self.load = load if self._since_change == 0 else 0.7 * self.load + 0.3 * load
+        if write_s > 0:
+            self.drain_kib_s = 0.7 * self.drain_kib_s + 0.3 * nbytes / write_s / 1024
+        self._since_change += 1
+        if self._since_change < self.cfg["hold_frames"] and load <= 1.0:
+            return
+
+        last_tier = len(self.cfg["tiers"]) - 1
+        if self.load > self.cfg["slow_load"]:
+            if self.tier < last_tier:
+                self._change(tier=self.tier + 1)
+            elif fps > self.cfg["min_fps"]:
+                self._change(fps=max(self.cfg["min_fps"], fps * 0.7))
+        elif self.load < self.cfg["fast_load"]:
+            if self.fps is not None:
+                self._change(fps=None if fps * 1.25 >= server_fps else fps * 1.25)
+            elif self.tier > 0:
+                self._change(tier=self.tier - 1)
+
+    def _change(self, tier: int | None = None, fps: float | None = None) -> None:
+        if tier is not None:
+            self.tier = tier
+        else:
+            self.fps = fps
+        self._since_change = 0
+        self.changes += 1
+        quality, scale = self.settings()
+        logging.info(
+            "MJPEG client %s: load %.2f, drain %.0f KiB/s → quality %d, scale %.2f, fps %s",
+            self.name, self.load, self.drain_kib_s, quality, scale,
+            "server" if self.fps is None else f"{self.fps:.2f}"
+        )
+
+    def settings(self) -> tuple[int, float]:
+        tier = self.cfg["tiers"][self.tier]
+        return tier["quality"], tier["scale"]
+
+
+def find_frame(ring, frame_id: int | None = None, t: float | None = None):
+    """Latest frame, the frame with frame_id, or the frame closest to timestamp t."""
+    if frame_id is None and t is None:
+        frames = ring.get_last(1)
+        return frames[0] if frames else None
+    frames = ring.get_last(sys.maxsize)     # every frame still held
+    if frame_id is not None:
+        return next((f for f in frames if f[1].frame_id == frame_id), None)
+    return min(frames, key=lambda f: abs(f[1].timestamp - t), default=None)
+
+
+def etag(meta) -> str:
+    # frame_id restarts at 0 with the service, the timestamp keeps tags unique
+    return f'"{meta.frame_id}-{int(meta.timestamp * 1000)}"'
+
 
 class MJPEGHandler(BaseHTTPRequestHandler):
     ring = None
     fps = 2
+    cache = FrameCache()
+    adaptive = None         # mjpeg_server.adaptive, None: fixed tier 0 for everyone
+    tiers = [{"quality": 95, "scale": 1.0}]
+    rois = None             # RoiSet: /stream?roi=<name>, /snapshot.jpg?roi=<name>
+
+    # Keep-alive for snapshot polling; idle connections are dropped after timeout
+    protocol_version = "HTTP/1.1"
+    timeout = 30
+
+    def log_message(self, format, *args):
+        logging.debug("MJPEG %s: %s", self.address_string(), format % args)
+
+    def encode(self, img, meta, tier: int = 0, roi=None) -> bytes | None:
+        """JPEG of the frame (or of a ROI view of it) at a quality tier, encoded once for all clients on that tier."""
+        key = (meta.frame_id, tier, roi.name if roi is not None else None)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        if roi is not None:
+            img = roi.crop(img)
+        quality, scale = self.tiers[tier]["quality"], self.tiers[tier]["scale"]
+        if scale < 1.0:
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return None
+        # Shared-memory frames are views: drop the frame if its slot was overwritten
+        if hasattr(self.ring, "still_valid") and not self.ring.still_valid(meta):
+            return None
+        data = jpeg.tobytes()
+        self.cache.put(key, data)
+        return data
+
+    def find_roi(self, query):
+        """(True, roi or None), or (False, None) after answering 404 for an unknown ROI."""
+        if "roi" not in query:
+            return True, None
+        roi = self.rois.get(query["roi"][0]) if self.rois is not None else None
+        if roi is None:
+            self.send_error(404, f"Unknown ROI {query['roi'][0]}")
+            return False, None
+        return True, roi
 
     def do_GET(self):
-        if self.path != "/stream":
-            self.send_error(404)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/stream":
+            ok, roi = self.find_roi(query)
+            if ok:
+                self.send_stream(roi)
+            return
+        if url.path == "/snapshot.jpg":
+            try:
+                frame_id = int(query["frame_id"][0]) if "frame_id" in query else None
+                t = float(query["t"][0]) if "t" in query else None
+            except ValueError:
+                self.send_error(400, "frame_id must be an integer, t a unix timestamp")
+                return
+            ok, roi = self.find_roi(query)
+            if ok:
+                self.send_frame(find_frame(self.ring, frame_id, t), latest=frame_id is None and t is None, roi=roi)
+            return
+        match = FRAME_PATH.match(url.path)
+        if match:
+            self.send_frame(find_frame(self.ring, int(match.group(1))), latest=False)
             return
+        self.send_error(404)
 
+    def send_frame(self, frame, latest, roi=None):
+        if frame is None:
+            self.send_error(404, "Frame not in ring buffer")
+            return
+        img, meta = frame
+        tag = etag(meta) if roi is None else etag(meta)[:-1] + f'-{roi.name}"'
+        if self.headers.get("If-None-Match") == tag:
+            self.send_response(304)
+            self.send_header("ETag", tag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        data = self.encode(img, meta, roi=roi)
+        if data is None:
+            self.send_error(503, "Frame was overwritten, retry")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", tag)
+        # The latest snapshot changes: revalidate; a given frame never does
+        self.send_header("Cache-Control", "no-cache" if latest else "max-age=3600")
+        self.send_metadata_headers(meta)
+        if roi is not None:
+            self.send_header("X-Roi", roi.name)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_metadata_headers(self, meta):
+        # conventions metadata headers
+        self.send_header("X-Frame-Id", str(meta.frame_id))
+        self.send_header("X-Timestamp", f"{meta.timestamp:.3f}")
+        # Custom metadata headers
+        self.send_header("X-Dark-Score", f"{meta.dark_score:.1f}")
+        self.send_header("X-Night", str(int(meta.night_mode)))
+        self.send_header("X-Motion-Score", f"{meta.motion_score:.4f}")
+
+    def send_stream(self, roi=None):
+        # The stream ends only when the client goes away
+        self.close_connection = True
         self.send_response(200)
         self.send_header(
             "Content-Type",
             "multipart/x-mixed-replace; boundary=frame"
         )
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
         self.end_headers()
 
-        logging.info("MJPEG client connected")
+        logging.info("MJPEG client connected%s", f" (roi {roi.name})" if roi is not None else "")
+        pacer = ClientPacer(self.adaptive, self.address_string()) if self.adaptive else None
+        roi_header = f"X-Roi: {roi.name}\r\n" if roi is not None else ""
 
         try:
             while True:
@@ -29,40 +255,92 @@ class MJPEGHandler(BaseHTTPRequestHandler):
                     time.sleep(0.1)
                     continue
 
+                # Read every frame: "set mjpeg_server.fps" and the governor change it live
+                server_fps = roi.stream_fps(self.fps) if roi is not None else self.fps
                 img, meta = frames[0]
-                ok, jpeg = cv2.imencode(".jpg", img)
-                if not ok:
+                tier = pacer.tier if pacer is not None else 0
+                data = self.encode(img, meta, tier, roi)
+                if data is None:
+                    # Overwritten while encoding, or not encodable: wait for the next frame
+                    time.sleep(1 / server_fps)
                     continue
 
-                data = jpeg.tobytes()
+                header = (
+                    "--frame\r\n"
+                    "Content-Type: image/jpeg\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    # conventions metadata headers
+                    f"X-Frame-Id: {meta.frame_id}\r\n"
+                    f"X-Timestamp: {meta.timestamp:.3f}\r\n"
+                    # Custom metadata headers
+                    f"X-Dark-Score: {meta.dark_score:.1f}\r\n"
+                    f"X-Night: {int(meta.night_mode)}\r\n"
+                    f"X-Motion-Score: {meta.motion_score:.4f}\r\n"
+                    f"X-Quality: {self.tiers[tier]['quality']}\r\n"
+                    f"{roi_header}"
+                    # End of headers
+                    "\r\n"
+                )
 
-                self.wfile.write(b"--frame\r\n")
-                self.wfile.write(b"Content-Type: image/jpeg\r\n")
-                self.wfile.write(f"Content-Length: {len(data)}\r\n".encode())
-                # conventions metadata headers
-                self.wfile.write(f"X-Frame-Id: {meta.frame_id}\r\n".encode()) 
-                self.wfile.write(f"X-Timestamp: {meta.timestamp:.3f}\r\n".encode())
-                # Custom metadata headers
-                self.wfile.write(f"X-Dark-Score: {meta.dark_score:.1f}\r\n".encode())
-                self.wfile.write(f"X-Night: {int(meta.night_mode)}\r\n".encode())
-                # End of headers
-                self.wfile.write(b"\r\n")
+                # One write per frame: its duration is the client's drain time
+                start = time.time()
+                self.wfile.write(header.encode() + data)
+                write_s = time.time() - start
 
-                self.wfile.write(data)
-
-                time.sleep(1 / self.fps)
+                if pacer is not None:
+                    pacer.update(len(data), write_s, server_fps)
+                    fps = pacer.frame_fps(server_fps)
+                else:
+                    fps = server_fps
+                time.sleep(max(0.0, 1 / fps - write_s))
 
         except Exception as e:
             logging.info("MJPEG client disconnected")
 
 class MJPEGServer(threading.Thread):
-    def __init__(self, port, ring, fps=2):
+    def __init__(self, port, ring, fps=2, cache_size=16, adaptive=None, rois=None):
         super().__init__(daemon=True)
         self.port = port
         MJPEGHandler.ring = ring
+        MJPEGHandler.rois = rois
         MJPEGHandler.fps = fps
+        MJPEGHandler.cache = FrameCache(cache_size)
+        if adaptive is not None and adaptive.get("enable", False):
+            MJPEGHandler.adaptive = adaptive
+            MJPEGHandler.tiers = adaptive["tiers"]
 
     def run(self):
-        server = HTTPServer(("", self.port), MJPEGHandler)
+        # One thread per client: a stream viewer no longer blocks snapshot requests
+        server = ThreadingHTTPServer(("", self.port), MJPEGHandler)
         logging.info("MJPEG server listening on port %d", self.port)
         server.serve_forever()
+
+def serve_shared(shm_name, port, fps=2, cache_size=16, adaptive=None, roi_cfg=None,
+                 fps_value=None, log_file=None, log_level=logging.INFO):
+    """
+    Entry point of the MJPEG worker process: serve frames from the
+    shared-memory ring. fps_value (a multiprocessing Value) carries fps
+    changes from the service; log_file is this process's own rotating log.
+    """
+    from roi import RoiSet
+    from shm_ring import SharedRingReader
+
+    handlers = [logging.StreamHandler()]
+    if log_file is not None:
+        handlers.append(RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=3))
+    logging.basicConfig(
+        level=log_level, handlers=handlers,
+        format="%(asctime)s [%(levelname)s] [mjpeg-worker] %(message)s", datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    if fps_value is not None:
+        def follow_fps():
+            # "set mjpeg_server.fps" and the memory governor change it in the service
+            while True:
+                MJPEGHandler.fps = fps_value.value
+                time.sleep(0.5)
+
+        threading.Thread(target=follow_fps, name="mjpeg-fps", daemon=True).start()
+
+    rois = RoiSet(roi_cfg) if roi_cfg is not None else None
+    MJPEGServer(port, SharedRingReader(shm_name), fps=fps, cache_size=cache_size, adaptive=adaptive, rois=rois).run()
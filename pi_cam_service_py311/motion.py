@@ -0,0 +1,118 @@
+import time
+import cv2
+import numpy as np
+
+
+def gray_thumbnail(small: np.ndarray) -> np.ndarray:
+    """Grayscale float32 version of an already downscaled frame."""
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small.astype(np.float32)
+
+
+class MotionDetector:
+    """
+    Running-average background subtraction on a thumbnail.
+
+    update() returns "START" when the changed fraction rises above
+    min_changed_fraction, "END" once it has stayed below for end_frames
+    frames, otherwise None (same convention as NightModeController).
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        self.background: np.ndarray | None = None
+        self.last_kept: np.ndarray | None = None
+        self.last_kept_ts = 0.0
+        self.marks: dict[str, np.ndarray] = {}
+
+        self.score = 0.0            # fraction of changed thumbnail pixels
+        self.duplicate = False      # last frame ~ last kept frame
+        self.active = False
+        self.quiet_count = 0
+        self.last_event: str | None = None
+        self.last_event_ts = 0.0
+        self.events = 0
+        self.skipped = 0
+
+    def update(self, thumb: np.ndarray) -> str | None:
+        alpha = self.cfg["background_alpha"]
+
+        if self.background is None or self.background.shape != thumb.shape:
+            self.background = thumb.copy()
+            self.last_kept = thumb
+            self.last_kept_ts = time.time()
+            self.last_event = None
+            return None
+
+        diff = np.abs(thumb - self.background)
+        self.score = float(np.count_nonzero(diff > self.cfg["pixel_threshold"])) / diff.size
+
+        # bg = (1 - alpha) * bg + alpha * thumb, in place
+        self.background *= 1.0 - alpha
+        self.background += alpha * thumb
+
+        self.duplicate = self._is_duplicate(thumb)
+        if not self.duplicate:
+            self.last_kept = thumb
+            self.last_kept_ts = time.time()
+
+        self.last_event = self._event()
+        return self.last_event
+
+    def _is_duplicate(self, thumb: np.ndarray) -> bool:
+        if self.last_kept is None or self.last_kept.shape != thumb.shape:
+            return False
+        # Keep one frame now and then so the ring never goes stale
+        if time.time() - self.last_kept_ts >= self.cfg["duplicate_keepalive_s"]:
+            return False
+        return float(np.mean(np.abs(thumb - self.last_kept))) < self.cfg["duplicate_threshold"]
+
+    def _event(self) -> str | None:
+        moving = self.score >= self.cfg["min_changed_fraction"]
+        if moving:
+            self.quiet_count = 0
+        else:
+            self.quiet_count += 1
+
+        match (self.active, moving):
+            case (False, True):
+                now = time.time()
+                if now - self.last_event_ts < self.cfg["cooldown_s"]:
+                    return None
+                self.active = True
+                self.last_event_ts = now
+                self.events += 1
+                return "START"
+            case (True, False) if self.quiet_count >= self.cfg["end_frames"]:
+                self.active = False
+                return "END"
+            case _:
+                return None
+
+    def skip_frame(self) -> bool:
+        """True if the last frame should not be stored in the ring."""
+        skip = self.cfg["skip_duplicate_frames"] and self.duplicate
+        if skip:
+            self.skipped += 1
+        return skip
+
+    def changed_since(self, key: str, thumb: np.ndarray) -> bool:
+        """
+        Compare thumb with the one last accepted for key (e.g. "auto_save").
+        Remembers thumb when it differs, so callers can skip near-duplicates.
+        """
+        prev = self.marks.get(key)
+        if prev is not None and prev.shape == thumb.shape:
+            if float(np.mean(np.abs(thumb - prev))) < self.cfg["duplicate_threshold"]:
+                return False
+        self.marks[key] = thumb
+        return True
+
+    def describe(self) -> dict:
+        return {
+            "score": round(self.score, 4),
+            "active": self.active,
+            "events": self.events,
+            "skipped_frames": self.skipped,
+        }
@@ -0,0 +1,141 @@
+import logging
+import os
+import time
+import numpy as np
+from numpy.lib.format import open_memmap
+from metadata import FrameMetadata
+
+STATE = np.dtype([
+    ("count", "<i8"),
+    ("started", "<f8"),
+    ("last_ts", "<f8"),
+    ("first_frame_id", "<i8"),
+])
+
+
+class NightAccumulator:
+    """
+    Folds every night frame into a running sum and a running max, kept in
+    memory-mapped .npy files in cfg["dir"] (sum.npy float32, max.npy
+    uint8, state.npy with the frame count). Cost per frame is one add and
+    one maximum over the pixels; no frame is kept.
+
+    The count is updated in the same page cache as the images, so after a
+    crash-restart the night resumes where it stopped (pages are flushed to
+    disk every flush_interval_s for power cuts). finish() returns the deep
+    image (mean) and the star-trail image (max), at dawn or when a stale
+    night is found at startup.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        self.dir = cfg["dir"]
+        os.makedirs(self.dir, exist_ok=True)
+        self.sum: np.ndarray | None = None
+        self.max: np.ndarray | None = None
+        self.state: np.ndarray | None = None
+        self._last_flush = 0.0
+        self._last_frame_id: int | None = None
+        self._open_existing()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def _open_existing(self) -> None:
+        try:
+            self.state = open_memmap(self._path("state.npy"), mode="r+")
+            self.sum = open_memmap(self._path("sum.npy"), mode="r+")
+            self.max = open_memmap(self._path("max.npy"), mode="r+")
+        except (OSError, ValueError):
+            self._close()
+            return
+        logging.info(
+            "Night accumulator found %d frames (started %s)",
+            self.count, time.strftime("%Y-%m-%d %H:%M", time.localtime(float(self.state["started"])))
+        )
+
+    def _create(self, shape: tuple, meta: FrameMetadata) -> None:
+        self._close()
+        self.sum = open_memmap(self._path("sum.npy"), mode="w+", dtype=np.float32, shape=shape)
+        self.max = open_memmap(self._path("max.npy"), mode="w+", dtype=np.uint8, shape=shape)
+        self.state = open_memmap(self._path("state.npy"), mode="w+", dtype=STATE, shape=())
+        self.state["started"] = meta.timestamp
+        self.state["first_frame_id"] = meta.frame_id
+        logging.info("Night accumulator started (%s)", "x".join(map(str, shape)))
+
+    def _close(self) -> None:
+        for arr in (self.sum, self.max, self.state):
+            if arr is not None:
+                arr.flush()
+        self.sum = self.max = self.state = None
+
+    @property
+    def count(self) -> int:
+        return int(self.state["count"]) if self.state is not None else 0
+
+    def stale(self, now: float) -> bool:
+        """True if the stored night ended more than resume_gap_s ago (not resumable)."""
+        return self.count > 0 and now - float(self.state["last_ts"]) > self.cfg["resume_gap_s"]
+
+    def add(self, img: np.ndarray, meta: FrameMetadata) -> None:
+        if meta.frame_id == self._last_frame_id:
+            return
+        self._last_frame_id = meta.frame_id
+        if self.sum is None or self.sum.shape != img.shape:
+            if self.count:
+                logging.warning("Night accumulator: frame size changed, restarting the night")
+            self._create(img.shape, meta)
+
+        np.add(self.sum, img, out=self.sum)
+        np.maximum(self.max, img, out=self.max)
+        # Count last: a crash before this line loses at most this frame's weight
+        self.state["last_ts"] = meta.timestamp
+        self.state["count"] += 1
+
+        if meta.timestamp - self._last_flush >= self.cfg["flush_interval_s"]:
+            self._last_flush = meta.timestamp
+            self.sum.flush()
+            self.max.flush()
+            self.state.flush()
+
+    def finish(self) -> tuple[np.ndarray, np.ndarray, FrameMetadata] | None:
+        """
+        Deep (mean) and star-trail (max) images of the night, then reset.
+        None if fewer than min_frames frames were accumulated.
+        """
+        if self.count == 0:
+            return None
+        count = self.count
+        result = None
+        if count >= self.cfg["min_frames"]:
+            deep = (self.sum / count).clip(0, 255).astype(np.uint8)
+            trails = np.array(self.max)
+            meta = FrameMetadata(
+                frame_id=int(self.state["first_frame_id"]),
+                timestamp=float(self.state["started"]),
+                dark_score=float(deep.mean()),
+                night_mode=True,
+            )
+            result = deep, trails, meta
+        else:
+            logging.info("Night accumulator: only %d frames, nothing saved", count)
+
+        self._close()
+        for name in ("state.npy", "sum.npy", "max.npy"):
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+        self._last_frame_id = None
+        return result
+
+    def describe(self) -> dict:
+        if self.count == 0:
+            return {"frames": 0}
+        return {
+            "frames": self.count,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(float(self.state["started"]))),
+            "last_frame": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(float(self.state["last_ts"]))),
+            "shape": list(self.sum.shape),
+            "mean_level": round(float(self.sum.mean()) / self.count, 1),
+        }
@@ -0,0 +1,215 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class Profiler:
+    """
+    On-demand diagnostics for the trigger port. Nothing runs until a
+    command starts it:
+    - "sample": a thread samples the stacks of all threads every
+      sample_interval_ms and writes them in folded (flamegraph) format
+    - "cprofile": cProfile of the capture loop thread, enabled from
+      capture_hook() (cProfile only sees the thread that enables it)
+    - tracemalloc snapshots and diffs against the previous snapshot
+    - a dump of all thread stacks
+    Summaries are returned to the caller, full reports go to report_dir.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        self.report_dir = cfg["report_dir"]
+        self.lock = threading.Lock()
+
+        self.mode: str | None = None
+        self.deadline = 0.0
+        self.samples: Counter[str] = Counter()
+        self.sample_count = 0
+        self._sampler: threading.Thread | None = None
+
+        self.cprofile_requested = False
+        self._cprofile: cProfile.Profile | None = None
+
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self.last_report: str | None = None
+
+    def _report_path(self, kind: str, ext: str = "txt") -> str:
+        os.makedirs(self.report_dir, exist_ok=True)
+        return os.path.join(self.report_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{kind}.{ext}")
+
+    # Profiling sessions
+
+    def start(self, seconds: float, mode: str = "sample") -> str:
+        with self.lock:
+            if self.mode is not None:
+                return f"ERROR: {self.mode} profile already running"
+            self.deadline = time.time() + seconds
+            self.mode = mode
+            if mode == "sample":
+                self.samples = Counter()
+                self.sample_count = 0
+                self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._sampler.start()
+            elif mode == "cprofile":
+                self.cprofile_requested = True
+            else:
+                self.mode = None
+                return "ERROR: mode must be sample or cprofile"
+        logging.info("Profiler started: %s for %gs", mode, seconds)
+        return f"PROFILE_STARTED mode={mode} seconds={seconds:g}"
+
+    def stop(self) -> str:
+        with self.lock:
+            if self.mode is None:
+                return "NO_PROFILE_RUNNING"
+            self.deadline = 0.0
+        if self._sampler is not None:
+            self._sampler.join(timeout=5)
+            return self.last_report or "PROFILE_STOPPED"
+        return "PROFILE_STOPPING (written by the capture loop after its current frame)"
+
+    def status(self) -> dict:
+        return {
+            "mode": self.mode,
+            "remaining_s": round(max(0.0, self.deadline - time.time()), 1) if self.mode else 0,
+            "samples": self.sample_count,
+            "tracemalloc": tracemalloc.is_tracing(),
+            "last_report": self.last_report,
+        }
+
+    def _sample_loop(self) -> None:
+        interval = self.cfg["sample_interval_ms"] / 1000
+        me = threading.get_ident()
+        names = {}
+        while time.time() < self.deadline:
+            names.update((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+            time.sleep(interval)
+        self._write_samples()
+
+    def _write_samples(self) -> None:
+        path = self._report_path("profile", "folded")
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        leaf = Counter()
+        for stack, count in self.samples.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        total = sum(self.samples.values()) or 1
+        top = ", ".join(
+            f"{name} {100 * count / total:.0f}%"
+            for name, count in leaf.most_common(self.cfg["top"])
+        )
+        with self.lock:
+            self.mode = None
+            self._sampler = None
+            self.last_report = f"PROFILE_DONE samples={self.sample_count} report={path} top: {top}"
+        logging.info(self.last_report)
+
+    def capture_hook(self) -> None:
+        """Called once per capture loop iteration; only an attribute check while idle."""
+        if self._cprofile is None:
+            if self.cprofile_requested:
+                self.cprofile_requested = False
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+            return
+        if time.time() < self.deadline:
+            return
+
+        self._cprofile.disable()
+        path = self._report_path("cprofile", "prof")
+        self._cprofile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self._cprofile, stream=out).sort_stats("cumulative").print_stats(self.cfg["top"])
+        with open(path[:-len(".prof")] + ".txt", "w") as f:
+            f.write(out.getvalue())
+        self._cprofile = None
+
+        stats = pstats.Stats(path).sort_stats("tottime")
+        top = ", ".join(
+            f"{func[2]} ({os.path.basename(func[0])}:{func[1]}) {stats.stats[func][2]:.3f}s"
+            for func in stats.fcn_list[:self.cfg["top"]]
+        )
+        with self.lock:
+            self.mode = None
+            self.last_report = f"PROFILE_DONE report={path} top tottime: {top}"
+        logging.info(self.last_report)
+
+    # Memory
+
+    def tracemalloc_command(self, action: str) -> str:
+        match action:
+            case "start":
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(self.cfg["tracemalloc_frames"])
+                self._snapshot = None
+                return "TRACEMALLOC_STARTED"
+            case "stop":
+                tracemalloc.stop()
+                self._snapshot = None
+                return "TRACEMALLOC_STOPPED"
+            case "snapshot" | "diff":
+                if not tracemalloc.is_tracing():
+                    return "ERROR: tracemalloc not started"
+                snapshot = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                ))
+                if action == "diff" and self._snapshot is not None:
+                    stats = snapshot.compare_to(self._snapshot, "lineno")
+                else:
+                    stats = snapshot.statistics("lineno")
+                self._snapshot = snapshot
+
+                path = self._report_path(f"tracemalloc_{action}")
+                with open(path, "w") as f:
+                    for stat in stats:
+                        f.write(f"{stat}\n")
+                current, peak = tracemalloc.get_traced_memory()
+                top = "\n".join(str(stat) for stat in stats[:self.cfg["top"]])
+                return (
+                    f"TRACED current={current / 1024 / 1024:.1f}MiB peak={peak / 1024 / 1024:.1f}MiB "
+                    f"report={path}\n{top}"
+                )
+            case _:
+                return "ERROR: usage tracemalloc start|snapshot|diff|stop"
+
+    # Threads
+
+    def dump_threads(self) -> str:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        path = self._report_path("threads")
+        summary = []
+        with open(path, "w") as f:
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                f.write(f"--- Thread {name} ({ident}) ---\n")
+                f.write("".join(traceback.format_stack(frame)))
+                f.write("\n")
+                summary.append(f"{name}: {_frame_label(frame)}")
+        return f"THREADS={len(summary)} report={path}\n" + "\n".join(summary)
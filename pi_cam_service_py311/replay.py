@@ -0,0 +1,228 @@
+"""
+Replays a capture trace (see "trace start") off-device, faster than real
+time: recorded night scores go through NightModeController, frames
+(recorded thumbnails, or flat images at the recorded brightness) through
+RingBuffer, and "save"/"pastStack" commands and auto-saves through
+Exporter into a scratch directory. Optionally serves the replayed ring on
+an MJPEG port.
+
+    python3 replay.py traces/trace_20250101_180000.bin --speed 0
+    python3 replay.py trace.bin --set night.dark_threshold 40 --set night.min_dark_frames 20
+
+Prints a JSON report on stdout: replay throughput, night ENTER/EXIT
+events compared with the recorded modes, oscillations, recorded capture
+times, command latencies and RSS trend.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import psutil
+from capture_trace import read_trace
+from exporter import Exporter
+from main import get_frames_for_save
+from night_mode import NightModeController
+from ring_buffer import RingBuffer
+from settings import ConfigStore
+
+
+def percentiles(values: list[float]) -> dict | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": round(values[len(values) // 2], 4),
+        "p99": round(values[min(len(values) - 1, int(len(values) * 0.99))], 4),
+        "max": round(values[-1], 4),
+    }
+
+
+def rss_trend(samples: list[tuple[float, float]]) -> dict | None:
+    """First, last, max and least-squares slope (MiB/h) of (timestamp, rss_mb) samples."""
+    samples = [(t, rss) for t, rss in samples if rss > 0]
+    if len(samples) < 2:
+        return None
+    t = np.array([s[0] for s in samples])
+    rss = np.array([s[1] for s in samples])
+    slope = np.polyfit(t - t[0], rss, 1)[0] * 3600 if t[-1] > t[0] else 0.0
+    return {
+        "first_mb": round(float(rss[0]), 1),
+        "last_mb": round(float(rss[-1]), 1),
+        "max_mb": round(float(rss.max()), 1),
+        "slope_mb_per_h": round(float(slope), 2),
+    }
+
+
+def oscillations(events: list[dict], window_s: float) -> int:
+    """ENTER/EXIT pairs less than window_s apart."""
+    return sum(
+        1 for a, b in zip(events, events[1:])
+        if a["event"] != b["event"] and b["timestamp"] - a["timestamp"] < window_s
+    )
+
+
+class Replay:
+    def __init__(self, cfg: dict, args) -> None:
+        self.cfg = cfg
+        self.args = args
+        self.store = ConfigStore(cfg)
+        self.night_ctrl = NightModeController(self.store.settings.night)
+        self.ring = RingBuffer(args.ring_size)
+        self.exporter = Exporter(cfg["export"])
+        self.size = (args.width, args.height)
+        self.thumb: np.ndarray | None = None
+
+        self.frames = 0
+        self.events: list[dict] = []
+        self.recorded: list[dict] = []
+        self.capture_s: list[float] = []
+        self.rss: list[tuple[float, float]] = []
+        self.commands: dict[str, list[float]] = {}
+        self.saved = 0
+        self.last_night: bool | None = None
+        self.last_auto_save = 0.0
+
+    def image(self, meta) -> np.ndarray:
+        if self.thumb is not None:
+            return cv2.resize(self.thumb, self.size, interpolation=cv2.INTER_LINEAR)
+        return np.full((self.size[1], self.size[0], 3), int(meta.dark_score), np.uint8)
+
+    def frame(self, meta, night_score: float, capture_s: float, rss_mb: float) -> None:
+        self.frames += 1
+        self.capture_s.append(capture_s)
+        self.rss.append((meta.timestamp, rss_mb))
+        if self.last_night is not None and meta.night_mode != self.last_night:
+            self.recorded.append({"frame_id": meta.frame_id, "timestamp": meta.timestamp, "night": meta.night_mode})
+        self.last_night = meta.night_mode
+
+        self.ring.append((self.image(meta), meta))
+        event = self.night_ctrl.update(night_score)
+        if event is not None:
+            self.events.append({"frame_id": meta.frame_id, "timestamp": meta.timestamp, "event": event})
+
+        interval = self.store.settings.export.auto_save_interval_s
+        if self.args.exports and interval > 0 and meta.timestamp - self.last_auto_save >= interval:
+            self.last_auto_save = meta.timestamp
+            self.saved += len(self.exporter.save(self.ring.get_last(1), ["jpg"], "auto"))
+
+    def command(self, cmd: str, duration_s: float) -> None:
+        name = cmd.split()[0] if cmd.split() else ""
+        self.commands.setdefault(name, []).append(duration_s)
+        if not self.args.exports:
+            return
+        if cmd.startswith("save"):
+            self.saved += len(self.exporter.save(self.ring.get_last(1), ["jpg"]))
+        elif cmd.startswith("pastStack"):
+            frames = get_frames_for_save(self.ring, self.cfg)
+            if self.cfg["export"]["stack_dark_frames"]:
+                self.saved += len(self.exporter.stack_and_save(frames, ["jpg"]))
+            else:
+                self.saved += len(self.exporter.save(frames, ["jpg"], "event"))
+
+    def run(self, records) -> dict:
+        process = psutil.Process()
+        start = time.time()
+        t0 = None
+        replay_rss = 0.0
+        for record in records:
+            kind = record[0]
+            if kind == "thumb":
+                thumb = cv2.imdecode(np.frombuffer(record[2], np.uint8), cv2.IMREAD_COLOR)
+                if thumb is not None:
+                    self.thumb = thumb
+                continue
+            ts = record[1].timestamp if kind == "frame" else record[2]
+            if t0 is None:
+                t0 = ts
+            if self.args.speed > 0:
+                delay = (ts - t0) / self.args.speed - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            if kind == "frame":
+                self.frame(*record[1:])
+                if self.frames % 1000 == 0:
+                    replay_rss = max(replay_rss, process.memory_info().rss / (1024 * 1024))
+            else:
+                self.command(record[1], record[3])
+        elapsed = time.time() - start
+        replay_rss = max(replay_rss, process.memory_info().rss / (1024 * 1024))
+
+        trace_s = self.rss[-1][0] - self.rss[0][0] if len(self.rss) > 1 else 0.0
+        return {
+            "frames": self.frames,
+            "trace_s": round(trace_s, 1),
+            "replay_s": round(elapsed, 3),
+            "speedup": round(trace_s / elapsed, 1) if elapsed > 0 else None,
+            "replay_fps": round(self.frames / elapsed, 1) if elapsed > 0 else None,
+            "night": {
+                "settings": {
+                    "dark_threshold": self.store.settings.night.dark_threshold,
+                    "bright_threshold": self.store.settings.night.bright_threshold,
+                    "min_dark_frames": self.store.settings.night.min_dark_frames,
+                },
+                "events": self.events,
+                "recorded_mode_changes": self.recorded,
+                "oscillations": oscillations(self.events, self.args.oscillation_s),
+                "matches_recording": len(self.events) == len(self.recorded),
+            },
+            "capture_s": percentiles(self.capture_s),
+            "commands": {name: percentiles(values) for name, values in sorted(self.commands.items())},
+            "rss_recorded": rss_trend(self.rss),
+            "rss_replay_max_mb": round(replay_rss, 1),
+            "saved_files": self.saved,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--config", default=None, help="config.json to replay with (default: the trace's snapshot)")
+    parser.add_argument("--set", nargs=2, action="append", default=[], metavar=("KEY", "VALUE"), help="override a setting, as the set command")
+    parser.add_argument("--speed", type=float, default=0, help="x real time (0 = as fast as possible)")
+    parser.add_argument("--ring-size", type=int, default=100)
+    parser.add_argument("--width", type=int, default=320, help="replayed frame width")
+    parser.add_argument("--height", type=int, default=240, help="replayed frame height")
+    parser.add_argument("--no-exports", dest="exports", action="store_false", help="do not replay saves")
+    parser.add_argument("--export-dir", default=None, help="directory of replayed saves (default: a temporary one)")
+    parser.add_argument("--mjpeg-port", type=int, default=None, help="serve the replayed ring on this port")
+    parser.add_argument("--oscillation-s", type=float, default=600, help="ENTER/EXIT closer than this count as an oscillation")
+    args = parser.parse_args()
+
+    header, records = read_trace(args.trace)
+    if args.config:
+        with open(args.config) as f:
+            cfg = json.load(f)
+    else:
+        cfg = header["config"]
+    cfg["export"]["base_dir"] = args.export_dir or tempfile.mkdtemp(prefix="replay_")
+    cfg["export"]["async_write"] = False
+
+    replay = Replay(cfg, args)
+    for key_path, value in args.set:
+        if not replay.store.set(key_path, value):
+            parser.error(f"unknown setting {key_path}")
+    replay.night_ctrl.cfg = replay.store.settings.night
+
+    if args.mjpeg_port is not None:
+        from mjpeg_server import MJPEGServer
+        mjpeg_cfg = cfg["mjpeg_server"]
+        MJPEGServer(args.mjpeg_port, replay.ring, mjpeg_cfg["fps"], mjpeg_cfg["snapshot_cache"], mjpeg_cfg["adaptive"]).start()
+
+    report = replay.run(records)
+    report["trace"] = os.path.abspath(args.trace)
+    report["export_dir"] = cfg["export"]["base_dir"]
+    print(json.dumps(report, indent=2))
+    print(
+        f"{report['frames']} frames in {report['replay_s']}s ({report['speedup']}x real time), "
+        f"{len(report['night']['events'])} night events, {report['night']['oscillations']} oscillations",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+# Frame metadata of a saved file, queried by CaptureCatalog (NULL for files added without it)
+CATALOG_COLUMNS = (
+    ("frame_id", "INTEGER"),
+    ("dark_score", "REAL"),
+    ("night", "INTEGER"),
+    ("motion_score", "REAL"),
+    ("format", "TEXT"),
+    ("stack_count", "INTEGER"),
+)
+
+
+class RetentionIndex:
+    """
+    SQLite index of saved files (path, timestamp, size, class), with the
+    frame metadata columns of the capture catalog in the same row: one
+    insert and one commit per file, and a file leaves the catalog when
+    retention deletes it.
+
+    Each class has a retention time (keep_s, 0 = keep forever) and the
+    whole index a byte quota; only the classes in evict_order are evicted
+    to meet the quota. enforce() only touches rows that have
+    expired or must be evicted, using the indexes on expires and
+    (class, ts), so its cost does not depend on the number of files kept.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        keep_s: dict[str, float],
+        max_bytes: int = 0,
+        evict_order: list[str] | None = None,
+        on_delete: Callable[[list[str]], None] | None = None,
+    ) -> None:
+        self.keep_s = keep_s
+        self.max_bytes = max_bytes
+        self.evict_order = list(keep_s) if evict_order is None else evict_order
+        self.on_delete = on_delete
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " ts REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " class TEXT NOT NULL,"
+            " expires REAL)"
+        )
+        # Indexes created before the catalog columns existed gain them
+        existing = {row[1] for row in self.db.execute("PRAGMA table_info(files)")}
+        for name, sql_type in CATALOG_COLUMNS:
+            if name not in existing:
+                self.db.execute(f"ALTER TABLE files ADD COLUMN {name} {sql_type}")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_expires ON files(expires)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_class_ts ON files(class, ts)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_ts ON files(ts)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_night_ts ON files(night, ts)")
+        self.db.commit()
+
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+        self.count = self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def add(
+        self,
+        path: str,
+        cls: str,
+        ts: float | None = None,
+        size: int | None = None,
+        meta=None,
+        fmt: str | None = None,
+        stack_count: int | None = None,
+    ) -> None:
+        """meta (FrameMetadata), fmt and stack_count fill the catalog columns."""
+        ts = time.time() if ts is None else ts
+        if size is None:
+            size = os.path.getsize(path)
+        keep = self.keep_s.get(cls, 0)
+        expires = ts + keep if keep > 0 else None
+        catalog = (None,) * len(CATALOG_COLUMNS)
+        if meta is not None:
+            catalog = (meta.frame_id, meta.dark_score, int(meta.night_mode), meta.motion_score, fmt, stack_count)
+
+        with self.lock:
+            old = self.db.execute("SELECT size FROM files WHERE path = ?", (path,)).fetchone()
+            columns = ("path", "ts", "size", "class", "expires") + tuple(name for name, _ in CATALOG_COLUMNS)
+            self.db.execute(
+                f"INSERT OR REPLACE INTO files ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                (path, ts, size, cls, expires) + catalog,
+            )
+            self.db.commit()
+            if old:
+                self.total_bytes -= old[0]
+            else:
+                self.count += 1
+            self.total_bytes += size
+
+    def adopt(self, directory: str, classify: Callable[[str], str | None]) -> int:
+        """
+        One-time import of files saved before the index existed.
+        Only runs when the index is empty. classify returns the class of
+        each file name (None to skip it).
+        """
+        if self.count:
+            return 0
+        adopted = 0
+        for entry in os.scandir(directory):
+            cls = classify(entry.name)
+            if cls is None or not entry.is_file():
+                continue
+            st = entry.stat()
+            self.add(entry.path, cls, ts=st.st_mtime, size=st.st_size)
+            adopted += 1
+        if adopted:
+            logging.info("Retention index adopted %d existing files from %s", adopted, directory)
+        return adopted
+
+    def enforce(self, now: float | None = None, limit: int = 200) -> list[str]:
+        """Delete expired files, then evict the oldest until under max_bytes."""
+        now = time.time() if now is None else now
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT path, size FROM files WHERE expires IS NOT NULL AND expires <= ? "
+                "ORDER BY expires LIMIT ?",
+                (now, limit),
+            ).fetchall()
+
+            if self.max_bytes > 0:
+                excess = self.total_bytes - sum(size for _, size in rows) - self.max_bytes
+                expired = {path for path, _ in rows}
+                for cls in self.evict_order:
+                    if excess <= 0:
+                        break
+                    for path, size in self.db.execute(
+                        "SELECT path, size FROM files WHERE class = ? ORDER BY ts LIMIT ?",
+                        (cls, limit),
+                    ):
+                        if excess <= 0:
+                            break
+                        if path in expired:
+                            continue
+                        rows.append((path, size))
+                        excess -= size
+
+            if not rows:
+                return []
+
+            for path, _ in rows:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.error("Retention failed to delete %s: %s", path, e)
+
+            self.db.executemany("DELETE FROM files WHERE path = ?", [(p,) for p, _ in rows])
+            self.db.commit()
+            self.total_bytes -= sum(size for _, size in rows)
+            self.count -= len(rows)
+
+        deleted = [path for path, _ in rows]
+        if self.on_delete is not None:
+            self.on_delete(deleted)
+        return deleted
+
+    def describe(self) -> dict:
+        with self.lock:
+            per_class = {
+                cls: {"files": n, "bytes": b}
+                for cls, n, b in self.db.execute(
+                    "SELECT class, COUNT(*), SUM(size) FROM files GROUP BY class"
+                )
+            }
+        return {
+            "files": self.count,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "classes": per_class,
+        }
@@ -2,17 +2,21 @@
 from collections import deque
 import threading
 from typing import Tuple, List
+import cv2
 import numpy as np
 from metadata import FrameMetadata
 
 class RingBuffer:
-    def __init__(self, size: int) -> None:
+    def __init__(self, size: int, shared=None) -> None:
         self.buffer: deque[Tuple[np.ndarray, FrameMetadata]] = deque(maxlen=size)
         self.lock = threading.Lock()
+        self.shared = shared    # optional SharedRing mirror for worker processes
 
     def append(self, item: Tuple[np.ndarray, FrameMetadata]) -> None:
         with self.lock:
             self.buffer.append(item)
+        if self.shared is not None:
+            self.shared.write(*item)
 
     def get_last(self, n: int) -> List[Tuple[np.ndarray, FrameMetadata]]:
         with self.lock:
@@ -20,3 +24,30 @@ class RingBuffer:
 
     def get_last_seconds(self, seconds: int, fps: int) -> List[Tuple[np.ndarray, FrameMetadata]]:
         return self.get_last(int(seconds * fps))
+
+    def nbytes(self) -> int:
+        with self.lock:
+            return sum(img.nbytes for img, _ in self.buffer)
+
+    def resize(self, size: int, shape: tuple[int, int] | None = None) -> int:
+        """
+        Reallocate the ring for size frames, keeping the most recent ones.
+        shape=(width, height) converts kept frames of another resolution.
+        Returns the number of frames kept.
+        """
+        with self.lock:
+            kept = list(self.buffer)[-size:]
+            if shape is not None:
+                width, height = shape
+                converted = []
+                for img, meta in kept:
+                    if img.shape[1] != width or img.shape[0] != height:
+                        shrink = width * height < img.shape[1] * img.shape[0]
+                        img = cv2.resize(
+                            img, (width, height),
+                            interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR
+                        )
+                    converted.append((img, meta))
+                kept = converted
+            self.buffer = deque(kept, maxlen=size)
+            return len(kept)
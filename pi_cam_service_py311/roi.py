@@ -0,0 +1,96 @@
+import threading
+from dataclasses import dataclass
+import numpy as np
+
+
+@dataclass(slots=True, frozen=True)
+class Roi:
+    """Named region as fractions of the frame, so it fits any ring resolution."""
+    name: str
+    x: float
+    y: float
+    width: float
+    height: float
+    fps: float              # 0: the server fps; never above it
+
+    def bounds(self, shape: tuple) -> tuple[int, int, int, int]:
+        """(top, bottom, left, right) in pixels for a frame of this shape."""
+        h, w = shape[:2]
+        top, left = int(self.y * h), int(self.x * w)
+        bottom = max(top + 1, int(round((self.y + self.height) * h)))
+        right = max(left + 1, int(round((self.x + self.width) * w)))
+        return top, min(bottom, h), left, min(right, w)
+
+    def crop(self, img: np.ndarray) -> np.ndarray:
+        """View of the region (no copy); cv2 encodes strided views directly."""
+        top, bottom, left, right = self.bounds(img.shape)
+        return img[top:bottom, left:right]
+
+    def stream_fps(self, server_fps: float) -> float:
+        return min(self.fps, server_fps) if self.fps > 0 else server_fps
+
+
+class RoiSet:
+    """
+    ROIs from config (roi.regions) and per-ROI brightness statistics,
+    sampled at each ROI's fps from the ring frames (mean of the view, its
+    EMA, min and max).
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        self.rois: dict[str, Roi] = {}
+        for name, r in cfg["regions"].items():
+            roi = Roi(name, float(r["x"]), float(r["y"]), float(r["width"]), float(r["height"]), float(r.get("fps", 0)))
+            if not (0 <= roi.x < 1 and 0 <= roi.y < 1 and 0 < roi.width <= 1 - roi.x and 0 < roi.height <= 1 - roi.y):
+                raise ValueError(f"roi.regions.{name}: x, y, width, height must be fractions inside the frame")
+            self.rois[name] = roi
+        self.lock = threading.Lock()
+        self.stats: dict[str, dict] = {name: {"samples": 0} for name in self.rois}
+        self._last: dict[str, float] = {}
+
+    def get(self, name: str) -> Roi | None:
+        return self.rois.get(name)
+
+    def update(self, img: np.ndarray, meta, server_fps: float) -> None:
+        alpha = self.cfg["ema_alpha"]
+        for name, roi in self.rois.items():
+            if meta.timestamp - self._last.get(name, 0.0) < 1 / roi.stream_fps(server_fps):
+                continue
+            self._last[name] = meta.timestamp
+            mean = float(roi.crop(img).mean())
+            with self.lock:
+                s = self.stats[name]
+                if s["samples"] == 0:
+                    s.update(ema=mean, min=mean, max=mean)
+                else:
+                    s["ema"] = (1 - alpha) * s["ema"] + alpha * mean
+                    s["min"] = min(s["min"], mean)
+                    s["max"] = max(s["max"], mean)
+                s["samples"] += 1
+                s["last"] = mean
+                s["frame_id"] = meta.frame_id
+                s["shape"] = img.shape[:2]
+
+    def describe(self, server_fps: float) -> dict:
+        with self.lock:
+            result = {}
+            for name, roi in self.rois.items():
+                s = self.stats[name]
+                entry = {
+                    "region": [roi.x, roi.y, roi.width, roi.height],
+                    "fps": roi.stream_fps(server_fps),
+                    "samples": s["samples"],
+                }
+                if s["samples"]:
+                    top, bottom, left, right = roi.bounds(s["shape"])
+                    entry.update(
+                        pixels=f"{right - left}x{bottom - top}+{left}+{top}",
+                        brightness=round(s["last"], 1),
+                        brightness_ema=round(s["ema"], 1),
+                        brightness_min=round(s["min"], 1),
+                        brightness_max=round(s["max"], 1),
+                        frame_id=s["frame_id"],
+                    )
+                result[name] = entry
+            return result
@@ -0,0 +1,238 @@
+import copy
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable
+
+
+def update_cfg(cfg: dict, key_path: str, value) -> bool:
+    """
+    Update a nested cfg key with a new value.
+    key_path: e.g., "camera.framerate" or "night.bright_threshold"
+    value: new value (converted to appropriate type if needed)
+    Returns True if updated, False if key not found.
+    """
+    keys = key_path.split(".")
+    sub = cfg
+    for k in keys[:-1]:
+        if k not in sub:
+            return False
+        sub = sub[k]
+    last_key = keys[-1]
+    if last_key not in sub:
+        return False
+
+    current_type = type(sub[last_key])
+    if current_type is bool:
+        # accept 1/0, true/false
+        sub[last_key] = str(value).lower() in ("1", "true", "yes")
+    else:
+        sub[last_key] = current_type(value)
+
+    return True
+
+
+def get_cfg(cfg: dict, key_path: str):
+    sub = cfg
+    for k in key_path.split("."):
+        sub = sub[k]
+    return sub
+
+
+def _check(ok: bool, msg: str) -> None:
+    if not ok:
+        raise ValueError(msg)
+
+
+@dataclass(slots=True, frozen=True)
+class CameraSettings:
+    width: int
+    height: int
+    framerate: float
+    capture_timeout_s: float
+
+
+@dataclass(slots=True, frozen=True)
+class RingSettings:
+    size: int
+    downscale: bool
+    width: int              # ring image size (downscaled or camera size)
+    height: int
+
+
+@dataclass(slots=True, frozen=True)
+class AnalysisSettings:
+    thumb_width: int
+    thumb_height: int
+
+
+@dataclass(slots=True, frozen=True)
+class NightSettings:
+    enable: bool
+    dark_threshold: float
+    bright_threshold: float
+    min_dark_frames: int
+    exposure_us: int
+    gain: float
+    use_smoothed_score: bool
+
+
+@dataclass(slots=True, frozen=True)
+class ExportSettings:
+    auto_save_interval_s: float
+    auto_save_use_ring: bool
+
+
+@dataclass(slots=True, frozen=True)
+class MJPEGSettings:
+    enable: bool
+    port: int
+    fps: float
+
+
+@dataclass(slots=True, frozen=True)
+class Settings:
+    """Typed, validated snapshot of the hot-path parts of config.json."""
+    camera: CameraSettings
+    ring: RingSettings
+    analysis: AnalysisSettings
+    night: NightSettings
+    export: ExportSettings
+    mjpeg: MJPEGSettings
+
+    @classmethod
+    def from_dict(cls, cfg: dict) -> "Settings":
+        c, r, n, e = cfg["camera"], cfg["ring"], cfg["night"], cfg["export"]
+        m = cfg.get("mjpeg_server", {})
+        downscale = r.get("downscale", {})
+
+        camera = CameraSettings(
+            width=int(c["width"]),
+            height=int(c["height"]),
+            framerate=float(c["framerate"]),
+            capture_timeout_s=float(c.get("capture_timeout_s", 4.0)),
+        )
+        _check(camera.width > 0 and camera.height > 0, "camera.width/height must be > 0")
+        _check(camera.framerate > 0, "camera.framerate must be > 0")
+
+        if downscale.get("enable", False):
+            ring_size = (int(downscale["width"]), int(downscale["height"]))
+        else:
+            ring_size = (camera.width, camera.height)
+        ring = RingSettings(
+            size=int(r["size"]),
+            downscale=bool(downscale.get("enable", False)),
+            width=ring_size[0],
+            height=ring_size[1],
+        )
+        _check(ring.size >= 1, "ring.size must be >= 1")
+        _check(ring.width > 0 and ring.height > 0, "ring.downscale.width/height must be > 0")
+
+        analysis = AnalysisSettings(
+            thumb_width=int(cfg["analysis"]["thumb_width"]),
+            thumb_height=int(cfg["analysis"]["thumb_height"]),
+        )
+        _check(analysis.thumb_width >= 3 and analysis.thumb_height >= 3, "analysis thumbnail must be at least 3x3")
+
+        night = NightSettings(
+            enable=bool(n["enable"]),
+            dark_threshold=float(n["dark_threshold"]),
+            bright_threshold=float(n["bright_threshold"]),
+            min_dark_frames=int(n["min_dark_frames"]),
+            exposure_us=int(n["exposure_us"]),
+            gain=float(n["gain"]),
+            use_smoothed_score=bool(n.get("use_smoothed_score", False)),
+        )
+        _check(0 <= night.dark_threshold <= 255, "night.dark_threshold must be in 0..255")
+        _check(0 <= night.bright_threshold <= 255, "night.bright_threshold must be in 0..255")
+        _check(night.min_dark_frames >= 1, "night.min_dark_frames must be >= 1")
+        _check(night.exposure_us > 0, "night.exposure_us must be > 0")
+
+        export = ExportSettings(
+            auto_save_interval_s=float(e.get("auto_save_interval_s", 0)),
+            auto_save_use_ring=bool(e.get("auto_save_use_ring", False)),
+        )
+
+        mjpeg = MJPEGSettings(
+            enable=bool(m.get("enable", False)),
+            port=int(m.get("port", 8080)),
+            fps=float(m.get("fps", 2)),
+        )
+        _check(mjpeg.fps > 0, "mjpeg_server.fps must be > 0")
+
+        return cls(camera, ring, analysis, night, export, mjpeg)
+
+
+class ConfigStore:
+    """
+    Owns the config dict and its typed Settings snapshot.
+
+    set() validates the change on a copy, then updates the dict in place,
+    swaps in a new Settings object and calls the subscribers whose prefix
+    matches the key, as callback(key_path, settings). Hot paths read
+    store.settings (plain attribute access) instead of walking the dict.
+
+    Transactional subscribers run first; if one raises, the change is
+    rolled back, they are called again with the old settings and set()
+    raises ValueError.
+    """
+
+    def __init__(self, cfg: dict) -> None:
+        self.cfg = cfg
+        self.settings = Settings.from_dict(cfg)
+        self.lock = threading.Lock()
+        self._subscribers: list[tuple[str, Callable[[str, Settings], None]]] = []
+        self._transactional: list[tuple[str, Callable[[str, Settings], None]]] = []
+
+    def subscribe(self, prefix: str, callback: Callable[[str, Settings], None], transactional: bool = False) -> None:
+        if transactional:
+            self._transactional.append((prefix, callback))
+        else:
+            self._subscribers.append((prefix, callback))
+
+    def get(self, key_path: str):
+        try:
+            return get_cfg(self.cfg, key_path)
+        except (KeyError, TypeError):
+            return None
+
+    def set(self, key_path: str, value) -> bool:
+        """Returns False for an unknown key, raises ValueError for an invalid value."""
+        with self.lock:
+            candidate = copy.deepcopy(self.cfg)
+            if not update_cfg(candidate, key_path, value):
+                return False
+            settings = Settings.from_dict(candidate)
+
+            old_value = get_cfg(self.cfg, key_path)
+            old_settings = self.settings
+            update_cfg(self.cfg, key_path, value)
+            self.settings = settings
+
+            applied = []
+            for prefix, callback in self._transactional:
+                if not key_path.startswith(prefix):
+                    continue
+                try:
+                    callback(key_path, settings)
+                    applied.append(callback)
+                except Exception as e:
+                    update_cfg(self.cfg, key_path, old_value)
+                    self.settings = old_settings
+                    for undo in (*applied, callback):
+                        try:
+                            undo(key_path, old_settings)
+                        except Exception as undo_error:
+                            logging.error("Rollback of %s failed: %s", key_path, undo_error)
+                    raise ValueError(f"failed to apply: {e}") from e
+
+        self.publish(key_path)
+        return True
+
+    def publish(self, key_path: str) -> None:
+        for prefix, callback in self._subscribers:
+            if key_path.startswith(prefix):
+                try:
+                    callback(key_path, self.settings)
+                except Exception as e:
+                    logging.warning("Failed to apply %s live: %s", key_path, e)
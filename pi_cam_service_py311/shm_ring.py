@@ -0,0 +1,238 @@
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import List, Tuple
+import numpy as np
+from metadata import FrameMetadata
+
+# Frames handed out by a reader are used for one encode: a mapping replaced by a
+# resize is closed once this long has passed (numpy views do not pin the mapping)
+RETIRED_GRACE_S = 10.0
+
+# Segment layout: CONTROL | SLOT_HEADER * slots | frame data * slots
+CONTROL = np.dtype([
+    ("slots", "<u4"),
+    ("slot_bytes", "<u8"),
+    ("writes", "<u8"),
+    ("retired", "<u1"),         # set before the segment is replaced by a resized one
+])
+
+SLOT_HEADER = np.dtype([
+    ("seq", "<u8"),             # odd while the slot is being written
+    ("frame_id", "<i8"),
+    ("timestamp", "<f8"),
+    ("dark_score", "<f8"),
+    ("motion_score", "<f8"),
+    ("night_mode", "<u1"),
+    ("height", "<u4"),
+    ("width", "<u4"),
+    ("channels", "<u4"),
+])
+
+
+def _views(buf, slots: int, slot_bytes: int):
+    control = np.ndarray((), dtype=CONTROL, buffer=buf)
+    headers = np.ndarray((slots,), dtype=SLOT_HEADER, buffer=buf, offset=CONTROL.itemsize)
+    data_offset = CONTROL.itemsize + SLOT_HEADER.itemsize * slots
+    data = np.ndarray((slots, slot_bytes), dtype=np.uint8, buffer=buf, offset=data_offset)
+    return control, headers, data
+
+
+class SharedRing:
+    """
+    Writer side: mirrors the newest frames into a multiprocessing
+    shared-memory segment. Each slot carries a seqlock counter, so
+    readers in other processes can use frames in place and detect
+    when a slot was overwritten under them.
+    """
+
+    def __init__(self, name: str, slots: int, slot_bytes: int) -> None:
+        self.name = name
+        self.slots = slots
+        self._create(slot_bytes)
+
+    def _create(self, slot_bytes: int) -> None:
+        size = CONTROL.itemsize + (SLOT_HEADER.itemsize + slot_bytes) * self.slots
+        try:
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        except FileExistsError:
+            # Left over from a crashed run
+            stale = shared_memory.SharedMemory(name=self.name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+
+        self.slot_bytes = slot_bytes
+        self.control, self.headers, self.data = _views(self.shm.buf, self.slots, slot_bytes)
+        self.control["slot_bytes"] = slot_bytes
+        self.control["writes"] = 0
+        self.headers["seq"] = 0
+        # Last: readers attaching meanwhile see slots == 0 and wait
+        self.control["slots"] = self.slots
+        self._warned = False
+
+    def resize(self, slot_bytes: int) -> None:
+        """
+        Replace the segment by one with slot_bytes per slot, under the
+        same name. Readers see the old one retired and reattach.
+        Not thread-safe with write(): call it with the ring's writer held.
+        """
+        if slot_bytes == self.slot_bytes:
+            return
+        old_bytes = self.slot_bytes
+        self.control["retired"] = 1
+        self.close()
+        try:
+            self._create(slot_bytes)
+        except OSError:
+            # e.g. /dev/shm full: keep publishing at the old size
+            self._create(old_bytes)
+            raise
+
+    def write(self, img: np.ndarray, meta: FrameMetadata) -> None:
+        if img.nbytes > self.slot_bytes:
+            if not self._warned:
+                logging.warning(
+                    "Frame %s (%d bytes) does not fit shared ring slot (%d bytes), not published",
+                    img.shape, img.nbytes, self.slot_bytes
+                )
+                self._warned = True
+            return
+
+        slot = int(self.control["writes"]) % self.slots
+        h = self.headers[slot:slot + 1]
+        h["seq"] += 1
+        self.data[slot, :img.nbytes] = img.reshape(-1).view(np.uint8)
+        height, width = img.shape[:2]
+        h["frame_id"] = meta.frame_id
+        h["timestamp"] = meta.timestamp
+        h["dark_score"] = meta.dark_score
+        h["motion_score"] = meta.motion_score
+        h["night_mode"] = meta.night_mode
+        h["height"] = height
+        h["width"] = width
+        h["channels"] = img.shape[2] if img.ndim == 3 else 1
+        h["seq"] += 1
+        self.control["writes"] += 1
+
+    def close(self) -> None:
+        del self.control, self.headers, self.data
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedRingReader:
+    """
+    Read-only view of a SharedRing from another process. get_last()
+    has the same shape as RingBuffer.get_last() but returns views into
+    shared memory instead of copies; call still_valid(meta) after
+    processing a frame to check it was not overwritten meanwhile.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.shm = None
+        self.slots = 0
+        self.slot_bytes = 0
+        self.lock = threading.Lock()
+        self._retired: list[tuple[shared_memory.SharedMemory, float]] = []
+        self._seq: dict[int, tuple[int, int]] = {}   # frame_id -> (slot, seq)
+        self._attach()
+
+    def _attach(self) -> bool:
+        """Map the current segment; False while the writer is replacing it."""
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            if self.shm is None:
+                raise
+            return False
+        # The writer owns the segment. Children of the service share its resource
+        # tracker; a standalone process has its own, which would unlink it on exit.
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        control = np.ndarray((), dtype=CONTROL, buffer=shm.buf)
+        slots, slot_bytes = int(control["slots"]), int(control["slot_bytes"])
+        if slots == 0 or control["retired"]:
+            del control
+            shm.close()
+            if self.shm is None:
+                raise RuntimeError(f"shared ring '{self.name}' is not initialized")
+            return False
+        del control
+
+        old = self.shm
+        self.control, self.headers, self.data = _views(shm.buf, slots, slot_bytes)
+        self.shm = shm
+        self.slots, self.slot_bytes = slots, slot_bytes
+        self._seq.clear()
+        if old is not None:
+            # Frames handed out by get_last() may still be in use
+            self._retired.append((old, time.monotonic()))
+        return True
+
+    def _close_retired(self, grace_s: float = RETIRED_GRACE_S) -> None:
+        with self.lock:
+            now = time.monotonic()
+            for shm, retired_at in list(self._retired):
+                if now - retired_at >= grace_s:
+                    shm.close()
+                    self._retired.remove((shm, retired_at))
+
+    def _current(self) -> bool:
+        """Follow a resize of the writer's segment; False while it is replaced."""
+        if self._retired:
+            self._close_retired()
+        if not self.control["retired"]:
+            return True
+        with self.lock:
+            return not self.control["retired"] or self._attach()
+
+    def _read_slot(self, slot: int) -> Tuple[np.ndarray, FrameMetadata] | None:
+        h = self.headers[slot]
+        seq = int(h["seq"])
+        if seq == 0 or seq % 2:
+            return None
+        height, width, channels = int(h["height"]), int(h["width"]), int(h["channels"])
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        img = self.data[slot, :height * width * channels].reshape(shape)
+        img.flags.writeable = False
+        meta = FrameMetadata(
+            frame_id=int(h["frame_id"]),
+            timestamp=float(h["timestamp"]),
+            dark_score=float(h["dark_score"]),
+            night_mode=bool(h["night_mode"]),
+            motion_score=float(h["motion_score"]),
+        )
+        if int(self.headers[slot]["seq"]) != seq:
+            return None
+        self._seq[meta.frame_id] = (slot, seq)
+        return img, meta
+
+    def get_last(self, n: int) -> List[Tuple[np.ndarray, FrameMetadata]]:
+        if not self._current():
+            return []
+        writes = int(self.control["writes"])
+        n = min(n, self.slots, writes)
+        if len(self._seq) > 4 * self.slots:
+            self._seq.clear()
+        frames = []
+        for i in range(writes - n, writes):
+            item = self._read_slot(i % self.slots)
+            if item is not None:
+                frames.append(item)
+        return frames
+
+    def still_valid(self, meta: FrameMetadata) -> bool:
+        slot_seq = self._seq.get(meta.frame_id)
+        if slot_seq is None:
+            return False
+        slot, seq = slot_seq
+        return int(self.headers[slot]["seq"]) == seq
+
+    def close(self) -> None:
+        del self.control, self.headers, self.data
+        self.shm.close()
+        self._close_retired(grace_s=0)
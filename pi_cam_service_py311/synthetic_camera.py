@@ -0,0 +1,99 @@
+import threading
+import time
+import numpy as np
+
+
+class _Request:
+    def __init__(self, img: np.ndarray, metadata: dict) -> None:
+        self.img = img
+        self.metadata = metadata
+
+    def get_metadata(self) -> dict:
+        return self.metadata
+
+    def make_array(self, name: str) -> np.ndarray:
+        return self.img
+
+    def release(self) -> None:
+        pass
+
+
+class SyntheticCamera:
+    """
+    Stand-in for Picamera2 (camera.synthetic in config.json), for load
+    tests and development without a camera: the subset of the API used by
+    CameraController, frames paced at the configured frame rate (or the
+    exposure time in still mode), textured so JPEG encoding costs about
+    what a real scene does. Brightness follows the exposure and gain.
+    """
+
+    def __init__(self) -> None:
+        self.size = (640, 480)
+        self.controls: dict = {}
+        self.camera_controls: dict = {}
+        self.started = False
+        self.still = False
+        self.lock = threading.Lock()
+        self._base: np.ndarray | None = None
+        self._next = 0.0
+        self._frame = 0
+
+    def create_video_configuration(self, main: dict, controls: dict | None = None, **kwargs) -> dict:
+        return {"main": main, "controls": dict(controls or {}), "still": False}
+
+    def create_still_configuration(self, main: dict, controls: dict | None = None, **kwargs) -> dict:
+        return {"main": main, "controls": dict(controls or {}), "still": True}
+
+    def configure(self, config: dict) -> None:
+        self.size = tuple(config["main"]["size"])
+        self.controls = config["controls"]
+        self.still = config["still"]
+        width, height = self.size
+        rng = np.random.default_rng(0)
+        # Texture at a quarter of the size, repeated: cheap to make, realistic to encode
+        tile = rng.integers(0, 256, (height // 2 + 1, width // 2 + 1, 3), dtype=np.uint8)
+        self._base = np.tile(tile, (2, 2, 1))[:height, :width]
+
+    def start(self) -> None:
+        self.started = True
+
+    def stop(self) -> None:
+        self.started = False
+
+    def set_controls(self, controls: dict) -> None:
+        self.controls.update(controls)
+
+    def _exposure_us(self) -> int:
+        exposure = self.controls.get("ExposureTime") or 0
+        if exposure > 0 and (self.still or not self.controls.get("AeEnable", True)):
+            return int(exposure)
+        return int(1e6 / self.controls.get("FrameRate", 30))
+
+    def _gain(self) -> float:
+        return float(self.controls.get("AnalogueGain") or 1.0)
+
+    def capture_metadata(self) -> dict:
+        return {"ExposureTime": self._exposure_us(), "AnalogueGain": self._gain(), "FrameDuration": self._exposure_us()}
+
+    def capture_array(self, name: str = "main") -> np.ndarray:
+        with self.lock:
+            if self.still:
+                interval = self._exposure_us() / 1e6
+            else:
+                interval = 1 / self.controls.get("FrameRate", 30)
+            now = time.monotonic()
+            self._next = max(self._next + interval, now)
+            if self._next > now:
+                time.sleep(self._next - now)
+            self._frame += 1
+            shift = self._frame * 4 % self._base.shape[1]
+            img = np.roll(self._base, shift, axis=1)
+        # Auto exposure lands mid-grey in video mode; manual exposure scales brightness
+        if self.still or not self.controls.get("AeEnable", True):
+            scale = self._exposure_us() * self._gain() / 20000
+            if scale < 1:
+                img = (img * scale).astype(np.uint8)
+        return img
+
+    def capture_request(self, name: str = "main") -> _Request:
+        return _Request(self.capture_array(), self.capture_metadata())
@@ -0,0 +1,15 @@
+import json
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+
+@pytest.fixture
+def cfg() -> dict:
+    """A fresh copy of the shipped config.json."""
+    with open(os.path.join(SERVICE_DIR, "config.json")) as f:
+        return json.load(f)
@@ -0,0 +1,80 @@
+import time
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from archive import ArchiveReader, write_archive
+from metadata import FrameMetadata
+
+
+def make_frames(count=37):
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        # The ring is resized mid-window: chunks split on the shape change
+        shape = (48, 64, 3) if i < 20 else (24, 32, 3)
+        img = rng.integers(0, 256, shape, dtype=np.uint8)
+        meta = FrameMetadata(frame_id=100 + i, timestamp=1000.0 + i / 10, dark_score=float(i),
+                             night_mode=i % 2 == 1, motion_score=i / 100)
+        frames.append((img, meta))
+    return frames
+
+
+def check_round_trip(path, frames):
+    with ArchiveReader(path) as archive:
+        assert len(archive) == len(frames)
+        for i, (img, meta) in enumerate(frames):
+            got, got_meta = archive.frame(i)
+            np.testing.assert_array_equal(got, img)
+            assert got_meta.frame_id == meta.frame_id
+            assert got_meta.night_mode == meta.night_mode
+        assert archive.find(frame_id=125) == 25
+        assert archive.find(t=1000.52) == 5
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_npz_round_trip(tmp_path, compress):
+    frames = make_frames()
+    path = write_archive(str(tmp_path / "window"), frames, {"backend": "npz", "chunk_frames": 8, "compress": compress})
+    assert path.endswith(".npz")
+    check_round_trip(path, frames)
+    # Plain numpy can read it too
+    assert np.load(path)["meta"].shape == (len(frames),)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_hdf5_round_trip(tmp_path, compress):
+    pytest.importorskip("h5py")
+    frames = make_frames()
+    path = write_archive(str(tmp_path / "window"), frames, {"backend": "hdf5", "chunk_frames": 8, "compress": compress})
+    assert path.endswith(".h5")
+    check_round_trip(path, frames)
+
+
+def test_past_stack_archive_keeps_the_whole_window(cfg, tmp_path):
+    from exporter import Exporter
+    from main import save_past_frames
+    from ring_buffer import RingBuffer
+
+    cfg["export"].update(base_dir=str(tmp_path), async_write=False, stack_dark_frames=True, stack_count=4, save_before_s=5)
+    cfg["camera"]["framerate"] = 10
+    exporter = Exporter(cfg["export"])
+    ring = RingBuffer(100)
+    start = time.time() - 6
+    for i, (img, meta) in enumerate(make_frames(60)):
+        # Recent timestamps: retention would delete frames from 1970 right away
+        ring.append((np.ascontiguousarray(img[:24, :32]), replace(meta, timestamp=start + i / 10)))
+
+    result = save_past_frames(ring, exporter, cfg, ["archive", "jpg"])
+
+    with ArchiveReader(result["archive"]) as archive:
+        assert len(archive) == 50
+    assert result["stacked"] and len(result["images_from"]) == 4
+    assert len(result["images"]) == 1 and result["images"][0].endswith(".jpg")
+    # "archive" in export.formats with stacking on: still the whole window, never a stacked frame
+    cfg["export"]["formats"] = ["archive"]
+    result = save_past_frames(ring, exporter, cfg)
+    with ArchiveReader(result["archive"]) as archive:
+        assert len(archive) == 50
+    assert not result["images"]
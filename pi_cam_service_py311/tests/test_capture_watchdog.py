@@ -0,0 +1,66 @@
+import threading
+import time
+
+from camera_controller import CameraController
+from capture_watchdog import CaptureWatchdog
+from ring_buffer import RingBuffer
+from settings import ConfigStore
+
+
+def start_camera(cfg):
+    cfg["camera"]["synthetic"] = True
+    cfg["camera"]["capture_timeout_s"] = 0.3
+    cfg["watchdog"].update(check_interval_s=0.05, abort_after=2, backoff_s=0)
+    store = ConfigStore(cfg)
+    cam = CameraController(store, RingBuffer(4))
+    cam.start_video()
+    watchdog = CaptureWatchdog(cfg["watchdog"], cam, store)
+    cam.watchdog = watchdog
+    watchdog.start()
+    return cam, watchdog
+
+
+def capture(cam, watchdog, count):
+    for _ in range(count):
+        try:
+            cam.capture_once()
+        except Exception as e:
+            watchdog.capture_failed(e)
+            continue
+        watchdog.beat()
+
+
+def test_long_locked_operation_is_not_a_stuck_capture(cfg):
+    cam, watchdog = start_camera(cfg)
+    # Like calibrate_dark or capture_bracket: the lock held for many deadlines
+    with cam.lock:
+        loop = threading.Thread(target=capture, args=(cam, watchdog, 3))
+        loop.start()
+        time.sleep(2.0)
+    loop.join(timeout=5)
+
+    assert not loop.is_alive()
+    assert watchdog.incidents == 0
+    assert not watchdog.attempts
+    assert not cam.needs_restart
+
+
+def test_stuck_capture_is_aborted(cfg):
+    cam, watchdog = start_camera(cfg)
+    capture_array = cam.cam.capture_array
+
+    def hang(name="main"):
+        while cam.cam.started:
+            time.sleep(0.01)
+        raise RuntimeError("camera stopped")
+
+    cam.cam.capture_array = hang
+    loop = threading.Thread(target=capture, args=(cam, watchdog, 1))
+    loop.start()
+    loop.join(timeout=5)
+    cam.cam.capture_array = capture_array
+    capture(cam, watchdog, 1)
+
+    assert [a["step"] for a in watchdog.attempts] == ["abort", "retry"]
+    assert watchdog.incidents == 1
+    assert watchdog.incident_start is None
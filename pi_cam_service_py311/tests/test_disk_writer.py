@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+import disk_writer
+from disk_writer import DiskWriter
+
+
+@pytest.fixture
+def writer(cfg):
+    # Batches are written by calling _write_batch directly, without the thread
+    return DiskWriter(cfg["export"])
+
+
+def submit_batch(writer, entries):
+    done = []
+    batch = [(path, data, lambda p, ok, i=i: done.append((i, p, ok))) for i, (path, data) in enumerate(entries)]
+    writer.pending += len(batch)
+    writer._write_batch(batch)
+    return done
+
+
+def test_batch_writes_all_files_before_one_sync_pass(writer, tmp_path, monkeypatch):
+    calls = []
+    real_fsync, real_replace = os.fsync, os.replace
+    monkeypatch.setattr(os, "fsync", lambda fd: (calls.append("fsync"), real_fsync(fd)))
+    monkeypatch.setattr(os, "replace", lambda a, b: (calls.append("rename"), real_replace(a, b)))
+    monkeypatch.setattr(disk_writer, "fsync_dir", lambda d: calls.append("dir"))
+
+    paths = [str(tmp_path / f"{i}.jpg") for i in range(4)]
+    done = submit_batch(writer, [(p, bytes([i]) * 10) for i, p in enumerate(paths)])
+
+    assert calls == ["fsync"] * 4 + ["rename"] * 4 + ["dir"]
+    assert [ok for _, _, ok in done] == [True] * 4
+    assert all(open(p, "rb").read() == bytes([i]) * 10 for i, p in enumerate(paths))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+    stats = writer.describe()
+    assert stats["files_written"] == 4 and stats["bytes_written"] == 40 and stats["pending"] == 0
+
+
+def test_duplicate_path_is_written_once_with_the_last_data(writer, tmp_path):
+    path = str(tmp_path / "a.jpg")
+    other = str(tmp_path / "b.jpg")
+    done = submit_batch(writer, [(path, b"old"), (other, b"other"), (path, b"new")])
+
+    assert open(path, "rb").read() == b"new"
+    # Only the entries actually written are reported
+    assert done == [(1, other, True), (2, path, True)]
+    stats = writer.describe()
+    assert stats["files_written"] == 2 and stats["superseded"] == 1 and stats["pending"] == 0
+
+
+def test_failed_write_is_reported_through_on_done(writer, tmp_path):
+    good = str(tmp_path / "good.jpg")
+    bad = str(tmp_path / "missing" / "bad.jpg")
+    done = submit_batch(writer, [(bad, b"x"), (good, b"y")])
+
+    assert done == [(0, bad, False), (1, good, True)]
+    assert os.path.exists(good)
+    assert writer.describe()["errors"] == 1
+
+
+def test_failed_sync_leaves_no_tmp_file(writer, tmp_path, monkeypatch):
+    def fail(fd):
+        raise OSError("I/O error")
+    monkeypatch.setattr(os, "fsync", fail)
+    path = str(tmp_path / "a.jpg")
+    done = submit_batch(writer, [(path, b"x")])
+
+    assert done == [(0, path, False)]
+    assert os.listdir(tmp_path) == []
+    assert writer.describe()["errors"] == 1
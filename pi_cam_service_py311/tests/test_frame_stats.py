@@ -0,0 +1,79 @@
+import numpy as np
+
+from frame_stats import FrameStats, RollingWindow
+
+
+def test_window_longer_than_old_sample_capacity():
+    # 300 s at 10 fps: 3000 samples, far more than the 512 the old window kept
+    window = RollingWindow(300, 0.1)
+    start = 1_700_000_000.0
+    for i in range(3000):
+        window.push(start + i / 10, float(i))
+
+    assert window.min(300) == 0.0
+    assert window.max(300) == 2999.0
+    assert window.mean(300) == np.mean(np.arange(3000))
+    assert window.min(10) == 2890.0
+
+
+def test_window_forgets_old_seconds():
+    window = RollingWindow(5, 0.1)
+    for second in range(20):
+        window.push(1000.0 + second, float(second))
+
+    assert window.min(5) == 14.0
+    assert window.max(5) == 19.0
+
+
+def test_frame_stats_night_level_window(cfg):
+    # The darkest frame is the first of a full window at the configured frame rate
+    stats = FrameStats(cfg["stats"])
+    fps = cfg["camera"]["framerate"]
+    window_s = cfg["stats"]["window_s"]
+    for i in range(int(window_s * fps)):
+        small = np.full((48, 64, 3), 20 if i == 0 else 100, dtype=np.uint8)
+        stats.update(small, small[..., 0].astype(np.float32), 1000.0 + i / fps)
+
+    assert stats.brightness.min(window_s) == 20.0
+    assert stats.brightness.max(window_s) == 100.0
+
+
+def test_overexposed_needs_the_whole_window(cfg):
+    stats = FrameStats(cfg["stats"])
+    seconds = cfg["stats"]["overexposed_s"]
+    white = np.full((48, 64, 3), 255, dtype=np.uint8)
+    gray = white[..., 0].astype(np.float32)
+
+    # One clipped frame, e.g. right after a mode change
+    stats.update(white, gray, 1000.0)
+    assert not stats.overexposed()
+
+    for i in range(1, seconds * 10 + 1):
+        stats.update(white, gray, 1000.0 + i / 10)
+    assert stats.overexposed()
+
+    stats.update(np.full_like(white, 100), gray * 0 + 100, 1000.0 + seconds + 0.2)
+    assert not stats.overexposed()
+
+
+def test_capture_uses_a_clock_that_does_not_step_back(cfg, monkeypatch):
+    import time
+
+    from camera_controller import CameraController
+    from ring_buffer import RingBuffer
+    from settings import ConfigStore
+
+    cfg["camera"]["synthetic"] = True
+    stats = FrameStats(cfg["stats"])
+    cam = CameraController(ConfigStore(cfg), RingBuffer(4), stats=stats)
+    cam.start_video()
+    cam.capture_once()
+    # NTP steps the wall clock back by an hour
+    real_time = time.time
+    monkeypatch.setattr(time, "time", lambda: real_time() - 3600)
+    cam.capture_once()
+
+    # Both frames count in the window (on the wall clock the second one would
+    # fall an hour before it, and later frames would empty it)
+    brightness = stats.brightness
+    assert brightness.count[brightness._recent(cfg["stats"]["window_s"])].sum() == 2
@@ -0,0 +1,31 @@
+import numpy as np
+
+from calibration import DarkCalibration
+from camera_controller import CameraController
+from ring_buffer import RingBuffer
+from settings import ConfigStore
+
+
+def test_night_bracket_is_dark_calibrated(cfg, tmp_path):
+    cfg["camera"]["synthetic"] = True
+    cfg["night"]["exposure_us"] = 20000
+    cfg["calibration"]["dir"] = str(tmp_path)
+    store = ConfigStore(cfg)
+    calibration = DarkCalibration(cfg["calibration"])
+    cam = CameraController(store, RingBuffer(4), calibration=calibration)
+    cam.start_still(store.settings.night)
+
+    evs = [-1, 0, 1]
+    night = store.settings.night
+    shape = cam.capture_dark().shape
+    for ev in evs:
+        exposure = int(night.exposure_us * 2 ** ev)
+        calibration.build(lambda: np.full(shape, 10, dtype=np.uint8), 2, exposure, night.gain)
+
+    bracket = cam.capture_bracket(evs, settle_frames=3)
+
+    assert [exposure for _, exposure in bracket] == [10000, 20000, 40000]
+    assert calibration.applied == 3
+    # The night controls are back once the bracket is done
+    assert cam.cam.controls["ExposureTime"] == night.exposure_us
+    assert not calibration.missing
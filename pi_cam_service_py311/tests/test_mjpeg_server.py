@@ -0,0 +1,98 @@
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from metadata import FrameMetadata
+from mjpeg_server import ClientPacer, FrameCache, MJPEGHandler, MJPEGServer
+from ring_buffer import RingBuffer
+
+
+@pytest.fixture
+def adaptive(cfg):
+    return cfg["mjpeg_server"]["adaptive"]
+
+
+def feed(pacer, write_s, frames, server_fps=10.0):
+    for _ in range(frames):
+        pacer.update(50_000, write_s, server_fps)
+
+
+def test_slow_client_steps_down_tiers_then_fps(adaptive):
+    pacer = ClientPacer(adaptive, "test")
+    last_tier = len(adaptive["tiers"]) - 1
+
+    # Writes take 80% of the 100 ms frame interval
+    feed(pacer, 0.08, adaptive["hold_frames"] * last_tier)
+    assert pacer.tier == last_tier and pacer.fps is None
+
+    # Then fps, until the load is back under slow_load
+    feed(pacer, 0.08, adaptive["hold_frames"] * 20)
+    assert pacer.tier == last_tier
+    assert pacer.frame_fps(10.0) < 10.0
+    assert 0.08 * pacer.frame_fps(10.0) <= adaptive["slow_load"]
+
+    # A client that cannot keep up at any rate ends at min_fps
+    feed(pacer, 3.0, adaptive["hold_frames"] * 20)
+    assert pacer.frame_fps(10.0) == adaptive["min_fps"]
+
+
+def test_fast_client_gets_fps_back_before_quality(adaptive):
+    pacer = ClientPacer(adaptive, "test")
+    feed(pacer, 0.08, adaptive["hold_frames"] * 30)
+    assert pacer.fps is not None
+
+    feed(pacer, 0.001, adaptive["hold_frames"] * 30)
+    assert pacer.fps is None and pacer.tier == 0
+    assert pacer.settings() == (adaptive["tiers"][0]["quality"], adaptive["tiers"][0]["scale"])
+
+
+def test_changes_wait_for_hold_frames_unless_a_frame_overruns(adaptive):
+    pacer = ClientPacer(adaptive, "test")
+    feed(pacer, 0.08, adaptive["hold_frames"] - 1)
+    assert pacer.tier == 0
+
+    # Longer than the frame interval: steps down at once
+    pacer = ClientPacer(adaptive, "test")
+    pacer.update(50_000, 0.15, 10.0)
+    assert pacer.tier == 1
+
+
+def test_frame_cache_keeps_the_most_recent():
+    cache = FrameCache(capacity=2)
+    cache.put((1, 0, None), b"one")
+    cache.put((2, 0, None), b"two")
+    assert cache.get((1, 0, None)) == b"one"
+    cache.put((3, 0, None), b"three")
+    # 2 was the least recently used
+    assert cache.get((2, 0, None)) is None
+    assert cache.get((1, 0, None)) == b"one" and cache.get((3, 0, None)) == b"three"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_stream_waits_when_a_frame_cannot_be_encoded(monkeypatch):
+    for name in ("ring", "fps", "cache", "adaptive", "tiers", "rois"):
+        monkeypatch.setattr(MJPEGHandler, name, getattr(MJPEGHandler, name))
+    calls = []
+    monkeypatch.setattr(MJPEGHandler, "encode", lambda self, *args: calls.append(1))
+
+    ring = RingBuffer(4)
+    ring.append((np.zeros((24, 32, 3), np.uint8), FrameMetadata(frame_id=0, timestamp=time.time(), dark_score=0.0, night_mode=False)))
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    MJPEGServer(port, ring, fps=10).start()
+
+    for _ in range(50):
+        try:
+            client = socket.create_connection(("127.0.0.1", port), timeout=1)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    with client:
+        client.sendall(b"GET /stream HTTP/1.1\r\nHost: test\r\n\r\n")
+        time.sleep(1.0)
+
+    # One attempt per frame interval at 10 fps, not a busy loop
+    assert 1 <= len(calls) <= 15
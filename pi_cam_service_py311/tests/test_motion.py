@@ -0,0 +1,88 @@
+import numpy as np
+
+from camera_controller import CameraController
+from motion import MotionDetector
+from ring_buffer import RingBuffer
+from settings import ConfigStore
+
+
+def motion_cfg(cfg, **overrides):
+    motion = cfg["motion"]
+    motion.update(cooldown_s=0, end_frames=2, duplicate_keepalive_s=60)
+    motion.update(overrides)
+    return motion
+
+
+def flat(value, shape=(24, 32)):
+    return np.full(shape, value, dtype=np.float32)
+
+
+def test_start_and_end_events(cfg):
+    motion = MotionDetector(motion_cfg(cfg))
+    assert motion.update(flat(50)) is None
+
+    # Half the thumbnail changes far beyond pixel_threshold
+    moved = flat(50)
+    moved[:12] = 200
+    assert motion.update(moved) == "START"
+    assert motion.score == 0.5 and motion.active
+    assert motion.update(moved) is None
+
+    # The background keeps the old scene for a while: feed it the moved scene until quiet
+    events = [motion.update(moved) for _ in range(200)]
+    assert "END" in events and not motion.active
+    assert motion.describe()["events"] == 1
+
+
+def test_cooldown_suppresses_a_second_start(cfg):
+    motion = MotionDetector(motion_cfg(cfg, cooldown_s=3600, end_frames=1))
+    motion.update(flat(50))
+    moved = flat(50)
+    moved[:12] = 200
+    assert motion.update(moved) == "START"
+    assert motion.update(flat(50)) in (None, "END")
+    motion.update(flat(50))
+    assert not motion.active
+    assert motion.update(moved) is None
+
+
+def test_near_duplicates_are_skipped_only_when_enabled(cfg):
+    motion = MotionDetector(motion_cfg(cfg, skip_duplicate_frames=False))
+    motion.update(flat(50))
+    motion.update(flat(50.5))
+    assert motion.duplicate and not motion.skip_frame()
+
+    motion = MotionDetector(motion_cfg(cfg, skip_duplicate_frames=True))
+    motion.update(flat(50))
+    motion.update(flat(50.5))
+    assert motion.skip_frame()
+    motion.update(flat(80))
+    assert not motion.skip_frame()
+    assert motion.describe()["skipped_frames"] == 1
+
+
+def test_keepalive_keeps_one_duplicate(cfg):
+    motion = MotionDetector(motion_cfg(cfg, skip_duplicate_frames=True, duplicate_keepalive_s=0))
+    motion.update(flat(50))
+    motion.update(flat(50))
+    assert not motion.skip_frame()
+
+
+def test_skipped_frame_is_still_the_last_capture(cfg):
+    cfg["camera"]["synthetic"] = True
+    motion = MotionDetector(motion_cfg(cfg, skip_duplicate_frames=True))
+    ring = RingBuffer(8)
+    cam = CameraController(ConfigStore(cfg), ring, motion=motion)
+    cam.start_video()
+
+    first = cam.capture_once()
+    # The synthetic scene moves: force the next frame to be a near-duplicate
+    motion.skip_frame = lambda: True
+    second = cam.capture_once()
+
+    assert len(ring.buffer) == 1
+    assert ring.buffer[-1][1] is first
+    # The capture loop reads the skipped frame from last_frame, not the ring
+    img, meta = cam.last_frame
+    assert meta is second and meta.frame_id == first.frame_id + 1
+    assert img.shape == ring.buffer[-1][0].shape
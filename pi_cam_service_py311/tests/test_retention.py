@@ -0,0 +1,76 @@
+import os
+import time
+
+from exporter import Exporter
+from retention import RetentionIndex
+
+
+def make_file(directory, name, size, mtime=None):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_quota_evicts_in_order_and_skips_unlisted_classes(tmp_path):
+    index = RetentionIndex(str(tmp_path / "index.sqlite"), {}, max_bytes=2500, evict_order=["auto", "event"])
+    now = time.time()
+    manual = make_file(tmp_path, "manual.jpg", 1000)
+    event = make_file(tmp_path, "event.jpg", 1000)
+    auto_old = make_file(tmp_path, "auto_old.jpg", 1000)
+    auto_new = make_file(tmp_path, "auto_new.jpg", 1000)
+    # The manual file is the oldest, but its class is not in evict_order
+    index.add(manual, "manual", ts=now - 40)
+    index.add(event, "event", ts=now - 30)
+    index.add(auto_old, "auto", ts=now - 20)
+    index.add(auto_new, "auto", ts=now - 10)
+
+    assert index.enforce() == [auto_old, auto_new]
+    assert os.path.exists(manual) and os.path.exists(event)
+
+    index.max_bytes = 500
+    assert index.enforce() == [event]
+    # Over quota with only unlisted classes left: nothing more is deleted
+    assert index.enforce() == []
+    assert os.path.exists(manual)
+    assert index.describe()["bytes"] == 1000
+
+
+def test_expired_files_are_deleted_before_eviction(tmp_path):
+    index = RetentionIndex(str(tmp_path / "index.sqlite"), {"auto": 60}, max_bytes=1500, evict_order=["auto"])
+    now = time.time()
+    expired = make_file(tmp_path, "expired.jpg", 1000)
+    kept = make_file(tmp_path, "kept.jpg", 1000)
+    index.add(expired, "auto", ts=now - 120)
+    index.add(kept, "auto", ts=now - 30)
+
+    assert index.enforce(now) == [expired]
+    assert os.path.exists(kept)
+
+
+def test_adopted_files_survive_the_default_quota(cfg, tmp_path):
+    # Captures from before the index existed, together over the quota
+    old = [make_file(tmp_path, f"old_{i}.jpg", 400_000, mtime=time.time() - 3600 * (i + 1)) for i in range(3)]
+    export_cfg = cfg["export"]
+    export_cfg.update(base_dir=str(tmp_path), async_write=False)
+    export_cfg["retention"]["max_bytes_mb"] = 1
+
+    exporter = Exporter(export_cfg)
+    assert exporter.retention.describe()["classes"]["adopted"]["files"] == 3
+    assert exporter.retention.enforce() == []
+    assert all(os.path.exists(path) for path in old)
+
+
+def test_adopted_files_are_evicted_when_opted_in(cfg, tmp_path):
+    old = [make_file(tmp_path, f"old_{i}.jpg", 400_000, mtime=time.time() - 3600 * (i + 1)) for i in range(3)]
+    export_cfg = cfg["export"]
+    export_cfg.update(base_dir=str(tmp_path), async_write=False)
+    export_cfg["retention"]["max_bytes_mb"] = 1
+    export_cfg["retention"]["evict_order"].append("adopted")
+
+    exporter = Exporter(export_cfg)
+    # Oldest first, until under the 1 MB quota
+    assert exporter.retention.enforce() == [old[2]]
+    assert os.path.exists(old[0]) and os.path.exists(old[1])
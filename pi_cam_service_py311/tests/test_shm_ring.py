@@ -0,0 +1,71 @@
+import uuid
+
+import numpy as np
+import pytest
+
+import shm_ring
+from metadata import FrameMetadata
+from shm_ring import SharedRing, SharedRingReader
+
+
+def frame(frame_id, shape):
+    img = np.full(shape, frame_id % 256, dtype=np.uint8)
+    return img, FrameMetadata(frame_id=frame_id, timestamp=1000.0 + frame_id, dark_score=float(frame_id), night_mode=False)
+
+
+@pytest.fixture
+def ring(cfg, monkeypatch):
+    # Reader and writer share this process and its resource tracker entry:
+    # the reader must not drop it before the writer unlinks the segment
+    monkeypatch.setattr(shm_ring.resource_tracker, "unregister", lambda name, rtype: None)
+    shared_cfg = cfg["ring"]["shared_memory"]
+    shared = SharedRing(f"{shared_cfg['name']}_test_{uuid.uuid4().hex[:8]}", shared_cfg["slots"], 24 * 32 * 3)
+    yield shared
+    shared.close()
+
+
+def test_reader_sees_the_newest_frames(ring):
+    reader = SharedRingReader(ring.name)
+    written = ring.slots + 2
+    for i in range(written):
+        ring.write(*frame(i, (24, 32, 3)))
+
+    frames = reader.get_last(written)
+    assert [meta.frame_id for _, meta in frames] == list(range(2, written))
+    img, meta = frames[-1]
+    assert img.shape == (24, 32, 3) and img[0, 0, 0] == written - 1
+    assert reader.still_valid(meta)
+
+    # Overwritten under the reader: the seqlock tells
+    first = frames[0][1]
+    ring.write(*frame(written, (24, 32, 3)))
+    assert not reader.still_valid(first)
+    reader.close()
+
+
+def test_frame_too_large_for_a_slot_is_not_published(ring):
+    reader = SharedRingReader(ring.name)
+    ring.write(*frame(0, (48, 64, 3)))
+    assert reader.get_last(1) == []
+    reader.close()
+
+
+def test_reader_follows_a_resize(ring):
+    reader = SharedRingReader(ring.name)
+    ring.write(*frame(0, (24, 32, 3)))
+    held_img, held_meta = reader.get_last(1)[0]
+
+    # A larger camera resolution: the segment is replaced under the same name
+    ring.resize(48 * 64 * 3)
+    ring.write(*frame(1, (48, 64, 3)))
+
+    img, meta = reader.get_last(1)[0]
+    assert meta.frame_id == 1 and img.shape == (48, 64, 3)
+    assert reader.slot_bytes == 48 * 64 * 3
+    # A frame from the old segment stays readable but is no longer valid
+    assert held_img[0, 0, 0] == 0
+    assert not reader.still_valid(held_meta)
+    del held_img, img
+    reader._close_retired(grace_s=0)
+    assert not reader._retired
+    reader.close()
@@ -0,0 +1,152 @@
+import csv
+import glob
+import logging
+import os
+from datetime import datetime
+import cv2
+import numpy as np
+
+INDEX_FIELDS = ("timestamp", "offset", "size", "frame_id", "dark_score", "gain")
+
+
+class TimelapseWriter:
+    """
+    Appends frames to a daily timelapse as they are saved, instead of
+    rebuilding it from thousands of files later.
+
+    Each day is one "timelapse_YYYYMMDD.mjpeg" file (concatenated JPEGs,
+    playable with "ffplay -f mjpeg" or VLC, convertible with ffmpeg
+    without re-encoding) and a "timelapse_YYYYMMDD.csv" index of frame
+    timestamps, byte offsets and brightness. Appending keeps the file
+    valid at every frame, so a restart just continues it; a frame cut
+    by a crash is truncated on reopen.
+
+    Optional downscale to cfg["width"] (and "height", 0 keeps the aspect
+    ratio; frames are never scaled up) and deflicker: each frame is scaled
+    towards the running mean of dark_score, by at most max_gain.
+
+    Past days are pruned when a new day starts: older than keep_days,
+    then the oldest until the directory is under max_mb (0 = no limit).
+    """
+
+    def __init__(self, cfg: dict, directory: str | None = None) -> None:
+        self.cfg = cfg
+        self.dir = directory or cfg["dir"]
+        os.makedirs(self.dir, exist_ok=True)
+        self.day: str | None = None
+        self.video = None
+        self.index = None
+        self.frames = 0
+        self.size: tuple[int, int] | None = None
+        self.level: float | None = None     # running mean of dark_score
+
+    def _paths(self, day: str) -> tuple[str, str]:
+        base = os.path.join(self.dir, f"timelapse_{day}")
+        return base + ".mjpeg", base + ".csv"
+
+    def _prune(self, today: str) -> None:
+        days = sorted(
+            os.path.basename(path)[len("timelapse_"):-len(".mjpeg")]
+            for path in glob.glob(os.path.join(self.dir, "timelapse_*.mjpeg"))
+        )
+        past = [day for day in days if day < today]
+        sizes = {day: sum(os.path.getsize(p) for p in self._paths(day) if os.path.exists(p)) for day in days}
+        total = sum(sizes.values())
+        keep_days, max_bytes = self.cfg["keep_days"], self.cfg["max_mb"] * 1024 * 1024
+        cutoff = datetime.strptime(today, "%Y%m%d").toordinal() - keep_days
+        for day in past:
+            too_old = keep_days > 0 and datetime.strptime(day, "%Y%m%d").toordinal() < cutoff
+            if not too_old and (max_bytes <= 0 or total <= max_bytes):
+                break
+            for path in self._paths(day):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= sizes[day]
+            logging.info("Timelapse %s removed (%.1f MiB)", day, sizes[day] / (1024 * 1024))
+
+    def _open(self, day: str) -> None:
+        self.close()
+        self._prune(day)
+        video_path, index_path = self._paths(day)
+
+        # Resume: keep only the frames listed in the index
+        rows = []
+        if os.path.exists(index_path):
+            with open(index_path, newline="") as f:
+                rows = list(csv.DictReader(f))
+        end = int(rows[-1]["offset"]) + int(rows[-1]["size"]) if rows else 0
+        if os.path.exists(video_path) and os.path.getsize(video_path) != end:
+            logging.warning("Timelapse %s: truncating partial frame at %d bytes", video_path, end)
+            with open(video_path, "r+b") as f:
+                f.truncate(end)
+
+        self.video = open(video_path, "ab")
+        new_index = not rows
+        self.index = open(index_path, "a", newline="")
+        self.writer = csv.writer(self.index)
+        if new_index:
+            self.index.truncate(0)
+            self.writer.writerow(INDEX_FIELDS)
+        self.day = day
+        self.frames = len(rows)
+        self.size = None
+        if rows:
+            self.level = float(rows[-1]["dark_score"]) * float(rows[-1]["gain"])
+        logging.info("Timelapse %s: %d frames", video_path, self.frames)
+
+    def close(self) -> None:
+        if self.video is not None:
+            self.video.close()
+            self.index.close()
+            logging.info("Timelapse %s closed: %d frames", self.day, self.frames)
+        self.video = self.index = None
+        self.day = None
+
+    def _resize(self, img: np.ndarray) -> np.ndarray:
+        if self.size is None:
+            h, w = img.shape[:2]
+            width = min(self.cfg["width"] or w, w)
+            height = min(self.cfg["height"], h) if self.cfg["height"] else round(h * width / w)
+            self.size = (width, height)
+        if (img.shape[1], img.shape[0]) == self.size:
+            return img
+        return cv2.resize(img, self.size, interpolation=cv2.INTER_AREA)
+
+    def _deflicker_gain(self, dark_score: float) -> float:
+        if not self.cfg["deflicker"] or dark_score <= 0:
+            return 1.0
+        alpha = self.cfg["deflicker_alpha"]
+        self.level = dark_score if self.level is None else (1 - alpha) * self.level + alpha * dark_score
+        max_gain = self.cfg["max_gain"]
+        return min(max(self.level / dark_score, 1 / max_gain), max_gain)
+
+    def add(self, img: np.ndarray, timestamp: float, dark_score: float, frame_id: int = -1) -> bool:
+        day = datetime.fromtimestamp(timestamp).strftime("%Y%m%d")
+        if day != self.day:
+            self._open(day)
+
+        frame = self._resize(img)
+        gain = self._deflicker_gain(dark_score)
+        if abs(gain - 1.0) > 0.01:
+            frame = cv2.convertScaleAbs(frame, alpha=gain)
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.cfg["quality"]])
+        if not ok:
+            return False
+
+        data = encoded.tobytes()
+        offset = self.video.tell()
+        self.video.write(data)
+        self.video.flush()
+        # Index row after the frame: an indexed frame is always complete
+        self.writer.writerow((f"{timestamp:.3f}", offset, len(data), frame_id, f"{dark_score:.2f}", f"{gain:.3f}"))
+        self.index.flush()
+        self.frames += 1
+        return True
+
+    def describe(self) -> dict:
+        return {
+            "day": self.day,
+            "frames": self.frames,
+            "size": list(self.size) if self.size else None,
+            "level": round(self.level, 1) if self.level is not None else None,
+        }
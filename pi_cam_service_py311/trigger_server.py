@@ -1,19 +1,24 @@
+import json
+import logging
 import socket
 import threading
 from typing import Callable
-import json
 class TriggerServer(threading.Thread):
     def __init__(self, port: int, callback: Callable[[str, "socket.socket"], str]) -> None:
         super().__init__(daemon=True)
         self.port = port
         self.callback = callback
+        # Bound here so the port accepts connections as soon as start() returns
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("", self.port))
+        self.sock.listen(5)
 
     def run(self) -> None:
-        s = socket.socket()
-        s.bind(("", self.port))
-        s.listen(5)
+        s = self.sock
         while True:
             conn, _ = s.accept()
+            cmd = ""
             try:
                 cmd = conn.recv(1024).decode().strip()
                 response = self.callback(cmd, conn)
@@ -22,5 +27,12 @@ class TriggerServer(threading.Thread):
                     if not isinstance(response, str):
                         response = json.dumps(response, indent=2)
                     conn.sendall((response + "\n").encode())
+            except Exception as e:
+                # One bad command or client must not stop the trigger port
+                logging.exception("Trigger command %r failed", cmd)
+                try:
+                    conn.sendall(f"ERROR: {type(e).__name__}: {e}\n".encode())
+                except OSError:
+                    pass
             finally:
                 conn.close()